@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 # Script to send ACI faults and events to Slack or WebEx Teams.
-# Python dependencies: slackclient (1.3.2) and acitoolkit (0.4)
+# Python dependencies: aiohttp
 #
 # Configure the following variables for your setup:
 #
@@ -11,11 +11,14 @@
 # slack_bot_oauth
 # webex_teams_token
 # webex_teams_room_id
+# fabrics
 
-import acitoolkit
-from slackclient import SlackClient
-import requests
-import json
+import asyncio
+from functools import partial
+
+import modules.aci_events as aci_events
+import modules.chat as chat
+import modules.fault_cache as fault_cache
 
 # Fault Severities descriptions
 
@@ -49,98 +52,137 @@ slack_bot_oauth = 'xxxx'
 webex_teams_token = 'xxx'
 webex_teams_room_id = 'xxx'
 
-# Connection to ACI
-URL = ''
-LOGIN = ''
-PASSWORD = ''
-
-def send_msg_webex_teams(msg):
-    msg = "```\n" + msg + "\n```"
-    header = {"Authorization": "Bearer %s" % webex_teams_token,
-              "Content-Type": "application/json"}
-    data = {"roomId": webex_teams_room_id,
-            "markdown": msg}
-    res = requests.post("https://api.ciscospark.com/v1/messages/", headers=header, data=json.dumps(data), verify=True)
-
-    if res.status_code == 200:
-        print("your message was successfully posted to Webex Teams")
-    else:
-        print("failed with statusCode: %d" % res.status_code)
-        if res.status_code == 404:
-            print("please check the bot is in the room you're attempting to post to...")
-        elif res.status_code == 400:
-            print("please check the identifier of the room you're attempting to post to...")
-        elif res.status_code == 401:
-            print("please check if the access token is correct...")
+# Connection to ACI, one (APIC host, user, password) for every fabric to listen to
+fabrics = [
+    ('', '', ''),
+]
 
+# Classes subscribed on every fabric
+_EVENT_CLASSES = {'fvTenant': 'Tenant', 'fvAp': 'AppProfile', 'fvAEPg': 'EPG'}
+_FAULT_CLASS = 'faultInst'
 
-def send_msg_slack(msg):
-    slack_client = SlackClient(slack_bot_oauth)
-    msg = "```" + msg + "```"
-    slack_client.api_call("chat.postMessage", channel=slack_channel, text=msg)
+# Repeated and flapping faults are summarized in a digest sent every _FAULT_DIGEST_TIMER seconds
+_FAULT_DIGEST_TIMER = 900
 
 
-def msg_dispatcher(msg):
-    print(msg)
+def get_chat_dispatcher():
     if platform == 'slack':
-        send_msg_slack(msg)
-    elif platform == 'webex_teams':
-        send_msg_webex_teams(msg)
+        return chat.ChatDispatcher(platform, slack_bot_oauth, slack_channel)
+    return chat.ChatDispatcher(platform, webex_teams_token, webex_teams_room_id)
 
 
-def main():
-    session = acitoolkit.Session(URL, LOGIN, PASSWORD)
-    session.login()
-    subscribe_to_events(session)
-
+async def send_fault_digest(dispatcher, faults):
+    while True:
+        await asyncio.sleep(_FAULT_DIGEST_TIMER)
+        message = faults.digest()
+        if message is not None:
+            dispatcher.send(message)
+
+
+async def listen_to_fabrics():
+    dispatcher = get_chat_dispatcher()
+    faults = fault_cache.FaultCache()
+    await dispatcher.start()
+    digest = asyncio.create_task(send_fault_digest(dispatcher, faults))
+    try:
+        dispatcher.send("Listening for Events & Faults...")
+        await aci_events.watch_fabrics(fabrics, list(_EVENT_CLASSES.keys()) + [_FAULT_CLASS],
+                                       partial(handle_event, dispatcher, faults))
+    finally:
+        digest.cancel()
+        print('Fault cache: {}'.format(faults.get_stats()))
+        await dispatcher.close()
 
-def subscribe_to_events(apic_session):
-    acitoolkit.Tenant.subscribe(apic_session, only_new=True)
-    acitoolkit.AppProfile.subscribe(apic_session, only_new=True)
-    acitoolkit.EPG.subscribe(apic_session, only_new=True)
-    acitoolkit.Faults.subscribe_faults(apic_session, only_new=True)
-    msg_dispatcher("Listening for Events & Faults...")
 
-    while True:
-        if acitoolkit.Tenant.has_events(apic_session):
-            event = acitoolkit.Tenant.get_event(apic_session)
-            if event.is_deleted():
-                status = "has been deleted"
-            else:
-                status = "has been created/modified"
-            msg_dispatcher("Tenant Event: {} {}".format(event.dn, status))
-
-        elif acitoolkit.AppProfile.has_events(apic_session):
-            event = acitoolkit.AppProfile.get_event(apic_session)
-            if event.is_deleted():
-                status = "has been deleted"
-            else:
-                status = "has been created/modified"
-            msg_dispatcher("AppProfile Event: {} {}".format(event.dn, status))
-
-        elif acitoolkit.EPG.has_events(apic_session):
-            event = acitoolkit.EPG.get_event(apic_session)
-            if event.is_deleted():
-                status = "has been deleted"
-            else:
-                status = "has been created/modified"
-            msg_dispatcher("EPG Event: {} {}".format(event.dn, status))
-
-        elif acitoolkit.Faults.has_faults(apic_session):
-            fault = acitoolkit.Faults.get_faults(apic_session)
-            if fault[0] is not None and fault[0].severity in match_fault_severity:
-                message = [
-                    'System Faults:',
-                    '    Description         : ' + fault[0].descr,
-                    '    Distinguished Name  : ' + fault[0].dn,
-                    '    Rule                : ' + fault[0].rule,
-                    '    Severity            : ' + fault[0].severity,
-                    '    Type                : ' + fault[0].type,
-                    '    Domain              : ' + fault[0].domain,
-                    '    Subject             : ' + fault[0].subject,
-                    '    Cause               : ' + fault[0].cause,
-                ]
-                msg_dispatcher("\n".join(message))
+def main():
+    try:
+        asyncio.run(listen_to_fabrics())
+    except KeyboardInterrupt:
+        print('\nStopped listening')
+
+
+def get_fault_message(host, fault):
+    # Modified faults only carry the attributes that changed
+    if fault.get('severity') not in match_fault_severity:
+        return None
+
+    message = [
+        'System Faults:',
+        '    Fabric              : ' + host,
+        '    Description         : ' + fault.get('descr', ''),
+        '    Distinguished Name  : ' + fault['dn'],
+        '    Rule                : ' + fault.get('rule', ''),
+        '    Severity            : ' + fault['severity'],
+        '    Type                : ' + fault.get('type', ''),
+        '    Domain              : ' + fault.get('domain', ''),
+        '    Subject             : ' + fault.get('subject', ''),
+        '    Cause               : ' + fault.get('cause', ''),
+    ]
+    return "\n".join(message)
+
+
+def get_event_message(host, class_name, event):
+    if event.get('status') == 'deleted':
+        status = "has been deleted"
+    else:
+        status = "has been created/modified"
+    return "{} Event: {} {} ({})".format(_EVENT_CLASSES[class_name], event['dn'], status, host)
+
+
+def get_cleared_message(host, fault, raised_severity):
+    message = [
+        'Fault Cleared:',
+        '    Fabric              : ' + host,
+        '    Distinguished Name  : ' + fault['dn'],
+        '    Rule                : ' + fault.get('rule', ''),
+        '    Severity            : cleared (was ' + raised_severity + ')',
+    ]
+    return "\n".join(message)
+
+
+def get_flapping_message(host, fault):
+    message = [
+        'Fault Flapping:',
+        '    Fabric              : ' + host,
+        '    Distinguished Name  : ' + fault['dn'],
+        '    Rule                : ' + fault.get('rule', ''),
+        '    Repeats are suppressed until it is stable, check the fault digest',
+    ]
+    return "\n".join(message)
+
+
+async def handle_event(dispatcher, faults, host, class_name, attributes):
+    # Bursts of messages on the same dn prefix are sent as one summary by the dispatcher
+    if class_name == _FAULT_CLASS:
+        if attributes.get('status') == 'deleted':
+            severity = 'cleared'
+        else:
+            severity = attributes.get('severity')
+        if severity is None:  # modified without a severity change
+            return
+
+        # Only the faults of the severities matched go through the cache, and their clears to detect the
+        # flapping faults. The others must not be reported flapping nor fill the digest.
+        fault_key = '{}:{}'.format(host, attributes['dn'])
+        if severity == 'cleared':
+            if not faults.is_raised(fault_key) or faults.get_raised_severity(fault_key) not in match_fault_severity:
+                return
+        elif severity not in match_fault_severity:
+            return
+
+        action = faults.observe(fault_key, attributes.get('rule', ''), severity)
+        if action == fault_cache.FLAPPING:
+            dispatcher.send(get_flapping_message(host, attributes))
+        elif action == fault_cache.CLEARED:
+            dispatcher.notify('faults', attributes['dn'],
+                              get_cleared_message(host, attributes, faults.get_raised_severity(fault_key)))
+        elif action == fault_cache.SEND:
+            message = get_fault_message(host, attributes)
+            if message is not None:
+                dispatcher.notify('faults', attributes['dn'], message)
+    else:
+        dispatcher.notify('{} events'.format(_EVENT_CLASSES[class_name]), attributes['dn'],
+                          get_event_message(host, class_name, attributes))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Writes a synthetic ACI tenant, shaped like the APIC answer to the tenant query of aci.get_tenant_path
+# (fvTenant with rsp-subtree=full and config-only), for the benchmarks.
+# The same arguments and seed always give the same tenant.
+
+import argparse
+import json
+import random
+import sys
+
+# Counts of a scale 1 tenant, every count is multiplied by the scale except the per object ones
+_BASE_APP_PROFILES = 5
+_BASE_CONTRACTS = 40
+_BASE_FILTERS = 40
+_EPGS_PER_APP_PROFILE = 10
+_SUBJECTS_PER_CONTRACT = 2
+_ENTRIES_PER_FILTER = 3
+_CONSUMED_PER_EPG = 3
+_PROVIDED_PER_EPG = 2
+_SKIPPED_EPG_RATIO = 0.1  # EPGs named -BD or VLAN, skipped by the OCI export
+
+_PROTOCOLS = ['tcp', 'tcp', 'tcp', 'udp', 'udp', 'icmp', 'unspecified']
+_NAMED_PORTS = ['http', 'https', 'ssh', 'dns', 'ftpData', 'smtp']
+
+
+def get_tenant_counts(scale, epgs_per_app_profile=_EPGS_PER_APP_PROFILE,
+                      subjects_per_contract=_SUBJECTS_PER_CONTRACT, entries_per_filter=_ENTRIES_PER_FILTER,
+                      consumed_per_epg=_CONSUMED_PER_EPG, provided_per_epg=_PROVIDED_PER_EPG):
+    # Contracts grow with the EPGs, so the providers and consumers of a contract stay the same at any scale
+    return {'app_profiles': max(1, round(_BASE_APP_PROFILES * scale)),
+            'epgs_per_app_profile': epgs_per_app_profile,
+            'contracts': max(1, round(_BASE_CONTRACTS * scale)),
+            'subjects_per_contract': subjects_per_contract,
+            'filters': max(1, round(_BASE_FILTERS * scale)),
+            'entries_per_filter': entries_per_filter,
+            'consumed_per_epg': consumed_per_epg,
+            'provided_per_epg': provided_per_epg}
+
+
+def get_port(rnd):
+    choice = rnd.random()
+    if choice < 0.2:
+        return 'unspecified', 'unspecified'
+    elif choice < 0.5:
+        port = rnd.choice(_NAMED_PORTS)
+        return port, port
+    elif choice < 0.8:
+        port = str(rnd.randint(1024, 49151))
+        return port, port
+    from_port = rnd.randint(1024, 40000)
+    return str(from_port), str(from_port + rnd.randint(1, 1000))
+
+
+def make_filter(rnd, filter_number, entries_per_filter):
+    entries = []
+    for entry_number in range(entries_per_filter):
+        protocol = rnd.choice(_PROTOCOLS)
+        from_port, to_port = get_port(rnd) if protocol in ('tcp', 'udp') else ('unspecified', 'unspecified')
+        entries.append({'vzEntry': {'attributes': {
+            'name': 'entry-{}'.format(entry_number), 'etherT': 'ip', 'prot': protocol,
+            'dFromPort': from_port, 'dToPort': to_port, 'sFromPort': 'unspecified', 'sToPort': 'unspecified',
+            'stateful': rnd.choice(['yes', 'no'])}}})
+    return {'vzFilter': {'attributes': {'name': 'flt-{}'.format(filter_number)}, 'children': entries}}
+
+
+def make_contract(rnd, contract_number, counts):
+    subjects = []
+    for subject_number in range(counts['subjects_per_contract']):
+        filter_name = 'flt-{}'.format(rnd.randrange(counts['filters']))
+        if rnd.random() < 0.2:  # filters applied in each direction
+            subject_children = [
+                {'vzInTerm': {'attributes': {}, 'children': [{'vzRsFiltAtt': {'attributes': {
+                    'action': 'permit', 'tnVzFilterName': filter_name}}}]}},
+                {'vzOutTerm': {'attributes': {}, 'children': [{'vzRsFiltAtt': {'attributes': {
+                    'action': 'permit', 'tnVzFilterName': 'flt-{}'.format(rnd.randrange(counts['filters']))}}}]}}]
+        else:
+            subject_children = [{'vzRsSubjFiltAtt': {'attributes': {'action': 'permit',
+                                                                    'tnVzFilterName': filter_name}}}]
+        subjects.append({'vzSubj': {'attributes': {'name': 'subj-{}'.format(subject_number), 'revFltPorts': 'yes'},
+                                    'children': subject_children}})
+    return {'vzBrCP': {'attributes': {'name': 'con-{}'.format(contract_number), 'scope': 'context'},
+                       'children': subjects}}
+
+
+def make_app_profile(rnd, app_profile_number, counts):
+    epgs = []
+    for epg_number in range(counts['epgs_per_app_profile']):
+        epg_name = 'epg-{}'.format(epg_number)
+        if rnd.random() < _SKIPPED_EPG_RATIO:
+            epg_name += rnd.choice(['-BD', '-VLAN'])
+        epg_children = [{'fvRsBd': {'attributes': {'tnFvBDName': 'bd-{}'.format(app_profile_number)}}}]
+        epg_children += [{'fvRsCons': {'attributes': {'tnVzBrCPName': 'con-{}'.format(rnd.randrange(counts['contracts']))}}}
+                         for _ in range(counts['consumed_per_epg'])]
+        epg_children += [{'fvRsProv': {'attributes': {'tnVzBrCPName': 'con-{}'.format(rnd.randrange(counts['contracts']))}}}
+                         for _ in range(counts['provided_per_epg'])]
+        epgs.append({'fvAEPg': {'attributes': {'name': epg_name}, 'children': epg_children}})
+    return {'fvAp': {'attributes': {'name': 'ap-{}'.format(app_profile_number)}, 'children': epgs}}
+
+
+def iter_tenant_children(counts, seed):
+    rnd = random.Random(seed)
+    yield {'fvCtx': {'attributes': {'name': 'vrf-1'}}}
+    for app_profile_number in range(counts['app_profiles']):
+        yield {'fvBD': {'attributes': {'name': 'bd-{}'.format(app_profile_number)},
+                        'children': [{'fvRsCtx': {'attributes': {'tnFvCtxName': 'vrf-1'}}}]}}
+    for filter_number in range(counts['filters']):
+        yield make_filter(rnd, filter_number, counts['entries_per_filter'])
+    for contract_number in range(counts['contracts']):
+        yield make_contract(rnd, contract_number, counts)
+    for app_profile_number in range(counts['app_profiles']):
+        yield make_app_profile(rnd, app_profile_number, counts)
+
+
+def write_tenant(file_write, counts, tenant_name='bench', seed=1):
+    # Written child by child, so big tenants don't have to fit in memory
+    file_write.write('{"totalCount": "1", "imdata": [{"fvTenant": {"attributes": ')
+    file_write.write(json.dumps({'dn': 'uni/tn-{}'.format(tenant_name), 'name': tenant_name}))
+    file_write.write(', "children": [')
+    for child_number, t_child in enumerate(iter_tenant_children(counts, seed)):
+        if child_number != 0:
+            file_write.write(', ')
+        file_write.write(json.dumps(t_child))
+    file_write.write(']}}]}')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Write a synthetic ACI tenant in the APIC JSON format.')
+    parser.add_argument('output', help='file to write, - for stdout')
+    parser.add_argument('--scale', type=float, default=1, help='multiplies the APs, contracts and filters')
+    parser.add_argument('--epgs-per-ap', type=int, default=_EPGS_PER_APP_PROFILE)
+    parser.add_argument('--subjects-per-contract', type=int, default=_SUBJECTS_PER_CONTRACT)
+    parser.add_argument('--entries-per-filter', type=int, default=_ENTRIES_PER_FILTER)
+    parser.add_argument('--consumed-per-epg', type=int, default=_CONSUMED_PER_EPG)
+    parser.add_argument('--provided-per-epg', type=int, default=_PROVIDED_PER_EPG)
+    parser.add_argument('--tenant', default='bench', help='tenant name')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    counts = get_tenant_counts(args.scale, args.epgs_per_ap, args.subjects_per_contract, args.entries_per_filter,
+                               args.consumed_per_epg, args.provided_per_epg)
+    if args.output == '-':
+        write_tenant(sys.stdout, counts, args.tenant, args.seed)
+    else:
+        with open(args.output, 'w') as file_write:
+            write_tenant(file_write, counts, args.tenant, args.seed)
+        print('Tenant {} written to {}: {}'.format(args.tenant, args.output, counts), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
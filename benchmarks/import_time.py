@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Import time of the scripts, measured with python -X importtime in a new interpreter, checked against
+# a budget. The heavy dependencies must only be imported by the code paths using them, so importing a
+# script must not import any of _LAZY_MODULES. Exits with 1 when a script is over its budget.
+# tests/test_import_time.py only checks the imports, the time depends too much on the machine load.
+
+import argparse
+import os
+import subprocess
+import sys
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SCRIPT_BUDGETS = {  # milliseconds of the import of the script, the interpreter startup is not counted
+    'getTenantExportEpgSecurity': 40,
+    'getTenantExportToOCI': 60,
+    'duplicateTenant': 40,
+    'aci_to_chat': 60,
+}
+_LAZY_MODULES = ['requests', 'urllib3', 'xlsxwriter', 'pyarrow', 'aiohttp', 'asyncio', 'multiprocessing']
+_SCRIPT_EAGER_MODULES = {  # lazy modules a script is built on
+    'aci_to_chat': ['asyncio'],
+}
+_REPEAT = 5
+
+
+def get_import_times(module_name):
+    # {module: cumulative microseconds} of a python -X importtime run importing module_name
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module_name], cwd=_REPO_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative_time, imported_name = line[len('import time:'):].split('|')
+        import_times[imported_name.strip()] = int(cumulative_time)
+    return import_times
+
+
+def check_script(module_name, repeat):
+    # Returns the best import time in milliseconds and the lazy modules imported
+    best_ms = None
+    for _ in range(repeat):
+        import_times = get_import_times(module_name)
+        import_ms = import_times[module_name] / 1000
+        best_ms = import_ms if best_ms is None else min(best_ms, import_ms)
+    lazy_imported = [lazy_module for lazy_module in _LAZY_MODULES if lazy_module in import_times.keys()
+                     and lazy_module not in _SCRIPT_EAGER_MODULES.get(module_name, [])]
+    return best_ms, lazy_imported
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Check the import time of the scripts against their budget.')
+    parser.add_argument('--repeat', type=int, default=_REPEAT, help='imports of every script, the best is kept')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    failed = False
+    print('{:<30} {:>10} {:>10}  {}\n{}'.format('Script', 'Import ms', 'Budget ms', 'Status', '=' * 70))
+    for module_name, budget_ms in _SCRIPT_BUDGETS.items():
+        import_ms, lazy_imported = check_script(module_name, args.repeat)
+        status = 'OK'
+        if import_ms > budget_ms:
+            status = 'over budget'
+        if len(lazy_imported) != 0:
+            status = 'imports ' + ', '.join(lazy_imported)
+        failed = failed or status != 'OK'
+        print('{:<30} {:>10.1f} {:>10}  {}'.format(module_name, import_ms, budget_ms, status))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+# Rule by rule translation of the contracts to NSG rules, the translation of modules/oci.py before the
+# columnar RuleExpansion. Kept as the reference the columnar translation is tested and timed against.
+
+import modules.aci as aci
+import modules.model as model
+import modules.oci as oci
+import modules.perf as perf
+
+
+@perf.timed('oci_by_rule.add_tcp_udp_rule')
+def add_tcp_udp_rule(aci_filter_entry, oci_nsg_full_dict, oci_display_name, current_oci_nsg_id, ocid_other_nsg_end_id,
+                     oci_direction, oci_nsg_rule_type):
+
+    if aci_filter_entry.protocol is model.Protocol.TCP:
+        protocol = '6'  # TCP
+        options = 'tcp_options'
+    else:
+        protocol = '17'  # UDP
+        options = 'udp_options'
+
+    if oci_direction == 'INGRESS':
+        direction = 'source'
+        direction_type = 'source_type'
+    else:
+        direction = 'destination'
+        direction_type = 'destination_type'
+
+    stateless = 'false' if aci_filter_entry.stateful == 'yes' else 'true'
+    min_p, max_p = oci.identify_port_number(aci_filter_entry)
+
+    if oci_display_name not in oci_nsg_full_dict.keys():
+        oci_nsg_full_dict[oci_display_name] = {'resources': []}
+
+    if ocid_other_nsg_end_id == 'ANY':
+        src_dst = '0.0.0.0/0'
+    else:
+        src_dst = ocid_other_nsg_end_id
+
+    oci_nsg_full_dict[oci_display_name]['resources'].append(
+        {
+            'network_security_group_id': current_oci_nsg_id,
+            'direction': oci_direction,
+            'protocol': protocol,
+            options: {"destination_port_range": {
+                "min": min_p,
+                "max": max_p
+            }
+            },
+            direction: src_dst,
+            'stateless': stateless,
+            direction_type: oci_nsg_rule_type
+        }
+    )
+
+
+@perf.timed('oci_by_rule.add_icmp_rule')
+def add_icmp_rule(aci_filter_entry, oci_nsg_full_dict, oci_display_name, current_oci_nsg_id, ocid_other_nsg_end_id,
+                  oci_direction, oci_nsg_rule_type):
+    protocol = '1'
+    stateless = 'false' if aci_filter_entry.stateful == 'yes' else 'true'
+
+    if oci_direction == 'INGRESS':
+        direction = 'source'
+        direction_type = 'source_type'
+    else:
+        direction = 'destination'
+        direction_type = 'destination_type'
+
+    if ocid_other_nsg_end_id == 'ANY':
+        src_dst = '0.0.0.0/0'
+    else:
+        src_dst = ocid_other_nsg_end_id
+
+    if oci_display_name not in oci_nsg_full_dict.keys():
+        oci_nsg_full_dict[oci_display_name] = {'resources': []}
+
+    oci_nsg_full_dict[oci_display_name]['resources'].append(
+        {
+            'network_security_group_id': current_oci_nsg_id,
+            'direction': oci_direction,
+            'protocol': protocol,
+            direction: src_dst,
+            'stateless': stateless,
+            direction_type: oci_nsg_rule_type
+        }
+    )
+
+
+@perf.timed('oci_by_rule.add_all_protocols_rule')
+def add_all_protocols_rule(aci_filter_entry, oci_nsg_full_dict, oci_display_name, current_oci_nsg_id,
+                           ocid_other_nsg_end_id, oci_direction, oci_nsg_rule_type):
+    protocol = 'all'
+    stateless = 'false' if aci_filter_entry.stateful == 'yes' else 'true'
+
+    if oci_direction == 'INGRESS':
+        direction = 'source'
+        direction_type = 'source_type'
+    else:
+        direction = 'destination'
+        direction_type = 'destination_type'
+
+    if oci_display_name not in oci_nsg_full_dict.keys():
+        oci_nsg_full_dict[oci_display_name] = {'resources': []}
+
+    oci_nsg_full_dict[oci_display_name]['resources'].append(
+        {
+            'network_security_group_id': current_oci_nsg_id,
+            'direction': oci_direction,
+            'protocol': protocol,
+            direction: ocid_other_nsg_end_id,
+            'stateless': stateless,
+            direction_type: oci_nsg_rule_type
+        }
+    )
+
+
+@perf.timed('oci_by_rule.build_add_rule')
+def build_add_rule(aci_filter_entry, aci_source_epg, aci_other_end_epg, aci_consumed_contract_name, aci_filter_name,
+                   oci_full_nsg_dict, oci_nsg_display_name, current_oci_nsg_id, ocid_other_nsg_end_id, oci_direction,
+                   oci_nsg_rule_type):
+
+    if aci_other_end_epg == 'ANY':
+        src_dst = '0.0.0.0/0'
+        ocid_src_dst = '0.0.0.0/0'
+    else:
+        src_dst = aci_other_end_epg
+        ocid_src_dst = ocid_other_nsg_end_id
+
+    if aci_filter_entry.protocol is model.Protocol.TCP or aci_filter_entry.protocol is model.Protocol.UDP:
+        add_tcp_udp_rule(aci_filter_entry, oci_full_nsg_dict, oci_nsg_display_name,
+                         current_oci_nsg_id, ocid_src_dst, oci_direction, oci_nsg_rule_type)
+
+    elif aci_filter_entry.protocol is model.Protocol.ICMP:
+        add_icmp_rule(aci_filter_entry, oci_full_nsg_dict, oci_nsg_display_name,
+                      current_oci_nsg_id, ocid_src_dst, oci_direction, oci_nsg_rule_type)
+
+    elif aci_filter_entry.protocol is model.Protocol.UNSPECIFIED:
+        add_all_protocols_rule(aci_filter_entry, oci_full_nsg_dict,
+                               oci_nsg_display_name, current_oci_nsg_id,
+                               ocid_src_dst, oci_direction, oci_nsg_rule_type)
+
+    else:
+        oci.print_skipped_rule(aci_filter_entry, aci_source_epg, src_dst, aci_consumed_contract_name,
+                               aci_filter_name, oci_direction)
+
+
+@perf.timed('oci_by_rule.export_to_oci_format')
+def export_to_oci_format(aci_full_aep_list, aci_full_contracts_dict, aci_full_filters_dict,
+                         _default_permit_all_egress_and_icmp_in, _acronysm_to_skip_in_epg_name,
+                         aci_contract_index=None, only_nsgs=None):
+    if aci_contract_index is None:
+        aci_contract_index = aci.build_contract_index(aci_full_aep_list, _acronysm_to_skip_in_epg_name)
+
+    oci_full_nsg_dict = {}
+    for aci_aep in aci_full_aep_list:
+        for aci_epg in aci_aep.epgs:
+            if aci.skip_aci_epg_name(aci_epg.name, _acronysm_to_skip_in_epg_name):
+                continue
+            elif only_nsgs is not None and aci_aep.name + "-" + aci_epg.name not in only_nsgs:
+                continue
+            else:
+                aci_source_epg = aci_epg.name
+                oci_nsg_display_name = aci_aep.name + "-" + aci_source_epg
+
+                if _default_permit_all_egress_and_icmp_in:
+                    destination = 'ANY'
+                    aci_filter_entry = oci._PERMIT_ALL_ENTRY
+                    aci_consumed_contract_name = None
+                    filter_name = None
+                    oci_nsg_rule_type = 'CIDR_BLOCK'
+
+                    current_oci_nsg_id = "${oci_core_network_security_group." \
+                                         "aci_exported_nsg_" + oci_nsg_display_name + ".id}"
+                    ocid_destination = "${oci_core_network_security_group." \
+                                       "aci_exported_nsg_" + destination + ".id}"
+
+                    oci_direction = 'EGRESS'
+
+                    build_add_rule(aci_filter_entry, aci_source_epg, destination,
+                                   aci_consumed_contract_name, filter_name, oci_full_nsg_dict,
+                                   oci_nsg_display_name, current_oci_nsg_id, ocid_destination,
+                                   oci_direction, oci_nsg_rule_type)
+
+                    source = 'ANY'
+                    oci_direction = 'INGRESS'
+                    aci_filter_entry = oci._PERMIT_ICMP_ENTRY
+
+                    build_add_rule(aci_filter_entry, aci_source_epg, source,
+                                   aci_consumed_contract_name, filter_name, oci_full_nsg_dict,
+                                   oci_nsg_display_name, current_oci_nsg_id, ocid_destination,
+                                   oci_direction, oci_nsg_rule_type)
+
+                else:
+                    for aci_consumed_contract_name in aci_epg.consumed:
+                        if aci_consumed_contract_name not in aci_full_contracts_dict.keys():
+                            print('\nWARNING: Skipping rule. Missing contract: ' + aci_consumed_contract_name)
+                            print('EPG Consumer: ' + aci_source_epg)
+
+                        else:
+                            aci_all_providers = aci.get_indexed_providers(aci_contract_index,
+                                                                          aci_consumed_contract_name)
+
+                            for aci_subject in aci_full_contracts_dict[aci_consumed_contract_name].subjects:
+                                aci_filter_list = aci.get_filter(aci_full_filters_dict, aci_subject.filter_name)
+
+                                for aci_filter_entry in aci_filter_list:
+
+                                    if len(aci_all_providers) != 0:
+                                        if oci_nsg_display_name not in oci_full_nsg_dict.keys():
+                                            oci_full_nsg_dict[oci_nsg_display_name] = {'resources': []}
+
+                                        for aci_provider in aci_all_providers:
+                                            current_oci_nsg_id = "${oci_core_network_security_group." \
+                                                                 "aci_exported_nsg_" + oci_nsg_display_name + ".id}"
+                                            ocid_destination = "${oci_core_network_security_group." \
+                                                               "aci_exported_nsg_" + aci_provider + ".id}"
+                                            oci_direction = 'EGRESS'
+                                            oci_nsg_rule_type = 'NETWORK_SECURITY_GROUP'
+
+                                            build_add_rule(aci_filter_entry, aci_source_epg, aci_provider,
+                                                           aci_consumed_contract_name, aci_subject.filter_name,
+                                                           oci_full_nsg_dict,
+                                                           oci_nsg_display_name, current_oci_nsg_id, ocid_destination,
+                                                           oci_direction, oci_nsg_rule_type)
+
+                                    else:
+                                        print('\nWARNING: Skipping rule. No providers'
+                                              ' for contract: ' + aci_consumed_contract_name)
+                                        print('EPG Consumer: ' + aci_source_epg)
+
+                for aci_provided_contract_name in aci_epg.provided:
+                    if aci_provided_contract_name not in aci_full_contracts_dict.keys():
+                        print('\nWARNING: Skipping rule. Missing contract: ' + aci_provided_contract_name)
+                        print('EPG Provider: ' + aci_source_epg)
+
+                    else:
+                        aci_consumers = aci.get_indexed_consumers(aci_contract_index, aci_provided_contract_name)
+
+                        for aci_subject in aci_full_contracts_dict[aci_provided_contract_name].subjects:
+                            aci_filter_list = aci.get_filter(aci_full_filters_dict, aci_subject.filter_name)
+
+                            for aci_filter_entry in aci_filter_list:
+
+                                if len(aci_consumers) != 0:
+                                    if oci_nsg_display_name not in oci_full_nsg_dict.keys():
+                                        oci_full_nsg_dict[oci_nsg_display_name] = {'resources': []}
+
+                                    for aci_consumer in aci_consumers:
+                                        current_oci_nsg_id = "${oci_core_network_security_group." \
+                                                             "aci_exported_nsg_" + oci_nsg_display_name + ".id}"
+                                        ocid_destination = "${oci_core_network_security_group." \
+                                                           "aci_exported_nsg_" + aci_consumer + ".id}"
+                                        oci_direction = 'INGRESS'
+                                        oci_nsg_rule_type = 'NETWORK_SECURITY_GROUP'
+
+                                        build_add_rule(aci_filter_entry, aci_source_epg, aci_consumer,
+                                                       aci_provided_contract_name, aci_subject.filter_name,
+                                                       oci_full_nsg_dict,
+                                                       oci_nsg_display_name, current_oci_nsg_id, ocid_destination,
+                                                       oci_direction, oci_nsg_rule_type)
+
+                                else:
+                                    print('\nWARNING: Skipping rule. No consumer for '
+                                          'contract: ' + aci_provided_contract_name)
+                                    print('EPG Provider: ' + aci_source_epg)
+
+    if perf.enabled:
+        perf.count('oci.rules_emitted', sum(len(resources['resources']) for resources in oci_full_nsg_dict.values()))
+        perf.count('oci.nsgs', len(oci_full_nsg_dict))
+    return oci_full_nsg_dict
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+# Times the extraction, translation and export stages over synthetic tenants of growing scale
+# (benchmarks/generate_tenant.py), with the peak memory of every stage traced by tracemalloc.
+# The results can be saved and used as the baseline of a later run, to catch scaling regressions.
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.aci as aci
+import modules.oci as oci
+import getTenantExportEpgSecurity as epg_security
+import generate_tenant
+import oci_by_rule
+
+_SCALES = [1, 10, 100]  # 1000 takes several minutes and GBs of memory, add it with --scales
+_REPEAT = 3
+_TOLERANCE = 1.5  # times slower than the baseline to report a regression
+_MIN_COMPARED_SECONDS = 0.05  # faster stages are too noisy to compare with the baseline
+_NSG_OVER_ALLOWED_RULES = 121
+_DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN = True
+_ACRONYSM_TO_SKIP_IN_EPG_NAME = ['-BD', 'VLAN']
+
+
+class Stages:
+    # Every stage takes the outputs of the stages before it, the outputs of the last run are kept
+    def __init__(self, tenant_file, work_dir, reference):
+        self.tenant_file = tenant_file
+        self.work_dir = work_dir
+        self.run_number = 0
+        self.tenant_data = None
+        self.contract_index = None
+        self.oci_dict = None
+        self.stages = [('extract_data', self.extract_data),
+                       ('extract_data_from_stream', self.extract_data_from_stream),
+                       ('build_contract_index', self.build_contract_index),
+                       ('export_to_oci_format', self.export_to_oci_format)]
+        if reference:
+            self.stages.append(('export_to_oci_format_by_rule', self.export_to_oci_format_by_rule))
+        self.stages += [('save_oci_files', self.save_oci_files),
+                        ('export_to_xlsx', self.export_to_xlsx),
+                        ('nice_print_contracts', self.nice_print_contracts),
+                        ('nice_print_aepg', self.nice_print_aepg)]
+
+    def get_work_file(self, name):
+        # A new file or directory every run, so nothing is reused from the run before
+        self.run_number += 1
+        return os.path.join(self.work_dir, '{}-{}'.format(name, self.run_number))
+
+    def extract_data(self):
+        with open(self.tenant_file) as file_read:
+            self.tenant_data = aci.extract_data(json.load(file_read))
+
+    def extract_data_from_stream(self):
+        with open(self.tenant_file, 'rb') as file_read:
+            self.tenant_data = aci.extract_data_from_stream(file_read)
+
+    def build_contract_index(self):
+        self.contract_index = aci.build_contract_index(self.tenant_data[0], _ACRONYSM_TO_SKIP_IN_EPG_NAME)
+
+    def export_to_oci_format(self):
+        self.oci_dict = oci.export_to_oci_format(self.tenant_data[0], self.tenant_data[3], self.tenant_data[5],
+                                                 _DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN,
+                                                 _ACRONYSM_TO_SKIP_IN_EPG_NAME, self.contract_index)
+
+    def export_to_oci_format_by_rule(self):
+        oci_by_rule.export_to_oci_format(self.tenant_data[0], self.tenant_data[3], self.tenant_data[5],
+                                         _DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN, _ACRONYSM_TO_SKIP_IN_EPG_NAME,
+                                         self.contract_index)
+
+    def save_oci_files(self):
+        export_dir = self.get_work_file('export-OCI') + '/'
+        oci.save_oci_files(self.oci_dict, export_dir, _NSG_OVER_ALLOWED_RULES)
+        shutil.rmtree(export_dir)
+
+    def export_to_xlsx(self):
+        export_file = self.get_work_file('export') + '.xlsx'
+        epg_security.export_to_xlsx(export_file, self.tenant_data[0], self.tenant_data[3], self.tenant_data[5])
+        os.remove(export_file)
+
+    def nice_print_contracts(self):
+        epg_security.nice_print_contracts(self.tenant_data[3], self.tenant_data[5])
+
+    def nice_print_aepg(self):
+        epg_security.nice_print_aepg(self.tenant_data[0])
+
+    def get_tenant_size(self):
+        full_aep, num_aepg, num_epg, full_contract, num_con, full_filter, num_fil = self.tenant_data
+        return {'epgs': num_epg, 'contracts': num_con, 'filters': num_fil,
+                'rules': sum(len(resources['resources']) for resources in self.oci_dict.values())}
+
+
+def time_stage(stage, repeat):
+    # Best of repeat runs, the prints of the stage are dropped
+    times = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            gc.collect()
+            timer_stage = perf_counter()
+            stage()
+            times.append(perf_counter() - timer_stage)
+    return min(times)
+
+
+def trace_stage_memory(stage):
+    # Run apart from the timed runs, tracemalloc makes the code several times slower
+    gc.collect()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        tracemalloc.start()
+        try:
+            stage()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def run_scale(scale, work_dir, repeat, trace_memory, reference):
+    tenant_file = os.path.join(work_dir, 'tenant-{:g}.json'.format(scale))
+    with open(tenant_file, 'w') as file_write:
+        generate_tenant.write_tenant(file_write, generate_tenant.get_tenant_counts(scale))
+
+    stages = Stages(tenant_file, work_dir, reference)
+    results = {}
+    for stage_name, stage in stages.stages:
+        seconds = time_stage(stage, repeat)
+        peak_mb = trace_stage_memory(stage) if trace_memory else None
+        results[stage_name] = {'seconds': seconds, 'peak_mb': peak_mb}
+        print_stage(scale, stage_name, seconds, peak_mb)
+
+    size = stages.get_tenant_size()
+    size['file_mb'] = os.path.getsize(tenant_file) / (1024 * 1024)
+    print('{:>6}  {}\n'.format('', ', '.join('{}: {:,.0f}'.format(key, value) for key, value in size.items())))
+    os.remove(tenant_file)
+    return {'scale': scale, 'size': size, 'stages': results}
+
+
+def print_stage(scale, stage_name, seconds, peak_mb):
+    peak_text = 'n/a' if peak_mb is None else '{:0.1f}'.format(peak_mb)
+    print('{:>6g}  {:<30} {:>10.4f} {:>12}'.format(scale, stage_name, seconds, peak_text))
+
+
+def nice_print_scaling(runs):
+    # 1.0 is linear: the time grows as much as the tenant does
+    print('\nTime growth over the tenant growth, from the previous scale\n' + '=' * 60)
+    for previous_run, run in zip(runs, runs[1:]):
+        growth = run['scale'] / previous_run['scale']
+        for stage_name, result in run['stages'].items():
+            previous_seconds = previous_run['stages'][stage_name]['seconds']
+            if previous_seconds > 0:
+                print('{:>6g}  {:<30} {:>10.2f}'.format(run['scale'], stage_name,
+                                                      result['seconds'] / previous_seconds / growth))
+
+
+def compare_with_baseline(runs, baseline_file, tolerance):
+    # Returns the stages slower than tolerance times the baseline
+    with open(baseline_file) as file_read:
+        baseline = {run['scale']: run for run in json.load(file_read)['runs']}
+
+    regressions = []
+    for run in runs:
+        baseline_run = baseline.get(run['scale'])
+        if baseline_run is None:
+            continue
+        for stage_name, result in run['stages'].items():
+            baseline_result = baseline_run['stages'].get(stage_name)
+            if baseline_result is None or baseline_result['seconds'] < _MIN_COMPARED_SECONDS:
+                continue
+            ratio = result['seconds'] / baseline_result['seconds']
+            if ratio > tolerance:
+                regressions.append((run['scale'], stage_name, baseline_result['seconds'], result['seconds'], ratio))
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the ACI to OCI and EPG security stages.')
+    parser.add_argument('--scales', type=float, nargs='+', default=_SCALES,
+                        help='tenant sizes, 1 is about 50 EPGs, 40 contracts and 40 filters')
+    parser.add_argument('--repeat', type=int, default=_REPEAT, help='timed runs of every stage, the best is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--reference', action='store_true',
+                        help='also time the rule by rule translation of oci_by_rule.py')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=_TOLERANCE,
+                        help='times slower than the baseline to fail')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    work_dir = tempfile.mkdtemp(prefix='aci-bench-')
+    runs = []
+    try:
+        print('{:>6}  {:<30} {:>10} {:>12}\n{}'.format('Scale', 'Stage', 'Seconds', 'Peak MB', '=' * 61))
+        for scale in args.scales:
+            runs.append(run_scale(scale, work_dir, args.repeat, not args.no_memory, args.reference))
+    finally:
+        shutil.rmtree(work_dir)
+
+    nice_print_scaling(runs)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file_write:
+            json.dump({'python': sys.version.split()[0], 'repeat': args.repeat, 'runs': runs}, file_write, indent=4)
+        print('\nResults saved to {}'.format(args.output))
+
+    if args.baseline is not None:
+        regressions = compare_with_baseline(runs, args.baseline, args.tolerance)
+        if len(regressions) != 0:
+            print('\n[!] Stages over {} times the baseline {}'.format(args.tolerance, args.baseline))
+            for scale, stage_name, baseline_seconds, seconds, ratio in regressions:
+                print('{:>6g}  {:<30} {:0.4f} -> {:0.4f} seconds ({:0.2f}x)'.format(
+                    scale, stage_name, baseline_seconds, seconds, ratio))
+            sys.exit(1)
+        print('\nNo stage over {} times the baseline {}'.format(args.tolerance, args.baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,113 +2,131 @@
 
 # Script to list Tenants and duplicate one with a new name
 
-import requests
 import json
 import sys
-from requests.packages import urllib3
-from time import time
-
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-tenants = []
-
-
-def get_post_uri(api_url_base, headers, aci_json_query_data, is_get):
-
-    if is_get:
-        response = requests.get(api_url_base, headers=headers, data=aci_json_query_data, verify=False)
-    else:
-        response = requests.post(api_url_base, headers=headers, data=aci_json_query_data, verify=False)
-
-    if response.status_code >= 500:
-        print('[!] [{0}] Server Error'.format(response.status_code))
-        return None
-    elif response.status_code == 404:
-        print('[!] [{0}] URL not found: [{1}]'.format(response.status_code, api_url_base))
-        return None
-    elif response.status_code == 401:
-        print('[!] [{0}] Authentication Failed'.format(response.status_code))
-        return None
-    elif response.status_code == 400:
-        print('[!] [{0}] Bad Request'.format(response.status_code))
-        return None
-    elif response.status_code >= 300:
-        print('[!] [{0}] Unexpected Redirect'.format(response.status_code))
-        return None
-    elif response.status_code == 200:
-        return json.loads(response.content.decode('utf-8'))
-    else:
-        print('[?] Unexpected Error: [HTTP {0}]: Content: {1}'.format(response.status_code, response.content))
-    return None
-
-
-def login(host, user, passwd):
-    api_url_base = 'https://{}/api/aaaLogin.json'.format(host)
-    headers = {'Content-Type': 'application/json'}
-    dict_query_data = {"aaaUser": {"attributes": {"name": "", "pwd": ""}}}
-    dict_query_data['aaaUser']['attributes']['name'] = user
-    dict_query_data['aaaUser']['attributes']['pwd'] = passwd
-    aci_json_query_data = json.dumps(dict_query_data)
-    data = get_post_uri(api_url_base, headers, aci_json_query_data, is_get=False)
-
-    if data is not None:
-        return data['imdata'][0]['aaaLogin']['attributes']['token']
-    else:
-        print('[!] Request Failed')
-        return None
-
-
-def get_tenants(host, token2):
-    api_url_base = 'https://{}/api/node/class/fvTenant.json'.format(host)
-    token2 = 'APIC-cookie=' + token2
-    headers = {'Content-Type': 'application/json', 'Cookie': token2}
-    aci_json_query_data = ''
-    data = get_post_uri(api_url_base, headers, aci_json_query_data, is_get=True)
-
-    if data is not None:
-        # print(json.dumps(data, indent=4))
-        print('Tenants List\n============')
-        for item in data['imdata']:
-            print(item['fvTenant']['attributes']['name'])
-            tenants.append(item['fvTenant']['attributes']['name'])
-    else:
-        print('[!] Request Failed')
-        return None
-
-
-def get_tenant(host, token2, tena):
-    api_url_base = 'https://{}/api/class/fvTenant.json?query-target-filter=eq(fvTenant.name,"{}")&rsp-subtree=full&rsp-prop-include=config-only'.format(host, tena)
-    token2 = 'APIC-cookie=' + token2
-    headers = {'Content-Type': 'application/json', 'Cookie': token2}
-    aci_json_query_data = ''
-    print('\nGetting Tenant {} detail - Only Configuration - Subtree - JSON ...'.format(tena))
-    data = get_post_uri(api_url_base, headers, aci_json_query_data, is_get=True)
-
-    if data is not None:
-        print('\nDetail Tenant {}\n===='.format(tena))
-        print(json.dumps(data, indent=4))
-        # print(data)
-        return data
-    else:
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
+
+import modules.aci as aci
+
+# Tenant children are created in this order, None takes the classes not listed
+_CLONE_BATCHES = [
+    ('Filters', ['vzFilter']),
+    ('Contracts', ['vzBrCP', 'vzTaboo', 'vzCPIf']),
+    ('VRFs and BDs', ['fvCtx', 'fvBD']),
+    ('Other objects', None),
+    ('APs and EPGs', ['fvAp']),
+]
+_CLONE_OBJECTS_PER_REQUEST = 50
+_CLONE_PARALLEL_REQUESTS = 4  # keep it at or below the ApicSession pool size
+_PRINT_TENANT = False  # print the whole tenant downloaded, slower than the download for big tenants
+
+
+def rewrite_dn(dn, tena, new_tena):
+    tenant_dn = 'uni/tn-{}'.format(tena)
+    if dn == tenant_dn or dn.startswith(tenant_dn + '/'):
+        return 'uni/tn-{}'.format(new_tena) + dn[len(tenant_dn):]
+    return dn
+
+
+def clone_mo(mo, tena, new_tena):
+    # Copy of an MO subtree where only the references to the source tenant point to the new one,
+    # object names containing the tenant name are left as they are
+    attributes = {}
+    for key, value in mo['attributes'].items():
+        if key == 'dn' or key.endswith('Dn'):
+            value = rewrite_dn(value, tena, new_tena)
+        elif key == 'tnFvTenantName' and value == tena:
+            value = new_tena
+        attributes[key] = value
+
+    clone = {'attributes': attributes}
+    if 'children' in mo:
+        clone['children'] = [{class_name: clone_mo(child, tena, new_tena) for class_name, child in item.items()}
+                             for item in mo['children']]
+    return clone
+
+
+def split_clone_batches(tenant_children):
+    # Tenant children grouped in _CLONE_BATCHES order, the classes not listed go to the batch with None
+    batches = [(batch_name, []) for batch_name, class_names in _CLONE_BATCHES]
+    batch_by_class = {}
+    other_batch = None
+    for batch_number, (batch_name, class_names) in enumerate(_CLONE_BATCHES):
+        if class_names is None:
+            other_batch = batch_number
+        else:
+            for class_name in class_names:
+                batch_by_class[class_name] = batch_number
+
+    for t_child in tenant_children:
+        class_name = next(iter(t_child))
+        batches[batch_by_class.get(class_name, other_batch)][1].append(t_child)
+    return batches
+
+
+def push_batch(apic, new_tena, batch_name, children):
+    # Posts the children under the new tenant, _CLONE_OBJECTS_PER_REQUEST objects per request
+    api_path = '/api/node/mo/uni/tn-{}.json'.format(new_tena)
+    tenant_attributes = {'dn': 'uni/tn-{}'.format(new_tena)}
+    requests_data = []
+    for start in range(0, len(children), _CLONE_OBJECTS_PER_REQUEST):
+        chunk = children[start:start + _CLONE_OBJECTS_PER_REQUEST]
+        requests_data.append((len(chunk), json.dumps({'fvTenant': {'attributes': tenant_attributes,
+                                                                   'children': chunk}})))
+
+    pushed = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=_CLONE_PARALLEL_REQUESTS) as executor:
+        futures = {executor.submit(apic.post, api_path, aci_json_query_data): objects
+                   for objects, aci_json_query_data in requests_data}
+        for future in as_completed(futures):
+            if future.result() is None:
+                failed += futures[future]
+            else:
+                pushed += futures[future]
+            print('{}: {}/{} objects'.format(batch_name, pushed + failed, len(children)))
+
+    return pushed, failed, len(requests_data)
+
+
+def nice_print_clone_report(report):
+    print('\n{:<20} {:>8} {:>8} {:>9} {:>10}'.format('Batch', 'Objects', 'Failed', 'Requests', 'Seconds'))
+    print('=' * 59)
+    for batch_name, pushed, failed, requests_sent, seconds in report:
+        print('{:<20} {:>8} {:>8} {:>9} {:>10.4f}'.format(batch_name, pushed, failed, requests_sent, seconds))
+
+
+def create_tenant(apic, tena, new_tena, config):
+    tenant = config['imdata'][0]['fvTenant']
+    new_tenant = clone_mo(tenant, tena, new_tena)
+    new_tenant['attributes']['name'] = new_tena
+    new_tenant['attributes']['dn'] = 'uni/tn-{}'.format(new_tena)
+    tenant_children = new_tenant.pop('children', [])
+    report = []
+
+    # The tenant first, then its children in dependency order, each batch in parallel requests
+    timer_batch = perf_counter()
+    data = apic.post('/api/node/mo/uni/tn-{}.json'.format(new_tena), json.dumps({'fvTenant': new_tenant}))
+    if data is None:
         print('[!] Request Failed')
         return None
+    report.append(('Tenant', 1, 0, 1, perf_counter() - timer_batch))
 
+    for batch_name, children in split_clone_batches(tenant_children):
+        if len(children) == 0:
+            continue
+        timer_batch = perf_counter()
+        pushed, failed, requests_sent = push_batch(apic, new_tena, batch_name, children)
+        report.append((batch_name, pushed, failed, requests_sent, perf_counter() - timer_batch))
+        if failed != 0:
+            nice_print_clone_report(report)
+            print('[!] Request Failed, {} objects of {} not created'.format(failed, batch_name))
+            return None
 
-def create_tenant(host, token2, tena, new_tena, config):
-    api_url_base = 'https://{}/api/node/mo/uni/tn-{}.json'.format(host, new_tena)
-    token2 = 'APIC-cookie=' + token2
-    headers = {'Content-Type': 'application/json', 'Cookie': token2}
-    aci_json_query_data = json.dumps(config)
-    aci_json_query_data = aci_json_query_data.replace(tena, new_tena)
-
-    data = get_post_uri(api_url_base, headers, aci_json_query_data, is_get=False)
-
-    if data is not None:
-        print('\nTenant {} Created \n===='.format(new_tena))
-        print(json.dumps(data, indent=4))
-    else:
-        print('[!] Request Failed')
-        return None
+    nice_print_clone_report(report)
+    print('\nTenant {} Created \n===='.format(new_tena))
+    return report
 
 
 if __name__ == '__main__':
@@ -122,14 +140,16 @@ if __name__ == '__main__':
     if password == '':
         password = 'ciscopsdt'
     print('Logging in...')
-    token = login(apic_host, username, password)
+    apic = aci.ApicSession(apic_host, username, password)
+    token = apic.login()
     if token is not None:
         print('Logging Successful\nGetting tenants list...')
-        get_tenants(apic_host, token)
+        tenants = aci.get_tenants(apic)
     else:
         print('Logging Failed')
         sys.exit(1)
-    start_login_expired_timer = time()
+    if tenants is None:
+        sys.exit(1)
     ten = input('\nSelect tenant name: ')
     if ten not in tenants:
         print('\nInput Error. Select a tenant from the list.\n')
@@ -140,29 +160,9 @@ if __name__ == '__main__':
         print('\nInput Error. Type the new tenant name.\n')
         sys.exit(1)
 
-    end_login_expired_timer = time()
-
-    if end_login_expired_timer - start_login_expired_timer >= 55:
-        print('Expired token, re logging ...')
-        token = login(apic_host, username, password)
-        if token is not None:
-            print('Logging Successful\n')
-            get_tenants(apic_host, token)
-        else:
-            print('Logging Failed')
-            sys.exit(1)
-
-    config = get_tenant(apic_host, token, ten)
-
-    end_login_expired_timer = time()
-    if end_login_expired_timer - start_login_expired_timer >= 55:
-        print('Expired token, re logging ...')
-        token = login(apic_host, username, password)
-        if token is not None:
-            print('Logging Successful\n')
-            get_tenants(apic_host, token)
-        else:
-            print('Logging Failed')
-            sys.exit(1)
+    config = aci.get_tenant(apic, ten, show=_PRINT_TENANT)
 
-    create_tenant(apic_host, token, ten, new_tenant_name, config)
\ No newline at end of file
+    if config is not None:
+        create_tenant(apic, ten, new_tenant_name, config)
+        print(aci.nice_print_request_metrics(apic.get_metrics()))
+    apic.close()
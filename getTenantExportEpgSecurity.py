@@ -6,373 +6,252 @@
 # 3.- export to excel format the full combination of: AEPg, EPG, provider/consumer,
 #     contract, subject, filter and filter name, ports, etc
 
-import requests
-import json
+import argparse
+import contextlib
+import csv
 import sys
-from requests.packages import urllib3
-from time import time, perf_counter
+from time import perf_counter
 import os
 from datetime import date
-import xlsxwriter
+from itertools import islice
+
+import modules.aci as aci
+import modules.model as model
+import modules.model_cache as model_cache
+import modules.perf as perf
+import modules.snapshot as snapshot
+
+_EXPORT_HEADER = ('AEPg Name', 'EPG Name', 'Provide/Consume', 'Contract Name', 'Subject Name', 'BiDir', 'Action',
+                  'Filter Name', 'Filter Entry Name', 'Proto', 'D.F.Port', 'D.T.Port', 'StFull')
+_MISSING_CONTRACT_ROW = ('missing contract', '', '', '', '', '', '', '', '')
+_PARQUET_BATCH_ROWS = 65536
+_MODEL_CACHE = True  # keep the extracted tenant next to its file, as <file>.model, for the next runs
+_OUTPUT_FORMATS = ['contracts', 'aepg', 'xlsx', 'csv', 'parquet']
+
+
+def iter_filter_entry_rows(f_f, f_n):
+    # The filter entries are shared, the 'any' values go only to the rows
+    for f_e in aci.get_filter(f_f, f_n):
+        yield (f_e.name,
+               'any' if f_e.protocol is model.Protocol.UNSPECIFIED else str(f_e.protocol),
+               model.format_port(f_e.from_port, 'any'),
+               model.format_port(f_e.to_port, 'any'),
+               f_e.stateful)
+
+
+def iter_contract_rows(f_c, f_f, contract_name):
+    # Subject Name, BiDir, Action, Filter Name, Filter Entry Name, Proto, D.F.Port, D.T.Port, StFull
+    for subject in f_c[contract_name].subjects:
+        subject_row = tuple(subject)
+        for f_e_row in iter_filter_entry_rows(f_f, subject.filter_name):
+            yield subject_row + f_e_row
+
+
+def iter_aepg_rows(f_a, sort=False):
+    # AEPg Name, EPG Name, Provide/Consume, Contract Name
+    order = sorted if sort else list
+    for aepg_detail in order(f_a):
+        aepg_name = aepg_detail.name
+        for epg_list in order(aepg_detail.epgs):
+            epg_name = epg_list.name
+            for p_c in order(epg_list.provided):
+                yield aepg_name, epg_name, 'P', p_c
+            for c_c in order(epg_list.consumed):
+                yield aepg_name, epg_name, 'C', c_c
+
+
+def iter_aepg_filter_entry_rows(f_a, f_c, f_f):
+    # One row per AEPg, EPG, contract, subject and filter entry, with the _EXPORT_HEADER columns
+    for aepg_row in iter_aepg_rows(f_a, sort=True):
+        if aepg_row[3] in f_c.keys():
+            for contract_row in iter_contract_rows(f_c, f_f, aepg_row[3]):
+                yield aepg_row + contract_row
+        else:
+            yield aepg_row + _MISSING_CONTRACT_ROW
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-tenants = []
+@perf.timed('epg_security.nice_print_contracts')
+def nice_print_contracts(f_c, f_f):
+    # print(json.dumps(f_c, indent=4))
+    # print(json.dumps(f_f, indent=4))
+    row_format = '{:<24} {:<25} {:<7} {:<8} {:<21} {:<22} {:<7} {:<8} {:<8} {:<8}\n'
+    text = [row_format.format(*_EXPORT_HEADER[3:]), '=' * 145 + '\n']
 
+    sorted_f_c = sorted(f_c.items(), key=lambda x: x[1].subjects)
 
-def get_post_uri(api_url_base, headers, aci_json_query_data, is_get):
-    if is_get:
-        response = requests.get(api_url_base, headers=headers, data=aci_json_query_data, verify=False)
-    else:
-        response = requests.post(api_url_base, headers=headers, data=aci_json_query_data, verify=False)
+    for contract_name in sorted_f_c:
+        for contract_row in iter_contract_rows(f_c, f_f, contract_name[0]):
+            text.append(row_format.format(contract_name[0], *contract_row))
+    return ''.join(text)
 
-    if response.status_code >= 500:
-        print('[!] [{0}] Server Error'.format(response.status_code))
-        return None
-    elif response.status_code == 404:
-        print('[!] [{0}] URL not found: [{1}]'.format(response.status_code, api_url_base))
-        return None
-    elif response.status_code == 401:
-        print('[!] [{0}] Authentication Failed'.format(response.status_code))
-        return None
-    elif response.status_code == 400:
-        print('[!] [{0}] Bad Request'.format(response.status_code))
-        return None
-    elif response.status_code >= 300:
-        print('[!] [{0}] Unexpected Redirect'.format(response.status_code))
-        return None
-    elif response.status_code == 200:
-        return json.loads(response.content.decode('utf-8'))
-    else:
-        print('[?] Unexpected Error: [HTTP {0}]: Content: {1}'.format(response.status_code, response.content))
-    return None
 
+@perf.timed('epg_security.nice_print_aepg')
+def nice_print_aepg(f_a):
+    # print(json.dumps(f_a, indent=4))
+    row_format = '{:<25} {:<25} {:^17} {:<20} \n'
+    text = [row_format.format(*_EXPORT_HEADER[:4]), '=' * 93 + '\n']
 
-def login(host, user, passwd):
-    api_url_base = 'https://{}/api/aaaLogin.json'.format(host)
-    headers = {'Content-Type': 'application/json'}
-    dict_query_data = {"aaaUser": {"attributes": {"name": "", "pwd": ""}}}
-    dict_query_data['aaaUser']['attributes']['name'] = user
-    dict_query_data['aaaUser']['attributes']['pwd'] = passwd
-    aci_json_query_data = json.dumps(dict_query_data)
-    data = get_post_uri(api_url_base, headers, aci_json_query_data, is_get=False)
+    for aepg_row in iter_aepg_rows(f_a):
+        text.append(row_format.format(*aepg_row))
+    return ''.join(text)
 
-    if data is not None:
-        return data['imdata'][0]['aaaLogin']['attributes']['token']
-    else:
-        print('[!] Request Failed')
-        return None
 
+@perf.timed('epg_security.export_to_xlsx')
+def export_to_xlsx(export_f_n, f_a, f_c, f_f):
+    # xlsxwriter is only needed for this output.
+    # constant_memory flushes every row to disk once the next one starts, so rows must be written in order
+    import xlsxwriter
 
-def get_tenants(host, token2):
-    api_url_base = 'https://{}/api/node/class/fvTenant.json'.format(host)
-    token2 = 'APIC-cookie=' + token2
-    headers = {'Content-Type': 'application/json', 'Cookie': token2}
-    aci_json_query_data = ''
-    data = get_post_uri(api_url_base, headers, aci_json_query_data, is_get=True)
+    workbook = xlsxwriter.Workbook(export_f_n, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('AEPg-to-filterEntry')
+    bold = workbook.add_format({'bold': True})
+    worksheet.write_row(0, 0, _EXPORT_HEADER, bold)
 
-    if data is not None:
-        # print(json.dumps(data, indent=4))
-        print('\nTenants List\n============')
-        for item in data['imdata']:
-            print(item['fvTenant']['attributes']['name'])
-            tenants.append(item['fvTenant']['attributes']['name'])
-    else:
-        print('[!] Request Failed')
-        return None
+    for row, data in enumerate(iter_aepg_filter_entry_rows(f_a, f_c, f_f), start=1):
+        worksheet.write_row(row, 0, data)
 
+    workbook.close()
+    return True
 
-def get_tenant(host, token2, tena):
-    api_url_base = 'https://{}/api/class/fvTenant.json?query-target-filter=eq(fvTenant.name,"{}")&rsp-subtree=full&rsp-prop-include=config-only'.format(
-        host, tena)
-    token2 = 'APIC-cookie=' + token2
-    headers = {'Content-Type': 'application/json', 'Cookie': token2}
-    aci_json_query_data = ''
-    print('\nGetting Tenant {} detail - Only Configuration - Subtree - JSON ...'.format(tena))
-    data = get_post_uri(api_url_base, headers, aci_json_query_data, is_get=True)
 
-    show = False
+def open_output(export_f_n):
+    # - is stdout
+    if export_f_n == '-':
+        return contextlib.nullcontext(sys.stdout)
+    return open(export_f_n, 'w', newline='')
 
-    if data is not None:
-        if show:
-            print('\nDetail Tenant {}\n===='.format(tena))
-            print(json.dumps(data, indent=4))
-        return data
-    else:
-        print('[!] Request Failed')
-        return None
 
+@perf.timed('epg_security.export_to_csv')
+def export_to_csv(export_f_n, f_a, f_c, f_f):
+    with open_output(export_f_n) as fp:
+        writer = csv.writer(fp)
+        writer.writerow(_EXPORT_HEADER)
+        writer.writerows(iter_aepg_filter_entry_rows(f_a, f_c, f_f))
+    return True
 
-def extract_data(data_dict):
-    number_of_contracts = 0
-    number_of_filters = 0
-    number_of_app_profile = 0
-    number_of_epg = 0
-    full_contract_rules = {}
-    full_filter_rules = {}
-    full_aep_list = []
-    tenant_children = data_dict['imdata'][0]['fvTenant']['children']
-    # print(json.dumps(tenant_children, indent=4))
-
-    for t_child in tenant_children:
-
-        if 'vzBrCP' in t_child.keys():  # is a Contract
-            number_of_contracts += 1
-            contract_name = t_child['vzBrCP']['attributes']['name']
-            contract_children_subj = t_child['vzBrCP']['children']
-            subj_list = []
-
-            for c_child_subj in contract_children_subj:
-                if 'vzSubj' in c_child_subj:  # is Subject
-                    subj_name = (c_child_subj['vzSubj']['attributes']['name'])
-                    subj_reverse_ports = (c_child_subj['vzSubj']['attributes']['revFltPorts'])
-                    subject_children_filter = c_child_subj['vzSubj']['children']
-                    subj_filter_list = []
-                    for s_child_filter in subject_children_filter:
-                        if 'vzRsSubjFiltAtt' in s_child_filter:  # is Subj_filter
-                            subj_filter_list.append((s_child_filter['vzRsSubjFiltAtt']['attributes']['action'],
-                                                     s_child_filter['vzRsSubjFiltAtt']['attributes']['tnVzFilterName']))
-
-                        if 'vzInTerm' in s_child_filter:
-                            if 'children' in s_child_filter['vzInTerm']:
-                                for item in s_child_filter['vzInTerm']['children']:
-                                    if 'vzRsFiltAtt' in item:
-                                        subj_filter_list.append((item['vzRsFiltAtt']['attributes']['action'],
-                                                                 item['vzRsFiltAtt']['attributes']['tnVzFilterName']))
-
-                        if 'vzOutTerm' in s_child_filter:
-                            if 'children' in s_child_filter['vzOutTerm']:
-                                for item in s_child_filter['vzOutTerm']['children']:
-                                    if 'vzRsFiltAtt' in item:
-                                        subj_filter_list.append((item['vzRsFiltAtt']['attributes']['action'],
-                                                                 item['vzRsFiltAtt']['attributes']['tnVzFilterName']))
-
-                    subj_list.append((subj_name, subj_reverse_ports, subj_filter_list))
-
-            # print(contract_name, str(subj_list))
-
-            for item in subj_list:
-                for rules in item[2]:
-                    if contract_name in full_contract_rules.keys():
-                        full_contract_rules[contract_name].append([item[0], item[1], rules[0], rules[1]])
-                    else:
-                        full_contract_rules[contract_name] = [[item[0], item[1], rules[0], rules[1]]]
-
-        elif 'vzFilter' in t_child.keys():  # is a Filter
-            number_of_filters += 1
-            filter_name = t_child['vzFilter']['attributes']['name']
-            filter_children = t_child['vzFilter']['children']
-            fe_list = []
-            for f_child in filter_children:
-                fe_name = f_child['vzEntry']['attributes']['name']
-                fe_protocol = f_child['vzEntry']['attributes']['prot']
-                fe_destination_from_port = f_child['vzEntry']['attributes']['dFromPort']
-                fe_destination_to_port = f_child['vzEntry']['attributes']['dToPort']
-                fe_stateful = f_child['vzEntry']['attributes']['stateful']
-                fe_list.append([fe_name, fe_protocol, fe_destination_from_port, fe_destination_to_port, fe_stateful])
-
-            full_filter_rules[filter_name] = fe_list
-
-        elif 'fvAp' in t_child.keys():  # is a Application Profile
-            number_of_app_profile += 1
-            app_profile_name = t_child['fvAp']['attributes']['name']
-            app_profile_children = t_child['fvAp']['children']
-            epg_list = []
-            for app_child in app_profile_children:
-                if 'fvAEPg' in app_child.keys():    # is EPG
-                    number_of_epg += 1
-                    epg_name = app_child['fvAEPg']['attributes']['name']
-                    epg_children = app_child['fvAEPg']['children']
-                    consumed_contract_list = []
-                    provided_contract_list = []
-                    for epg_child in epg_children:
-                        if 'fvRsCons' in epg_child.keys():      # consume contract
-                            consumed_contract_list.append(epg_child['fvRsCons']['attributes']['tnVzBrCPName'])
-                        elif 'fvRsProv'in epg_child.keys():     # provide contract
-                            provided_contract_list.append(epg_child['fvRsProv']['attributes']['tnVzBrCPName'])
-
-                    epg_list.append([epg_name, provided_contract_list, consumed_contract_list])
-            full_aep_list.append([app_profile_name, epg_list])
-
-    return full_aep_list, number_of_app_profile, number_of_epg,\
-           full_contract_rules, number_of_contracts,\
-           full_filter_rules,  number_of_filters
 
+@perf.timed('epg_security.export_to_parquet')
+def export_to_parquet(export_f_n, f_a, f_c, f_f):
+    # pyarrow is only needed for this output
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        print('[!] Parquet output needs pyarrow, install it with \'pip install pyarrow\'')
+        return False
 
-def nice_print_contracts(f_c, f_f):
-    # print(json.dumps(f_c, indent=4))
-    # print(json.dumps(f_f, indent=4))
-    text = ''
-    text += '{:<24} {:<25} {:<7} {:<8} {:<21} {:<22} {:<7} {:<8} {:<8} {:<8}\n'.format(
-        'Contract Name', 'Subject Name', 'BiDir', 'Action',
-        'Filter Name', 'Filter Entry Name', 'Proto', 'D.F.Port', 'D.T.Port',
-        'StFull')
-    text += '=' * 145 + '\n'
+    schema = pyarrow.schema([(column, pyarrow.string()) for column in _EXPORT_HEADER])
+    rows = iter_aepg_filter_entry_rows(f_a, f_c, f_f)
+    with pyarrow.parquet.ParquetWriter(export_f_n, schema) as writer:
+        while True:
+            batch = list(islice(rows, _PARQUET_BATCH_ROWS))
+            if len(batch) == 0:
+                break
+            columns = [pyarrow.array(column, pyarrow.string()) for column in zip(*batch)]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+    return True
 
-    sorted_f_c = sorted(f_c.items(), key=lambda x: x[1])
 
-    for contract_name in sorted_f_c:
-        for subject in f_c[contract_name[0]]:
-            fe_list = list(get_filter(f_f, subject[3]))
-            for f_e in fe_list:
-                if f_e[1] == 'unspecified':
-                    f_e[1] = 'any'
-                if f_e[2] == 'unspecified':
-                    f_e[2] = 'any'
-                if f_e[3] == 'unspecified':
-                    f_e[3] = 'any'
-                text += '{:<24} {:<25} {:<7} {:<8} {:<21} {:<22} {:<7} {:<8} {:<8} {:<8}\n'.format(
-                    contract_name[0], subject[0], subject[1], subject[2],
-                    subject[3], f_e[0], f_e[1], f_e[2],
-                    f_e[3], f_e[4])
-    return text
+def read_config(config_file):
+    return aci.extract_data(snapshot.load_snapshot(config_file))
 
 
-def nice_print_aepg(f_a):
-    # print(json.dumps(f_a, indent=4))
-    text = ''
-    text += '{:<25} {:<25} {:^17} {:<20} \n'.format(
-        'AEPg Name', 'EPG Name', 'Provide/Consume', 'Contract Name')
-    text += '=' * 93 + '\n'
-
-    for aepg_detail in f_a:
-        aepg_name = aepg_detail[0]
-        for epg_list in aepg_detail[1]:
-            epg_name = epg_list[0]
-            provided_contract_list = epg_list[1]
-            consumed_contract_list = epg_list[2]
-            for p_c in provided_contract_list:
-                text += '{:<25} {:<25} {:^17} {:<20} \n'.format(aepg_name, epg_name, 'P', p_c)
-            for c_c in consumed_contract_list:
-                text += '{:<25} {:<25} {:^17} {:<20} \n'.format(aepg_name, epg_name, 'C', c_c)
-    return text
+def extract_config(config_file):
+    if _MODEL_CACHE:
+        return model_cache.get_model(config_file, read_config)
+    return read_config(config_file)
 
 
-def export_to_xlsx(export_f_n, f_a, f_c, f_f):
-    # print(json.dumps(f_a, indent=4))
-    row = 0
-    col = 0
-    workbook = xlsxwriter.Workbook(export_f_n)
-    worksheet = workbook.add_worksheet('AEPg-to-filterEntry')
-    bold = workbook.add_format({'bold': True})
-    worksheet.write(row, col, 'AEPg Name', bold)
-    worksheet.write(row, col + 1, 'EPG Name', bold)
-    worksheet.write(row, col + 2, 'Provide/Consume', bold)
-    worksheet.write(row, col + 3, 'Contract Name', bold)
-    worksheet.write(row, col + 4, 'Subject Name', bold)
-    worksheet.write(row, col + 5, 'BiDir', bold)
-    worksheet.write(row, col + 6, 'Action', bold)
-    worksheet.write(row, col + 7, 'Filter Name', bold)
-    worksheet.write(row, col + 8, 'Filter Entry Name', bold)
-    worksheet.write(row, col + 9, 'Proto', bold)
-    worksheet.write(row, col + 10, 'D.F.Port', bold)
-    worksheet.write(row, col + 11, 'D.T.Port', bold)
-    worksheet.write(row, col + 12, 'StFull', bold)
-    row += 1
-
-    for aepg_detail in sorted(f_a):
-        aepg_name = aepg_detail[0]
-
-        for epg_list in sorted(aepg_detail[1]):
-            epg_name = epg_list[0]
-            provided_contract_list = epg_list[1]
-            consumed_contract_list = epg_list[2]
-
-            for p_c in sorted(provided_contract_list):
-                if p_c in f_c.keys():
-                    for subject in f_c[p_c]:
-                        fe_list = list(get_filter(f_f, subject[3]))
-                        for f_e in fe_list:
-                            if f_e[1] == 'unspecified':
-                                f_e[1] = 'any'
-                            if f_e[2] == 'unspecified':
-                                f_e[2] = 'any'
-                            if f_e[3] == 'unspecified':
-                                f_e[3] = 'any'
-
-                            worksheet.write(row, col, aepg_name)
-                            worksheet.write(row, col + 1, epg_name)
-                            worksheet.write(row, col + 2, 'P')
-                            worksheet.write(row, col + 3, p_c)
-                            worksheet.write(row, col + 4, subject[0])
-                            worksheet.write(row, col + 5, subject[1])
-                            worksheet.write(row, col + 6, subject[2])
-                            worksheet.write(row, col + 7, subject[3])
-                            worksheet.write(row, col + 8, f_e[0])
-                            worksheet.write(row, col + 9, f_e[1])
-                            worksheet.write(row, col + 10, f_e[2])
-                            worksheet.write(row, col + 11, f_e[3])
-                            worksheet.write(row, col + 12, f_e[4])
-                            row += 1
-                else:
-                    worksheet.write(row, col, aepg_name)
-                    worksheet.write(row, col + 1, epg_name)
-                    worksheet.write(row, col + 2, 'P')
-                    worksheet.write(row, col + 3, p_c)
-                    worksheet.write(row, col + 4, 'missing contract')
-                    worksheet.write(row, col + 5, '')
-                    worksheet.write(row, col + 6, '')
-                    worksheet.write(row, col + 7, '')
-                    worksheet.write(row, col + 8, '')
-                    worksheet.write(row, col + 9, '')
-                    worksheet.write(row, col + 10, '')
-                    worksheet.write(row, col + 11, '')
-                    worksheet.write(row, col + 12, '')
-                    row += 1
-
-            for c_c in sorted(consumed_contract_list):
-                if c_c in f_c.keys():
-                    for subject in f_c[c_c]:
-                        fe_list = list(get_filter(f_f, subject[3]))
-                        for f_e in fe_list:
-                            if f_e[1] == 'unspecified':
-                                f_e[1] = 'any'
-                            if f_e[2] == 'unspecified':
-                                f_e[2] = 'any'
-                            if f_e[3] == 'unspecified':
-                                f_e[3] = 'any'
-
-                            worksheet.write(row, col, aepg_name)
-                            worksheet.write(row, col + 1, epg_name)
-                            worksheet.write(row, col + 2, 'C')
-                            worksheet.write(row, col + 3, c_c)
-                            worksheet.write(row, col + 4, subject[0])
-                            worksheet.write(row, col + 5, subject[1])
-                            worksheet.write(row, col + 6, subject[2])
-                            worksheet.write(row, col + 7, subject[3])
-                            worksheet.write(row, col + 8, f_e[0])
-                            worksheet.write(row, col + 9, f_e[1])
-                            worksheet.write(row, col + 10, f_e[2])
-                            worksheet.write(row, col + 11, f_e[3])
-                            worksheet.write(row, col + 12, f_e[4])
-                            row += 1
-                else:
-                    worksheet.write(row, col, aepg_name)
-                    worksheet.write(row, col + 1, epg_name)
-                    worksheet.write(row, col + 2, 'C')
-                    worksheet.write(row, col + 3, c_c)
-                    worksheet.write(row, col + 4, 'missing contract')
-                    worksheet.write(row, col + 5, '')
-                    worksheet.write(row, col + 6, '')
-                    worksheet.write(row, col + 7, '')
-                    worksheet.write(row, col + 8, '')
-                    worksheet.write(row, col + 9, '')
-                    worksheet.write(row, col + 10, '')
-                    worksheet.write(row, col + 11, '')
-                    worksheet.write(row, col + 12, '')
-                    row += 1
+def download_snapshot(host, username, password, ten):
+    apic = aci.ApicSession(host, username, password)
+    if apic.login() is None:
+        print('Logging Failed')
+        return None
 
-    workbook.close()
+    all_tenants = aci.get_tenants(apic, show=False)
+    if all_tenants is None or ten not in all_tenants:
+        print('[!] Tenant {} not found'.format(ten))
+        apic.close()
+        return None
 
+    with perf.span('stage.download'):
+        snapshot_file = snapshot.SnapshotStore().get_tenant_snapshot(apic, ten)
+    apic.close()
+    return snapshot_file
 
-def get_filter(f_f, f_n):
-    if f_n in f_f.keys():
-        return f_f[f_n]
-    else:
-        return [['na', 'na', 'na', 'na', 'na']]
+
+def cli_export(args):
+    # Non interactive export. Only the output goes to stdout, the messages go to stderr.
+    output = args.output
+    if output is None:
+        if args.format in ('contracts', 'aepg'):
+            output = '-'
+        else:
+            export_basename = 'stdin' if args.file in (None, '-') else os.path.basename(args.file).split('.')[0]
+            if args.host is not None:
+                export_basename = '{}-{}-{}'.format(args.host, args.tenant, date.today())
+            output = '{}.{}'.format(export_basename, args.format)
+    if output == '-' and args.format in ('xlsx', 'parquet'):
+        print('[!] {} output needs a file name in --output'.format(args.format))
+        sys.exit(1)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        config_file = args.file
+        if args.host is not None:
+            username, password = aci.read_credentials(args.credentials)
+            if args.tenant is None or username is None or password is None:
+                print('--host needs --tenant and the APIC credentials, in --credentials or in the APIC_USERNAME '
+                      'and APIC_PASSWORD environment variables')
+                sys.exit(1)
+            config_file = download_snapshot(args.host, username, password, args.tenant)
+            if config_file is None:
+                sys.exit(1)
+
+        with perf.span('stage.extract'):
+            if config_file == '-':
+                tenant_data = aci.extract_data_from_stream(snapshot.open_stream(sys.stdin.buffer))
+            else:
+                tenant_data = extract_config(config_file)
+    full_aep, num_aepg, num_epg, full_contract, num_con, full_filter, num_fil = tenant_data
+
+    if args.format == 'contracts' or args.format == 'aepg':
+        if args.format == 'contracts':
+            final_text = nice_print_contracts(full_contract, full_filter)
+        else:
+            final_text = nice_print_aepg(full_aep)
+        with open_output(output) as fp:
+            fp.write(final_text)
+        return
+
+    exporters = {'xlsx': export_to_xlsx, 'csv': export_to_csv, 'parquet': export_to_parquet}
+    if not exporters[args.format](output, full_aep, full_contract, full_filter):
+        sys.exit(1)
+    if output != '-':
+        print(f'File save as: {output}', file=sys.stderr)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Export the EPGs, contracts and filters of a Cisco ACI tenant. '
+                                                 'Without arguments the script runs interactively.')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--file', help='tenant JSON file or snapshot, - to read it from stdin')
+    source.add_argument('--host', help='APIC host to download the tenant from')
+    parser.add_argument('--tenant', help='tenant to download from --host')
+    parser.add_argument('--credentials', help='file with APIC_USERNAME=... and APIC_PASSWORD=... lines, '
+                                              'the environment variables with these names are used otherwise')
+    parser.add_argument('--format', choices=_OUTPUT_FORMATS, default='xlsx',
+                        help='contracts or aepg tables, or the AP-EPG-Contract-Filter-FilterEntry rows')
+    parser.add_argument('--output', help='output file, - for stdout. The tables go to stdout by default, '
+                                         'the files are named after the tenant')
+    return parser.parse_args()
 
 
 def main():
+    args = parse_arguments()
+    if args.file is not None or args.host is not None:
+        cli_export(args)
+        return
+
     static_data = input('\nUse static data (y/n): ')
 
     if static_data.lower() == 'n':
@@ -382,48 +261,40 @@ def main():
         password = input('Password: ')
 
         print('Logging in...')
+        apic = aci.ApicSession(host, username, password)
 
         try:
-            token = login(host, username, password)
+            token = apic.login()
         except Exception as e:
             print(e)
             sys.exit(1)
 
         if token is not None:
             print('Logging Successful\nGetting tenants list...')
-            get_tenants(host, token)
+            tenants = aci.get_tenants(apic)
         else:
             print('Logging Failed')
             sys.exit(1)
+        if tenants is None:
+            sys.exit(1)
 
-        start_login_expired_timer = time()
         ten = input('\nSelect tenant name: ')
         if ten not in tenants:
             print('\nInput Error. Select a tenant from the list.\n')
             sys.exit(1)
 
-        end_login_expired_timer = time()
-
-        if end_login_expired_timer - start_login_expired_timer >= 55:
-            print('Expired token, re logging ...')
-            token = login(host, username, password)
-            if token is not None:
-                print('Logging Successful\n')
-                get_tenants(host, token)
-            else:
-                print('Logging Failed')
-                sys.exit(1)
-
+        # Downloaded only if the tenant changed since the last snapshot
         print('Downloading tenant detail...')
         timer_download = perf_counter()
-        config = get_tenant(host, token, ten)
+        with perf.span('stage.download'):
+            snapshot_file = snapshot.SnapshotStore().get_tenant_snapshot(apic, ten)
+        apic.close()
+        if snapshot_file is None:
+            sys.exit(1)
         print('\nDownload time: {:0.4f} seconds\n'.format(perf_counter() - timer_download))
 
         filename = '{}-{}-{}.json'.format(host, ten, date.today())
-
-        print(f'Saving tenant to {filename}\n')
-        with open(filename, 'w') as fp:
-            json.dump(config, fp)
+        config_file = snapshot_file
 
     elif static_data.lower() == 'y':
         file_list = []
@@ -432,6 +303,16 @@ def main():
             if file.endswith(".json"):
                 file_list.append(file)
                 print(file)
+
+        # The newest snapshot of every downloaded tenant, exported with the name of a download
+        snapshot_store = snapshot.SnapshotStore()
+        snapshot_names = {}
+        for snapshot_host, snapshot_ten, entry in snapshot_store.list_latest():
+            snapshot_file = snapshot_store.path(entry['file'])
+            snapshot_date = date.fromtimestamp(entry['downloaded'])
+            file_list.append(snapshot_file)
+            snapshot_names[snapshot_file] = '{}-{}-{}.json'.format(snapshot_host, snapshot_ten, snapshot_date)
+            print('{}  ({} {} {})'.format(snapshot_file, snapshot_host, snapshot_ten, snapshot_date))
         filename = input('\nSelect file name: ')
 
         if filename not in file_list:
@@ -440,10 +321,8 @@ def main():
 
         # filename = 'co-TENANT-DTV' + '.json'
         print(f'\nReading tenant to {filename}\n')
-        with open(filename, 'r') as fp:
-            config = json.load(fp)
-
-        # print(json.dumps(config, indent=4))
+        config_file = filename
+        filename = snapshot_names.get(filename, filename)
 
     else:
         print('Invalid input')
@@ -452,19 +331,25 @@ def main():
     print('Processing...')
     timer_processing = perf_counter()
 
-    full_aep, num_aepg, num_epg, full_contract, num_con, full_filter, num_fil = extract_data(config)
+    with perf.span('stage.extract'):
+        full_aep, num_aepg, num_epg, full_contract, num_con, full_filter, num_fil = extract_config(config_file)
 
     # print(json.dumps(full_aep, indent=4))
 
     print('\nProcessing time: {:0.4f} seconds\n'.format(perf_counter() - timer_processing))
 
-    export_filename = '{}.xlsx'.format(filename.split('.')[0])
+    export_basename = os.path.splitext(filename)[0]
+    exporters = {'3': ('{}.xlsx'.format(export_basename), export_to_xlsx),
+                 '4': ('{}.csv'.format(export_basename), export_to_csv),
+                 '5': ('{}.parquet'.format(export_basename), export_to_parquet)}
 
     select_output = input('Select output type:\n\n'
                           '1.- to screen Contract-Filter-FilterEntry\n'
                           '2.- to screen AP-EPG-Contract\n'
-                          '3.- to xls AP-EPG-Contract-Filter-FilterEntry \'{}\'\n\n'
-                          'Select option: '.format(export_filename))
+                          '3.- to xls AP-EPG-Contract-Filter-FilterEntry \'{}\'\n'
+                          '4.- to csv AP-EPG-Contract-Filter-FilterEntry \'{}\'\n'
+                          '5.- to parquet AP-EPG-Contract-Filter-FilterEntry \'{}\'\n\n'
+                          'Select option: '.format(exporters['3'][0], exporters['4'][0], exporters['5'][0]))
 
     if str(select_output) == '1':
         timer_parsing = perf_counter()
@@ -491,7 +376,7 @@ def main():
         print('\nParsing time: {:0.4f} seconds\n'.format(perf_counter() - timer_parsing))
         count = 0
         for aep in full_aep:
-            for epg in aep[1]:
+            for epg in aep.epgs:
                 count += 1
         if (len(full_aep) == num_aepg) and (count == num_epg):
             double_check = 'OK'
@@ -506,12 +391,14 @@ def main():
               f'#AEPg: {num_aepg}\n'
               f'#EPG: {num_epg}\n')
 
-    elif str(select_output) == '3':
+    elif str(select_output) in exporters.keys():
         timer_file_creation = perf_counter()
-        export_to_xlsx(export_filename, full_aep, full_contract, full_filter)
+        export_filename, exporter = exporters[str(select_output)]
+        if not exporter(export_filename, full_aep, full_contract, full_filter):
+            sys.exit(1)
         count = 0
         for aep in full_aep:
-            for epg in aep[1]:
+            for epg in aep.epgs:
                 count += 1
 
         if (len(full_aep) == num_aepg) and (count == num_epg):
@@ -4,22 +4,41 @@
 # to OCI and Terraform data structures.
 # Cleaning rules and adaptations
 
+import argparse
+import contextlib
 import json
 import os
+import shutil
 import sys
 import getpass
-from datetime import date
-from time import time, perf_counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from time import perf_counter
 
 import modules.aci as aci
+import modules.model_cache as model_cache
 import modules.oci as oci
+import modules.perf as perf
+import modules.port_numbers as port_numbers
+import modules.snapshot as snapshot
+import modules.tenant_diff as tenant_diff
 
-_ACI_RELOGIN_TIMER = 55
 _DATA_DIR = './data/'
+_SNAPSHOT_DIR = _DATA_DIR + 'snapshots/'  # downloaded tenants, gzip, reused while the tenant is not modified
 _EXPORT_TO_DIR = './export-OCI/'
 _NSG_OVER_ALLOWED_RULES = 121
 _DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN = True
 _ACRONYSM_TO_SKIP_IN_EPG_NAME = ['-BD', 'VLAN']
+_STREAMING_EXTRACTION = True  # walk the tenant JSON while reading it, instead of loading it whole
+_MODEL_CACHE = True  # keep the extracted tenant next to its file, as <file>.model, for the next runs
+_PAGED_CLASS_QUERIES = False  # download with concurrent paged class queries, the raw tenant is not saved
+_OPTIMIZE_NSG_RULES = True  # remove duplicated and redundant rules, merge port ranges
+_SPLIT_OVERSIZED_NSGS = True  # split NSGs over _NSG_OVER_ALLOWED_RULES in <name>-1, <name>-2, ...
+_INCREMENTAL_TRANSLATION = True  # translate only the NSGs changed since the configuration last exported
+_EXPORT_STATE_FILE = '.aci_export_state.json'
+_EXPORT_MODEL_FILE = '.aci_export_model'  # the tenant last exported, what the next export is compared to
+_BATCH_APIC_CONNECTIONS = 4  # tenants downloaded at the same time in batch mode
+_BATCH_TERRAFORM_FILES = ['provider.tf', 'variables.tf', 'terraform.tfvars']
 
 
 def list_available_configurations():
@@ -28,6 +47,11 @@ def list_available_configurations():
         if file.endswith(".json"):
             file_list.append(file)
             print(file)
+
+    snapshot_dir = os.path.relpath(_SNAPSHOT_DIR, _DATA_DIR)
+    for host, ten, entry in snapshot.SnapshotStore(_SNAPSHOT_DIR).list_latest():
+        file_list.append(os.path.join(snapshot_dir, entry['file']))
+        print('{}  ({} {} {})'.format(file_list[-1], host, ten, datetime.fromtimestamp(entry['downloaded']).date()))
     return file_list
 
 
@@ -38,12 +62,25 @@ def use_pre_downloaded_config(file_list):
         print('Invalid file name')
         sys.exit(1)
 
-    print(f'\nReading tenant {filename}\n')
-    with open(_DATA_DIR + filename, 'r') as file_write:
-        aci_tenant_config = json.load(file_write)
+    return _DATA_DIR + filename
+
+
+def extract_config(config_file):
+    print(f'\nReading tenant {config_file}\n')
+    if _MODEL_CACHE:
+        return model_cache.get_model(config_file, extract_config_file)
+    return extract_config_file(config_file)
+
+
+def extract_config_file(config_file):
+    if _STREAMING_EXTRACTION:
+        with snapshot.open_snapshot(config_file, 'rb') as file_read:
+            return aci.extract_data_from_stream(file_read)
+
+    aci_tenant_config = snapshot.load_snapshot(config_file)
 
     # print(json.dumps(config, indent=4))
-    return aci_tenant_config
+    return aci.extract_data(aci_tenant_config)
 
 
 def download_config():
@@ -54,52 +91,400 @@ def download_config():
     password = getpass.getpass(prompt='Password: ', stream=None)
 
     print('\nLogging in...')
+    apic = aci.ApicSession(host, username, password)
 
     try:
-        token = aci.login(host, username, password)
+        token = apic.login()
     except Exception as e:
         print(e)
         sys.exit(1)
 
     if token is not None:
         print('Logging Successful\nGetting tenants list...')
-        tenants = aci.get_tenants(host, token)
+        tenants = aci.get_tenants(apic)
     else:
         print('Logging Failed')
         sys.exit(1)
+    if tenants is None:
+        sys.exit(1)
 
-    start_login_expired_timer = time()
     ten = input('\nSelect tenant name: ')
     if ten not in tenants:
         print('\nInput Error. Select a tenant from the list.\n')
         sys.exit(1)
 
-    end_login_expired_timer = time()
+    if _PAGED_CLASS_QUERIES:
+        print('\nDownloading tenant detail...')
+        import modules.aci_async as aci_async
 
-    if end_login_expired_timer - start_login_expired_timer >= _ACI_RELOGIN_TIMER:
-        print('Expired token, re logging ...')
-        token = aci.login(host, username, password)
-        if token is not None:
-            print('Logging Successful\n')
-        else:
-            print('Logging Failed')
+        timer_download = perf_counter()
+        with perf.span('stage.download'):
+            aci_tenant_data = aci_async.get_tenant_paged(apic, ten)
+        apic.close()
+        if aci_tenant_data is None:
             sys.exit(1)
+        print('\nDownload time: {:0.4f} seconds\n'.format(perf_counter() - timer_download))
+        print(perf.format_peak_memory())
+        return None, aci_tenant_data
 
+    # Downloaded only if the tenant changed since the last snapshot
     print('\nDownloading tenant detail...')
     timer_download = perf_counter()
-    aci_tenant_config = aci.get_tenant(host, token, ten)
+    with perf.span('stage.download'):
+        config_file = snapshot.SnapshotStore(_SNAPSHOT_DIR).get_tenant_snapshot(apic, ten)
+    apic.close()
+    if config_file is None:
+        sys.exit(1)
     print('\nDownload time: {:0.4f} seconds\n'.format(perf_counter() - timer_download))
+    print(perf.format_peak_memory())
+    return config_file, None
+
+
+def get_export_settings():
+    # An export with other settings can't be updated incrementally
+    return [_DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN, _ACRONYSM_TO_SKIP_IN_EPG_NAME, _OPTIMIZE_NSG_RULES,
+            _SPLIT_OVERSIZED_NSGS, _NSG_OVER_ALLOWED_RULES, port_numbers._SERVICE_TABLE_VERSION,
+            oci._TRANSLATION_VERSION]
 
-    filename = '{}-{}-{}.json'.format(host, ten, date.today())
 
-    print(f'Saving tenant to {filename}\n')
-    with open(_DATA_DIR + filename, 'w') as file_write:
-        json.dump(aci_tenant_config, file_write)
+def read_export_state(export_dir):
+    try:
+        with open(export_dir + _EXPORT_STATE_FILE, 'r') as file_read:
+            return json.load(file_read)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_export_state(export_dir, config_file, aci_tenant_data):
+    export_state = {'config_file': config_file, 'settings': get_export_settings()}
+    if _INCREMENTAL_TRANSLATION and config_file is not None:
+        # The tenant exported is kept, the configuration file may be edited or removed before the next export
+        config_hash = model_cache.save_model(config_file, aci_tenant_data, export_dir + _EXPORT_MODEL_FILE)
+        if config_hash is not None:
+            export_state['config_hash'] = config_hash.hex()
+    oci.write_file_atomic(export_dir + _EXPORT_STATE_FILE, json.dumps(export_state).encode('utf-8'))
+
+
+def get_changed_nsgs(config_file, aci_tenant_data, contract_index, export_dir):
+    # NSGs to translate again since the last export to export_dir, None to translate all of them
+    export_state = read_export_state(export_dir)
+    previous_config_hash = export_state.get('config_hash')
+    if not _INCREMENTAL_TRANSLATION or config_file is None or previous_config_hash is None \
+            or export_state.get('settings') != get_export_settings():
+        return None
+
+    if model_cache.hash_file(config_file).hex() == previous_config_hash:
+        print('Same configuration as the last export, there is nothing to translate')
+        return set()
+
+    previous_tenant_data = model_cache.load_model_copy(export_dir + _EXPORT_MODEL_FILE,
+                                                       bytes.fromhex(previous_config_hash))
+    if previous_tenant_data is None:
+        print('The configuration of the last export is missing, translating all the NSGs')
+        return None
+
+    previous_contract_index = aci.build_contract_index(previous_tenant_data[0], _ACRONYSM_TO_SKIP_IN_EPG_NAME)
+    changed_nsgs, report = tenant_diff.diff_tenants(previous_tenant_data, aci_tenant_data,
+                                                    previous_contract_index, contract_index)
+    print('Changed since {}: {} filters, {} contracts, {} EPGs. NSGs to translate: {}'.format(
+        export_state['config_file'], report['filters'], report['contracts'], report['epgs'], report['nsgs']))
+    return changed_nsgs
+
+
+def translate_config(aci_tenant_data, contract_index, export_dir, only_nsgs=None):
+    # Returns the OCI NSGs and the NSGs translated, None when all of them were
+    full_aep, full_contract, full_filter = aci_tenant_data[0], aci_tenant_data[3], aci_tenant_data[5]
+    previous_split_nsgs = set()
+    if only_nsgs is not None:
+        previous_split_nsgs = oci.get_split_nsgs(export_dir)
+
+    print('Translating to OCI structure...')
+    timer_processing_to_oci = perf_counter()
+    oci_dict = oci.export_to_oci_format(full_aep, full_contract, full_filter, _DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN,
+                                        _ACRONYSM_TO_SKIP_IN_EPG_NAME, contract_index, only_nsgs)
+    print('\nProcessing time: {:0.4f} seconds\n'.format(perf_counter() - timer_processing_to_oci))
 
-    return aci_tenant_config
+    if _OPTIMIZE_NSG_RULES:
+        print('\n[ Optimize OCI rules ]\n')
+        timer_processing_to_oci = perf_counter()
+        oci.optimize_nsg_rules(oci_dict)
+        print('\nProcessing time: {:0.4f} seconds\n'.format(perf_counter() - timer_processing_to_oci))
+
+    if _SPLIT_OVERSIZED_NSGS:
+        print('\n[ Split NSGs over the rules limit ]\n')
+        timer_processing_to_oci = perf_counter()
+        oci_dict = oci.split_oversized_nsgs(oci_dict, _NSG_OVER_ALLOWED_RULES,
+                                            previous_split_nsgs - (only_nsgs or set()))
+        print('\nProcessing time: {:0.4f} seconds\n'.format(perf_counter() - timer_processing_to_oci))
+
+        # An NSG split or joined again changes the rules of the NSGs pointing to it
+        if only_nsgs is not None:
+            split_nsgs = {resources['split_from'] for resources in oci_dict.values() if 'split_from' in resources}
+            peers = tenant_diff.get_contract_peers(contract_index, (previous_split_nsgs ^ split_nsgs) & only_nsgs)
+            if len(peers - only_nsgs) != 0:
+                print('Translating again with the {} NSGs pointing to NSGs split or joined'.format(
+                    len(peers - only_nsgs)))
+                return translate_config(aci_tenant_data, contract_index, export_dir, only_nsgs | peers)
+
+    return oci_dict, only_nsgs
+
+
+def batch_download_config(apic, snapshot_store, ten):
+    timer_download = perf_counter()
+    with perf.span('stage.download'):
+        config_file = snapshot_store.get_tenant_snapshot(apic, ten)
+    return config_file, perf_counter() - timer_download
+
+
+def batch_export_config(ten, config_file):
+    # Runs in a worker process. Messages go to a log next to the tenant Terraform files.
+    export_dir = _EXPORT_TO_DIR + ten + '/'
+    if not os.path.exists(export_dir):
+        os.makedirs(export_dir)
+
+    for terraform_file in _BATCH_TERRAFORM_FILES:
+        if os.path.exists(_EXPORT_TO_DIR + terraform_file) and not os.path.exists(export_dir + terraform_file):
+            shutil.copy(_EXPORT_TO_DIR + terraform_file, export_dir + terraform_file)
+
+    result = {'tenant': ten}
+    with open(export_dir + 'export.log', 'w') as log_file, contextlib.redirect_stdout(log_file):
+        timer_processing = perf_counter()
+        aci_tenant_data = extract_config(config_file)
+        contract_index = aci.build_contract_index(aci_tenant_data[0], _ACRONYSM_TO_SKIP_IN_EPG_NAME)
+        result['extract'] = perf_counter() - timer_processing
+
+        timer_processing = perf_counter()
+        changed_nsgs = get_changed_nsgs(config_file, aci_tenant_data, contract_index, export_dir)
+        oci_dict, changed_nsgs = translate_config(aci_tenant_data, contract_index, export_dir, changed_nsgs)
+        result['translate'] = perf_counter() - timer_processing
+
+        timer_processing = perf_counter()
+        oci.save_oci_files(oci_dict, export_dir, _NSG_OVER_ALLOWED_RULES, changed_nsgs)
+        write_export_state(export_dir, config_file, aci_tenant_data)
+        result['save'] = perf_counter() - timer_processing
+
+    result['nsgs'] = len(oci_dict)
+    result['rules'] = sum(len(nsg['resources']) for nsg in oci_dict.values())
+    return result
+
+
+def batch_export(host, username, password, tenant_names, connections, workers):
+    # multiprocessing is only imported in batch mode
+    from concurrent.futures import ProcessPoolExecutor
+
+    print('\n[ Batch export ]\n')
+    apic = aci.ApicSession(host, username, password, pool_size=connections)
+    if apic.login() is None:
+        print('Logging Failed')
+        sys.exit(1)
+
+    all_tenants = aci.get_tenants(apic)
+    if all_tenants is None:
+        sys.exit(1)
+
+    if not tenant_names:
+        tenant_names = all_tenants
+
+    summary = {}
+    for ten in tenant_names:
+        summary[ten] = {'tenant': ten, 'status': 'OK'}
+        if ten not in all_tenants:
+            summary[ten]['status'] = 'not found'
+
+    snapshot_store = snapshot.SnapshotStore(_SNAPSHOT_DIR)
+    timer_batch = perf_counter()
+    with ThreadPoolExecutor(max_workers=connections) as download_pool, \
+            ProcessPoolExecutor(max_workers=workers, initializer=set_custom_variables,
+                                initargs=get_custom_variables()) as export_pool:
+        downloads = {download_pool.submit(batch_download_config, apic, snapshot_store, ten): ten
+                     for ten in tenant_names if summary[ten]['status'] == 'OK'}
+        exports = {}
+
+        # Each tenant is translated as soon as its download finishes
+        for future in as_completed(downloads):
+            ten = downloads[future]
+            try:
+                config_file, summary[ten]['download'] = future.result()
+            except Exception as e:
+                config_file = None
+                print(f'\n[!] {ten}: {e}')
+
+            if config_file is None:
+                summary[ten]['status'] = 'download failed'
+            else:
+                exports[export_pool.submit(batch_export_config, ten, config_file)] = ten
+
+        for future in as_completed(exports):
+            ten = exports[future]
+            try:
+                summary[ten].update(future.result())
+            except Exception as e:
+                summary[ten]['status'] = 'export failed'
+                print(f'\n[!] {ten}: {e}')
+
+    apic.close()
+    print(nice_print_batch_summary(summary.values()))
+    print(aci.nice_print_request_metrics(apic.get_metrics()))
+    print('\nBatch time: {:0.4f} seconds\n'.format(perf_counter() - timer_batch))
+
+
+def nice_print_batch_summary(results):
+    text = '\n{:<30} {:>10} {:>10} {:>10} {:>10} {:>7} {:>8}  {:<16}\n'.format(
+        'Tenant', 'Download', 'Extract', 'Translate', 'Save', 'NSGs', 'Rules', 'Status')
+    text += '=' * 110 + '\n'
+
+    for result in results:
+        text += '{:<30} {:>10} {:>10} {:>10} {:>10} {:>7} {:>8}  {:<16}\n'.format(
+            result['tenant'],
+            *['{:0.2f}'.format(result[stage]) if stage in result else '-'
+              for stage in ('download', 'extract', 'translate', 'save')],
+            result.get('nsgs', '-'), result.get('rules', '-'), result['status'])
+    return text
+
+
+def set_custom_variables(export_to_dir, nsg_over_allowed_rules, acronysm_to_skip_in_epg_name,
+                         default_permit_all_egress_and_icmp_in):
+    # Custom variables given in the command line, also set in every batch worker process
+    global _EXPORT_TO_DIR, _NSG_OVER_ALLOWED_RULES, _ACRONYSM_TO_SKIP_IN_EPG_NAME, \
+        _DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN
+    _EXPORT_TO_DIR = os.path.join(export_to_dir, '')
+    _NSG_OVER_ALLOWED_RULES = nsg_over_allowed_rules
+    _ACRONYSM_TO_SKIP_IN_EPG_NAME = acronysm_to_skip_in_epg_name
+    _DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN = default_permit_all_egress_and_icmp_in
+
+
+def get_custom_variables():
+    return _EXPORT_TO_DIR, _NSG_OVER_ALLOWED_RULES, _ACRONYSM_TO_SKIP_IN_EPG_NAME, \
+        _DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN
+
+
+def write_oci_json(oci_dict, output):
+    # The translated NSGs as a single JSON document, - for stdout
+    if output == '-':
+        json.dump(oci_dict, sys.stdout)
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+    else:
+        with open(output, 'w') as file_write:
+            json.dump(oci_dict, file_write)
+
+
+def file_export(config_file, output_format, output):
+    # Non interactive export of a tenant file or snapshot, - to read it from stdin.
+    # Only the output goes to stdout, the messages go to stderr.
+    with contextlib.redirect_stdout(sys.stderr):
+        with perf.span('stage.extract'):
+            if config_file == '-':
+                config_file = None
+                aci_tenant_data = aci.extract_data_from_stream(snapshot.open_stream(sys.stdin.buffer))
+            else:
+                aci_tenant_data = extract_config(config_file)
+            contract_index = aci.build_contract_index(aci_tenant_data[0], _ACRONYSM_TO_SKIP_IN_EPG_NAME)
+
+        if output_format == 'json':
+            with perf.span('stage.translate'):
+                oci_dict, changed_nsgs = translate_config(aci_tenant_data, contract_index, _EXPORT_TO_DIR)
+        else:
+            with perf.span('stage.translate'):
+                changed_nsgs = get_changed_nsgs(config_file, aci_tenant_data, contract_index, _EXPORT_TO_DIR)
+                oci_dict, changed_nsgs = translate_config(aci_tenant_data, contract_index, _EXPORT_TO_DIR,
+                                                          changed_nsgs)
+            with perf.span('stage.save'):
+                oci.save_oci_files(oci_dict, _EXPORT_TO_DIR, _NSG_OVER_ALLOWED_RULES, changed_nsgs)
+                write_export_state(_EXPORT_TO_DIR, config_file, aci_tenant_data)
+            print('\nFiles created in {}'.format(_EXPORT_TO_DIR))
+
+    if output_format == 'json':
+        with perf.span('stage.save'):
+            write_oci_json(oci_dict, output)
+
+
+def download_only(host, username, password, tenant_names):
+    # Downloads the tenants to the snapshot store and prints their files, one per line, for the next stage
+    with contextlib.redirect_stdout(sys.stderr):
+        apic = aci.ApicSession(host, username, password)
+        if apic.login() is None:
+            print('Logging Failed')
+            sys.exit(1)
+
+        all_tenants = aci.get_tenants(apic, show=False)
+        if all_tenants is None:
+            sys.exit(1)
+
+        snapshot_store = snapshot.SnapshotStore(_SNAPSHOT_DIR)
+        config_files = []
+        for ten in tenant_names or all_tenants:
+            if ten not in all_tenants:
+                print('[!] Tenant {} not found'.format(ten))
+                continue
+            config_file, download_time = batch_download_config(apic, snapshot_store, ten)
+            if config_file is None:
+                print('[!] Tenant {} download failed'.format(ten))
+                continue
+            print('Tenant {} downloaded to {} in {:0.2f} seconds'.format(ten, config_file, download_time))
+            config_files.append(config_file)
+        apic.close()
+
+    for config_file in config_files:
+        print(config_file)
+    if len(config_files) != len(tenant_names or all_tenants):
+        sys.exit(1)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Export Cisco ACI tenants to OCI Terraform files. '
+                                                 'Without arguments the script runs interactively.')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--file', help='tenant JSON file or snapshot to export, - to read it from stdin')
+    source.add_argument('--host', help='APIC host, the tenants are downloaded and exported')
+    parser.add_argument('--tenants', nargs='*', default=[], help='tenants to export, all tenants when not given')
+    parser.add_argument('--download-only', action='store_true',
+                        help='only download the --host tenants and print their snapshot files')
+    parser.add_argument('--credentials', help='file with APIC_USERNAME=... and APIC_PASSWORD=... lines, '
+                                              'the environment variables with these names are used otherwise')
+    parser.add_argument('--format', choices=['terraform', 'json'], default='terraform',
+                        help='Terraform files in the output directory, or the NSGs as one JSON document '
+                             '(--file only)')
+    parser.add_argument('--output', default='-', help='file for --format json, - for stdout')
+    parser.add_argument('--output-dir', default=_EXPORT_TO_DIR,
+                        help='Terraform files directory, a directory per tenant in batch mode')
+    parser.add_argument('--nsg-max-rules', type=int, default=_NSG_OVER_ALLOWED_RULES,
+                        help='NSGs with more rules are split')
+    parser.add_argument('--skip-epg-names', nargs='*', default=_ACRONYSM_TO_SKIP_IN_EPG_NAME,
+                        help='EPGs with any of these in the name are not exported')
+    parser.add_argument('--default-permit', dest='default_permit', action='store_true',
+                        help='permit all egress and ICMP ingress in every NSG, instead of the consumed contracts')
+    parser.add_argument('--no-default-permit', dest='default_permit', action='store_false',
+                        help='permit only the consumed contracts')
+    parser.set_defaults(default_permit=_DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN)
+    parser.add_argument('--connections', type=int, default=_BATCH_APIC_CONNECTIONS,
+                        help='tenants downloaded at the same time')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes used for the translation, one per CPU by default')
+    return parser.parse_args()
 
 
 def main():
+    args = parse_arguments()
+    set_custom_variables(args.output_dir, args.nsg_max_rules, args.skip_epg_names, args.default_permit)
+
+    if args.file is not None:
+        file_export(args.file, args.format, args.output)
+        return
+
+    if args.host is not None:
+        username, password = aci.read_credentials(args.credentials)
+        if username is None or password is None:
+            print('Batch mode needs the APIC credentials, in --credentials or in the APIC_USERNAME '
+                  'and APIC_PASSWORD environment variables')
+            sys.exit(1)
+
+        if args.download_only:
+            download_only(args.host, username, password, args.tenants)
+        else:
+            batch_export(args.host, username, password, args.tenants, args.connections, args.workers)
+        return
+
     print('[ INIT ]\n')
     print('[ Select configuration ]\n')
     file_list = list_available_configurations()
@@ -107,10 +492,11 @@ def main():
     static_data = input('\nUse static pre downloaded data (y/n): ')
 
     if static_data.lower() == 'y':
-        aci_tenant_config = use_pre_downloaded_config(file_list)
+        config_file = use_pre_downloaded_config(file_list)
+        aci_tenant_data = None
 
     elif static_data.lower() == 'n':
-        aci_tenant_config = download_config()
+        config_file, aci_tenant_data = download_config()
 
     else:
         print('Invalid input')
@@ -120,23 +506,30 @@ def main():
     input('Press any key to start...\n')
     print('Processing...')
     timer_processing = perf_counter()
-    full_aep, num_aepg, num_epg, full_contract, num_con, full_filter, num_fil = aci.extract_data(aci_tenant_config)
+    with perf.span('stage.extract'):
+        if aci_tenant_data is None:
+            aci_tenant_data = extract_config(config_file)
+        full_aep, num_aepg, num_epg, full_contract, num_con, full_filter, num_fil = aci_tenant_data
+        contract_index = aci.build_contract_index(full_aep, _ACRONYSM_TO_SKIP_IN_EPG_NAME)
     # print(json.dumps(full_aep, indent=4))
     print('\nProcessing time: {:0.4f} seconds\n'.format(perf_counter() - timer_processing))
+    print(perf.format_peak_memory())
 
     print('\n[ Translate configuration to Oracle OCI ]\n')
     input('Press any key to start...\n')
-    print('Translating to OCI structure...')
-    timer_processing_to_oci = perf_counter()
-    oci_dict = oci.export_to_oci_format(full_aep, full_contract, full_filter, _DEFAULT_PERMIT_ALL_EGRESS_AND_ICMP_IN,
-                                        _ACRONYSM_TO_SKIP_IN_EPG_NAME)
-    print('\nProcessing time: {:0.4f} seconds\n'.format(perf_counter() - timer_processing_to_oci))
+    with perf.span('stage.translate'):
+        changed_nsgs = get_changed_nsgs(config_file, aci_tenant_data, contract_index, _EXPORT_TO_DIR)
+        oci_dict, changed_nsgs = translate_config(aci_tenant_data, contract_index, _EXPORT_TO_DIR, changed_nsgs)
+    print(perf.format_peak_memory())
 
     print('\n\n[ Saving OCI files ]\n')
     timer_processing_to_oci = perf_counter()
-    oci.save_oci_files(oci_dict, _EXPORT_TO_DIR, _NSG_OVER_ALLOWED_RULES)
+    with perf.span('stage.save'):
+        oci.save_oci_files(oci_dict, _EXPORT_TO_DIR, _NSG_OVER_ALLOWED_RULES, changed_nsgs)
+        write_export_state(_EXPORT_TO_DIR, config_file, aci_tenant_data)
     print('\nFiles created')
     print('\nProcessing time: {:0.4f} seconds\n'.format(perf_counter() - timer_processing_to_oci))
+    print(perf.format_peak_memory())
 
 
 if __name__ == '__main__':
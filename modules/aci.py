@@ -1,86 +1,429 @@
 # Modules to work with ACI
 
 import json
-import requests
-from requests.packages import urllib3
-
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-tenants = []
+import os
+import random
+import shutil
+import sys
+import threading
+from collections import deque
+from time import monotonic, perf_counter, sleep, time
+
+import modules.json_stream as json_stream
+import modules.model as model
+import modules.perf as perf
+
+_STREAM_CHUNK_SIZE = 1024 * 1024
+_ACI_REFRESH_TIMER = 55  # seconds before the token is refreshed with aaaRefresh
+_ACI_POOL_SIZE = 10  # keep-alive connections kept open to the APIC
+_ACI_TIMEOUT = (10, 300)  # seconds to connect, and seconds without receiving data, big tenants take minutes
+_ACI_RETRIES = 4  # tries after the first one of a failed call, see ApicSession
+_ACI_RETRY_BACKOFF = 1  # seconds before the first retry, doubled on every retry
+_ACI_MAX_RETRY_WAIT = 60  # seconds, longest wait before a retry, Retry-After of the APIC included
+_ACI_THROTTLED_STATUS = (429, 503)  # the APIC rejected the request without processing it
+_ACI_RETRY_STATUS = (429, 500, 502, 503, 504)
+_ACI_BREAKER_FAILURES = 5  # failed calls in a row that open the circuit breaker
+_ACI_BREAKER_RESET = 30  # seconds the circuit breaker stays open before a trial call
+_ACI_LATENCY_SAMPLES = 10000  # latest calls kept for the latency percentiles
+
+# Entries of a filter referenced by a subject but not found in the tenant
+_MISSING_FILTER = (model.FilterEntry('na', 'na', 'na', 'na', 'na'),)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Stops calling the APIC while it is failing. After failure_threshold failed calls in a row the
+    # breaker opens and the calls fail at once for reset_timeout seconds. Then a single trial call is
+    # let through (half open): if it works the breaker closes, if it fails it opens again.
+
+    def __init__(self, failure_threshold=_ACI_BREAKER_FAILURES, reset_timeout=_ACI_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_time = 0
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        # Returns None if the call is refused, otherwise the state it is let through in
+        with self.lock:
+            if self.state == 'open':
+                if monotonic() - self.opened_time < self.reset_timeout:
+                    return None
+                self.state = 'half open'
+                self.trial_running = False
+            if self.state == 'half open':
+                if self.trial_running:
+                    return None
+                self.trial_running = True
+            return self.state
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        # Returns True when this failure opened the breaker
+        with self.lock:
+            self.failures += 1
+            if self.state == 'open' or (self.state == 'closed' and self.failures < self.failure_threshold):
+                return False
+            self.state = 'open'
+            self.opened_time = monotonic()
+            self.trial_running = False
+            return True
 
+    def end_trial(self):
+        # A trial call ended without a result, the next call can be the trial
+        with self.lock:
+            self.trial_running = False
+
+    def get_retry_time(self):
+        # Seconds until the next trial call
+        with self.lock:
+            if self.state != 'open':
+                return 0
+            return max(0, self.reset_timeout - (monotonic() - self.opened_time))
+
+
+class RequestMetrics:
+    # Calls, retries and failures of an ApicSession, and the latency of its latest calls.
+    # The counters also go to the performance report (modules/perf.py) when it is enabled.
+
+    def __init__(self, latency_samples=_ACI_LATENCY_SAMPLES):
+        self.counters = {'requests': 0, 'retries': 0, 'throttled': 0, 'timeouts': 0, 'connection_errors': 0,
+                         'server_errors': 0, 'rejected': 0, 'failed': 0}
+        self.latencies = deque(maxlen=latency_samples)
+        self.lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+        perf.count('aci.apic_' + name, value)
+
+    def add_latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def get_metrics(self):
+        with self.lock:
+            metrics = dict(self.counters)
+            latencies = sorted(self.latencies)
+        for percentile in (50, 90, 99):
+            metrics['p{}_seconds'.format(percentile)] = get_percentile(latencies, percentile)
+        metrics['max_seconds'] = latencies[-1] if len(latencies) != 0 else None
+        return metrics
+
+
+def get_percentile(sorted_values, percentile):
+    # Nearest rank percentile
+    if len(sorted_values) == 0:
+        return None
+    return sorted_values[max(0, -(-len(sorted_values) * percentile // 100) - 1)]
+
+
+class ApicSession:
+    # Keep-alive session to one APIC, shared by all the calls of a script.
+    # The token is refreshed on demand with aaaRefresh, and a new login is done if the refresh fails.
+    # Every call has a timeout, the login and refresh included. GETs are retried with exponential backoff
+    # after timeouts, connection errors and 5xx, POSTs only when the APIC throttled them (429/503), as
+    # then they were not processed.
+    # The Retry-After of the APIC is honoured, and a circuit breaker stops the calls while it is failing.
+
+    def __init__(self, host, user, passwd, refresh_timer=_ACI_REFRESH_TIMER, pool_size=_ACI_POOL_SIZE,
+                 timeout=_ACI_TIMEOUT, retries=_ACI_RETRIES, breaker=None):
+        self.host = host
+        self.user = user
+        self.passwd = passwd
+        self.refresh_timer = refresh_timer
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = CircuitBreaker() if breaker is None else breaker
+        self.metrics = RequestMetrics()
+        self.token = None
+        self.token_time = 0
+        self.token_lock = threading.Lock()
+        requests = import_requests()
+        self.timeout_errors = (requests.exceptions.Timeout,)
+        self.request_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def url(self, path):
+        return 'https://{}{}'.format(self.host, path)
+
+    def set_token(self, data):
+        self.token = data['imdata'][0]['aaaLogin']['attributes']['token']
+        self.token_time = time()
+        self.session.cookies.clear()
+        self.session.cookies.set('APIC-cookie', self.token)
+
+    @perf.timed('aci.ApicSession.login')
+    def login(self):
+        dict_query_data = {"aaaUser": {"attributes": {"name": "", "pwd": ""}}}
+        dict_query_data['aaaUser']['attributes']['name'] = self.user
+        dict_query_data['aaaUser']['attributes']['pwd'] = self.passwd
+        aci_json_query_data = json.dumps(dict_query_data)
+        # A retried login only opens one more session on the APIC, so it is retried like a GET
+        data = self.read_request('POST', '/api/aaaLogin.json', aci_json_query_data, authenticate=False,
+                                 idempotent=True)
+
+        if data is not None:
+            self.set_token(data)
+            return self.token
+        else:
+            self.token = None
+            print('[!] Request Failed')
+            return None
+
+    @perf.timed('aci.ApicSession.refresh')
+    def refresh(self):
+        data = self.read_request('GET', '/api/aaaRefresh.json', authenticate=False)
+
+        if data is not None:
+            self.set_token(data)
+            return self.token
+        else:
+            print('Token refresh failed, re logging ...')
+            return self.login()
+
+    def check_token(self):
+        with self.token_lock:
+            if self.token is None:
+                self.login()
+            elif time() - self.token_time >= self.refresh_timer:
+                self.refresh()
+
+    def relogin(self, token_used):
+        # Only the first call finding the token expired logs in again
+        with self.token_lock:
+            if self.token == token_used:
+                print('Expired token, re logging ...')
+                self.login()
+
+    def send_checked(self, method, path, aci_json_query_data, stream, timeout):
+        # One call to the APIC. Returns the response, or the timeout or connection error, recorded by the
+        # breaker and metrics
+        allowed_state = self.breaker.allow()
+        if allowed_state is None:
+            self.metrics.count('rejected')
+            raise CircuitOpenError('APIC {} not called, too many failed calls. Next try in {:0.0f} seconds'.format(
+                self.host, self.breaker.get_retry_time()))
+
+        try:
+            self.metrics.count('requests')
+            timer_request = perf_counter()
+            try:
+                response = self.session.request(method, self.url(path), data=aci_json_query_data, stream=stream,
+                                                verify=False, timeout=timeout)
+            except self.request_errors as e:
+                self.metrics.count('timeouts' if isinstance(e, self.timeout_errors) else 'connection_errors')
+                self.record_failure()
+                return None, e
+            finally:
+                self.metrics.add_latency(perf_counter() - timer_request)
+
+            if response.status_code in _ACI_THROTTLED_STATUS:
+                self.metrics.count('throttled')
+            if response.status_code >= 500:
+                self.metrics.count('server_errors')
+            if response.status_code >= 500 or response.status_code in _ACI_THROTTLED_STATUS:
+                self.record_failure()
+            else:
+                self.breaker.record_success()
+            return response, None
+        finally:
+            # Any other error of the trial call must not leave the breaker waiting for it forever
+            if allowed_state == 'half open':
+                self.breaker.end_trial()
+
+    def record_failure(self):
+        if self.breaker.record_failure():
+            print('[!] APIC {} is failing, no calls for {} seconds'.format(self.host, self.breaker.reset_timeout))
+
+    def can_retry(self, idempotent, response, attempt):
+        if idempotent:
+            return attempt < self.retries and (response is None or response.status_code in _ACI_RETRY_STATUS)
+        return attempt < self.retries and response is not None and \
+            response.status_code in _ACI_THROTTLED_STATUS
+
+    @perf.timed('aci.ApicSession.request')
+    def request(self, method, path, aci_json_query_data='', stream=False, timeout=None, authenticate=True,
+                idempotent=None):
+        # Raises the timeout or connection error of the last try, or CircuitOpenError.
+        # authenticate=False is for the login and refresh calls, which must not check the token themselves
+        timeout = self.timeout if timeout is None else timeout
+        idempotent = method == 'GET' if idempotent is None else idempotent
+        relogged = not authenticate
+        attempt = 0
+        while True:
+            if authenticate:
+                self.check_token()
+            token_used = self.token
+            response, error = self.send_checked(method, path, aci_json_query_data, stream, timeout)
+
+            if not relogged and response is not None and response.status_code in (401, 403):
+                # token expired or invalidated by the APIC
+                response.close()
+                self.relogin(token_used)
+                relogged = True
+                continue
+            if not self.can_retry(idempotent, response, attempt):
+                break
+
+            wait = get_retry_wait(response, attempt)
+            reason = error.__class__.__name__ if response is None else 'HTTP {}'.format(response.status_code)
+            print('[!] {} {}: {}, retry {} of {} in {:0.1f} seconds'.format(
+                method, path, reason, attempt + 1, self.retries, wait))
+            if response is not None:
+                response.close()
+            self.metrics.count('retries')
+            sleep(wait)
+            attempt += 1
+
+        if response is None or response.status_code >= 500 or response.status_code in _ACI_THROTTLED_STATUS:
+            self.metrics.count('failed')
+        if response is None:
+            raise error
+        return response
+
+    def read_request(self, method, path, aci_json_query_data='', timeout=None, authenticate=True,
+                     idempotent=None):
+        try:
+            response = self.request(method, path, aci_json_query_data, timeout=timeout,
+                                    authenticate=authenticate, idempotent=idempotent)
+        except (CircuitOpenError,) + self.request_errors as e:
+            print('[!] Request Failed: {}'.format(e))
+            return None
+        return read_response(response, self.url(path))
+
+    def get(self, path, timeout=None):
+        return self.read_request('GET', path, timeout=timeout)
+
+    def post(self, path, aci_json_query_data, timeout=None):
+        return self.read_request('POST', path, aci_json_query_data, timeout=timeout)
+
+    def get_metrics(self):
+        metrics = self.metrics.get_metrics()
+        metrics['breaker'] = self.breaker.state
+        return metrics
+
+    def close(self):
+        self.session.close()
+
+
+def get_retry_wait(response, attempt):
+    # Retry-After in seconds of the APIC, or exponential backoff with jitter
+    retry_after = None if response is None else response.headers.get('Retry-After', '')
+    if retry_after is not None and retry_after.strip().isdigit():
+        return min(int(retry_after), _ACI_MAX_RETRY_WAIT)
+    backoff = min(_ACI_RETRY_BACKOFF * 2 ** attempt, _ACI_MAX_RETRY_WAIT)
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+def nice_print_request_metrics(metrics):
+    def format_seconds(seconds):
+        return '-' if seconds is None else '{:0.3f}'.format(seconds)
+
+    text = '\nAPIC requests: {requests}, retries: {retries}, failed: {failed}, throttled: {throttled}, ' \
+           'timeouts: {timeouts}, connection errors: {connection_errors}, 5xx: {server_errors}, ' \
+           'rejected by the circuit breaker ({breaker}): {rejected}\n'.format(**metrics)
+    text += 'Latency seconds p50: {}, p90: {}, p99: {}, max: {}'.format(
+        *[format_seconds(metrics[key]) for key in ('p50_seconds', 'p90_seconds', 'p99_seconds', 'max_seconds')])
+    return text
+
+
+def import_requests():
+    # requests is imported by the first APIC connection only, the tenant files are processed without it
+    import requests
+    import requests.adapters
+    import urllib3
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    return requests
+
+
+def read_response(response, api_url_base):
+    if check_response_status(response, api_url_base):
+        return json.loads(response.content.decode('utf-8'))
+    return None
 
-def get_post_uri(api_url_base, headers, aci_json_query_data, is_get):
-    if is_get:
-        response = requests.get(api_url_base, headers=headers, data=aci_json_query_data, verify=False)
-    else:
-        response = requests.post(api_url_base, headers=headers, data=aci_json_query_data, verify=False)
 
+def check_response_status(response, api_url_base):
     if response.status_code >= 500:
         print('[!] [{0}] Server Error'.format(response.status_code))
-        return None
+        return False
     elif response.status_code == 404:
         print('[!] [{0}] URL not found: [{1}]'.format(response.status_code, api_url_base))
-        return None
+        return False
     elif response.status_code == 401:
         print('[!] [{0}] Authentication Failed'.format(response.status_code))
-        return None
+        return False
     elif response.status_code == 400:
         print('[!] [{0}] Bad Request'.format(response.status_code))
-        return None
+        return False
     elif response.status_code >= 300:
         print('[!] [{0}] Unexpected Redirect'.format(response.status_code))
-        return None
+        return False
     elif response.status_code == 200:
-        return json.loads(response.content.decode('utf-8'))
+        return True
     else:
         print('[?] Unexpected Error: [HTTP {0}]: Content: {1}'.format(response.status_code, response.content))
-    return None
+    return False
 
 
-def login(host, user, passwd):
-    api_url_base = 'https://{}/api/aaaLogin.json'.format(host)
-    headers = {'Content-Type': 'application/json'}
-    dict_query_data = {"aaaUser": {"attributes": {"name": "", "pwd": ""}}}
-    dict_query_data['aaaUser']['attributes']['name'] = user
-    dict_query_data['aaaUser']['attributes']['pwd'] = passwd
-    aci_json_query_data = json.dumps(dict_query_data)
-    data = get_post_uri(api_url_base, headers, aci_json_query_data, is_get=False)
+def read_credentials(credentials_file=None):
+    # APIC username and password from a file of APIC_USERNAME=... and APIC_PASSWORD=... lines,
+    # or from the environment variables with the same names
+    credentials = {}
+    if credentials_file is not None:
+        try:
+            with open(credentials_file, 'r') as file_read:
+                for line in file_read:
+                    key, separator, value = line.strip().partition('=')
+                    if separator and not key.startswith('#'):
+                        credentials[key.strip()] = value.strip()
+        except OSError as e:
+            print('[!] Credentials file not read: {}'.format(e))
+            return None, None
 
-    if data is not None:
-        return data['imdata'][0]['aaaLogin']['attributes']['token']
-    else:
-        print('[!] Request Failed')
-        return None
+    return credentials.get('APIC_USERNAME', os.environ.get('APIC_USERNAME')), \
+        credentials.get('APIC_PASSWORD', os.environ.get('APIC_PASSWORD'))
 
 
-def get_tenants(host, token2):
-    api_url_base = 'https://{}/api/node/class/fvTenant.json'.format(host)
-    token2 = 'APIC-cookie=' + token2
-    headers = {'Content-Type': 'application/json', 'Cookie': token2}
-    aci_json_query_data = ''
-    data = get_post_uri(api_url_base, headers, aci_json_query_data, is_get=True)
+@perf.timed('aci.get_tenants')
+def get_tenants(apic, show=True):
+    # Names of the tenants, printed with show
+    data = apic.get('/api/node/class/fvTenant.json')
 
     if data is not None:
-        # print(json.dumps(data, indent=4))
-        print('\nTenants List\n------------')
-        for item in data['imdata']:
-            print(item['fvTenant']['attributes']['name'])
-            tenants.append(item['fvTenant']['attributes']['name'])
+        tenants = [item['fvTenant']['attributes']['name'] for item in data['imdata']]
+        if show:
+            print('\nTenants List\n------------')
+            print('\n'.join(tenants))
         return tenants
     else:
         print('[!] Request Failed')
         return None
 
 
-def get_tenant(host, token2, tena):
-    api_url_base = 'https://{}/api/class/fvTenant.json?query-target-filter=eq(fvTenant.name,"{}")&rsp-subtree=' \
-                   'full&rsp-prop-include=config-only'.format(host, tena)
-    token2 = 'APIC-cookie=' + token2
-    headers = {'Content-Type': 'application/json', 'Cookie': token2}
-    aci_json_query_data = ''
+def get_tenant_path(tena):
+    return '/api/class/fvTenant.json?query-target-filter=eq(fvTenant.name,"{}")&rsp-subtree=' \
+           'full&rsp-prop-include=config-only'.format(tena)
+
+
+@perf.timed('aci.get_tenant')
+def get_tenant(apic, tena, show=False):
+    # show pretty prints the whole tenant, it can take longer than the download for big tenants
     print('\nGetting Tenant {} detail - Only Configuration - Subtree - JSON ...'.format(tena))
-    data = get_post_uri(api_url_base, headers, aci_json_query_data, is_get=True)
-    show = False
+    data = apic.get(get_tenant_path(tena))
 
     if data is not None:
         if show:
@@ -92,7 +435,49 @@ def get_tenant(host, token2, tena):
         return None
 
 
+def get_tenant_stream(apic, tena):
+    # Returns the raw HTTP response as a file object, to be saved or parsed while it is being received
+    print('\nGetting Tenant {} detail - Only Configuration - Subtree - JSON stream ...'.format(tena))
+    try:
+        response = apic.request('GET', get_tenant_path(tena), stream=True)
+    except (CircuitOpenError,) + apic.request_errors as e:
+        print('[!] Request Failed: {}'.format(e))
+        return None
+
+    if check_response_status(response, apic.url(get_tenant_path(tena))):
+        response.raw.decode_content = True
+        return response.raw
+    else:
+        response.close()
+        print('[!] Request Failed')
+        return None
+
+
+@perf.timed('aci.download_tenant')
+def download_tenant(apic, tena, file_write):
+    tenant_stream = get_tenant_stream(apic, tena)
+    if tenant_stream is None:
+        return False
+
+    with tenant_stream:
+        shutil.copyfileobj(tenant_stream, file_write, _STREAM_CHUNK_SIZE)
+    return True
+
+
+@perf.timed('aci.extract_data')
 def extract_data(data_dict):
+    tenant_children = data_dict['imdata'][0]['fvTenant']['children']
+    # print(json.dumps(tenant_children, indent=4))
+    return extract_tenant_children(tenant_children)
+
+
+@perf.timed('aci.extract_data_from_stream')
+def extract_data_from_stream(stream):
+    # Same as extract_data, but walks a file or HTTP response without loading the whole document
+    return extract_tenant_children(json_stream.iter_tenant_children(stream))
+
+
+def extract_tenant_children(tenant_children):
     number_of_contracts = 0
     number_of_filters = 0
     number_of_app_profile = 0
@@ -100,67 +485,20 @@ def extract_data(data_dict):
     full_contract_rules = {}
     full_filter_rules = {}
     full_aep_list = []
-    tenant_children = data_dict['imdata'][0]['fvTenant']['children']
-    # print(json.dumps(tenant_children, indent=4))
 
     for t_child in tenant_children:
 
         if 'vzBrCP' in t_child.keys():  # is a Contract
             number_of_contracts += 1
-            contract_name = t_child['vzBrCP']['attributes']['name']
-            contract_children_subj = t_child['vzBrCP']['children']
-            subj_list = []
-
-            for c_child_subj in contract_children_subj:
-                if 'vzSubj' in c_child_subj:  # is Subject
-                    subj_name = (c_child_subj['vzSubj']['attributes']['name'])
-                    subj_reverse_ports = (c_child_subj['vzSubj']['attributes']['revFltPorts'])
-                    subject_children_filter = c_child_subj['vzSubj']['children']
-                    subj_filter_list = []
-                    for s_child_filter in subject_children_filter:
-                        if 'vzRsSubjFiltAtt' in s_child_filter:  # is Subj_filter
-                            subj_filter_list.append((s_child_filter['vzRsSubjFiltAtt']['attributes']['action'],
-                                                     s_child_filter['vzRsSubjFiltAtt']['attributes']['tnVzFilterName']))
-
-                        if 'vzInTerm' in s_child_filter:
-                            if 'children' in s_child_filter['vzInTerm']:
-                                for item in s_child_filter['vzInTerm']['children']:
-                                    if 'vzRsFiltAtt' in item:
-                                        subj_filter_list.append((item['vzRsFiltAtt']['attributes']['action'],
-                                                                 item['vzRsFiltAtt']['attributes']['tnVzFilterName']))
-
-                        if 'vzOutTerm' in s_child_filter:
-                            if 'children' in s_child_filter['vzOutTerm']:
-                                for item in s_child_filter['vzOutTerm']['children']:
-                                    if 'vzRsFiltAtt' in item:
-                                        subj_filter_list.append((item['vzRsFiltAtt']['attributes']['action'],
-                                                                 item['vzRsFiltAtt']['attributes']['tnVzFilterName']))
-
-                    subj_list.append((subj_name, subj_reverse_ports, subj_filter_list))
-
-            # print(contract_name, str(subj_list))
-
-            for item in subj_list:
-                for rules in item[2]:
-                    if contract_name in full_contract_rules.keys():
-                        full_contract_rules[contract_name].append([item[0], item[1], rules[0], rules[1]])
-                    else:
-                        full_contract_rules[contract_name] = [[item[0], item[1], rules[0], rules[1]]]
+            contract = model.make_contract(t_child['vzBrCP']['attributes']['name'],
+                                           extract_contract(t_child['vzBrCP']))
+            if len(contract.subjects) != 0:
+                full_contract_rules[contract.name] = contract
 
         elif 'vzFilter' in t_child.keys():  # is a Filter
             number_of_filters += 1
-            filter_name = t_child['vzFilter']['attributes']['name']
-            filter_children = t_child['vzFilter']['children']
-            fe_list = []
-            for f_child in filter_children:
-                fe_name = f_child['vzEntry']['attributes']['name']
-                fe_protocol = f_child['vzEntry']['attributes']['prot']
-                fe_destination_from_port = f_child['vzEntry']['attributes']['dFromPort']
-                fe_destination_to_port = f_child['vzEntry']['attributes']['dToPort']
-                fe_stateful = f_child['vzEntry']['attributes']['stateful']
-                fe_list.append([fe_name, fe_protocol, fe_destination_from_port, fe_destination_to_port, fe_stateful])
-
-            full_filter_rules[filter_name] = fe_list
+            filter_name = sys.intern(t_child['vzFilter']['attributes']['name'])
+            full_filter_rules[filter_name] = extract_filter(t_child['vzFilter'])
 
         elif 'fvAp' in t_child.keys():  # is a Application Profile
             number_of_app_profile += 1
@@ -180,44 +518,146 @@ def extract_data(data_dict):
                         elif 'fvRsProv' in epg_child.keys():  # provide contract
                             provided_contract_list.append(epg_child['fvRsProv']['attributes']['tnVzBrCPName'])
 
-                    epg_list.append([epg_name, provided_contract_list, consumed_contract_list])
-            full_aep_list.append([app_profile_name, epg_list])
+                    epg_list.append(model.make_epg(epg_name, provided_contract_list, consumed_contract_list))
+            full_aep_list.append(model.make_app_profile(app_profile_name, epg_list))
 
+    perf.count('aci.app_profiles', number_of_app_profile)
+    perf.count('aci.epgs', number_of_epg)
+    perf.count('aci.contracts', number_of_contracts)
+    perf.count('aci.filters', number_of_filters)
     return full_aep_list, number_of_app_profile, number_of_epg, \
            full_contract_rules, number_of_contracts, \
            full_filter_rules, number_of_filters
 
 
+@perf.timed('aci.extract_contract')
+def extract_contract(contract_mo):
+    contract_children_subj = contract_mo.get('children', [])
+    subj_list = []
+    contract_rules = []
+
+    for c_child_subj in contract_children_subj:
+        if 'vzSubj' in c_child_subj:  # is Subject
+            subj_name = (c_child_subj['vzSubj']['attributes']['name'])
+            subj_reverse_ports = (c_child_subj['vzSubj']['attributes']['revFltPorts'])
+            subject_children_filter = c_child_subj['vzSubj'].get('children', [])
+            subj_filter_list = []
+            for s_child_filter in subject_children_filter:
+                if 'vzRsSubjFiltAtt' in s_child_filter:  # is Subj_filter
+                    subj_filter_list.append((s_child_filter['vzRsSubjFiltAtt']['attributes']['action'],
+                                             s_child_filter['vzRsSubjFiltAtt']['attributes']['tnVzFilterName']))
+
+                if 'vzInTerm' in s_child_filter:
+                    if 'children' in s_child_filter['vzInTerm']:
+                        for item in s_child_filter['vzInTerm']['children']:
+                            if 'vzRsFiltAtt' in item:
+                                subj_filter_list.append((item['vzRsFiltAtt']['attributes']['action'],
+                                                         item['vzRsFiltAtt']['attributes']['tnVzFilterName']))
+
+                if 'vzOutTerm' in s_child_filter:
+                    if 'children' in s_child_filter['vzOutTerm']:
+                        for item in s_child_filter['vzOutTerm']['children']:
+                            if 'vzRsFiltAtt' in item:
+                                subj_filter_list.append((item['vzRsFiltAtt']['attributes']['action'],
+                                                         item['vzRsFiltAtt']['attributes']['tnVzFilterName']))
+
+            subj_list.append((subj_name, subj_reverse_ports, subj_filter_list))
+
+    for item in subj_list:
+        for rules in item[2]:
+            contract_rules.append(model.make_subject(item[0], item[1], rules[0], rules[1]))
+
+    return contract_rules
+
+
+@perf.timed('aci.extract_filter')
+def extract_filter(filter_mo):
+    filter_children = filter_mo.get('children', [])
+    fe_list = []
+    for f_child in filter_children:
+        fe_name = f_child['vzEntry']['attributes']['name']
+        fe_protocol = f_child['vzEntry']['attributes']['prot']
+        fe_destination_from_port = f_child['vzEntry']['attributes']['dFromPort']
+        fe_destination_to_port = f_child['vzEntry']['attributes']['dToPort']
+        fe_stateful = f_child['vzEntry']['attributes']['stateful']
+        fe_list.append(model.make_filter_entry(fe_name, fe_protocol, fe_destination_from_port,
+                                               fe_destination_to_port, fe_stateful))
+
+    return tuple(fe_list)
+
+
+@perf.timed('aci.get_filter')
 def get_filter(f_f, f_n):
     if f_n in f_f.keys():
         return f_f[f_n]
     else:
-        return [['na', 'na', 'na', 'na', 'na']]
+        return _MISSING_FILTER
 
 
+@perf.timed('aci.get_provider_epg')
 def get_provider_epg(full_aep, consumed_contract_name):
     contract_provider_list = []
 
     for aep1 in full_aep:
-        for epg1 in aep1[1]:
-            if consumed_contract_name in epg1[1] and '-BD' not in epg1[0] and 'VLAN' not in epg1[0]:
-                contract_provider_list.append(aep1[0] + "-" + epg1[0])
+        for epg1 in aep1.epgs:
+            if consumed_contract_name in epg1.provided and '-BD' not in epg1.name and 'VLAN' not in epg1.name:
+                contract_provider_list.append(aep1.name + "-" + epg1.name)
 
     return contract_provider_list
 
 
+@perf.timed('aci.build_contract_index')
+def build_contract_index(full_aep, _acronysm_to_skip_in_epg_name):
+    # Index the provider/consumer relations once, so the exporter doesn't rescan full_aep for every filter entry
+    contract_providers = {}
+    contract_consumers = {}
+    epg_contracts = {}
+
+    for aep1 in full_aep:
+        for epg1 in aep1.epgs:
+            if skip_aci_epg_name(epg1.name, _acronysm_to_skip_in_epg_name):
+                continue
+
+            epg_full_name = aep1.name + "-" + epg1.name
+            epg_contracts[epg_full_name] = epg1
+
+            for provided_contract_name in epg1.provided:
+                index_contract_epg(contract_providers, provided_contract_name, epg_full_name)
+            for consumed_contract_name in epg1.consumed:
+                index_contract_epg(contract_consumers, consumed_contract_name, epg_full_name)
+
+    return {'providers': contract_providers, 'consumers': contract_consumers, 'epg_contracts': epg_contracts}
+
+
+def index_contract_epg(contract_epg_dict, contract_name, epg_full_name):
+    if contract_name not in contract_epg_dict.keys():
+        contract_epg_dict[contract_name] = [epg_full_name]
+    elif epg_full_name not in contract_epg_dict[contract_name][-1:]:
+        contract_epg_dict[contract_name].append(epg_full_name)
+
+
+def get_indexed_providers(contract_index, contract_name):
+    return contract_index['providers'].get(contract_name, [])
+
+
+def get_indexed_consumers(contract_index, contract_name):
+    return contract_index['consumers'].get(contract_name, [])
+
+
 def skip_aci_epg_name(aci_epg_name, _acronysm_to_skip_in_epg_name):
     for acronysm in _acronysm_to_skip_in_epg_name:
         if acronysm in aci_epg_name:
             return True
 
 
+@perf.timed('aci.get_consumer_epg')
 def get_consumer_epg(full_aep, provided_contract_name, _acronysm_to_skip_in_epg_name):
     contract_consumer_list = []
 
     for aep1 in full_aep:
-        for epg1 in aep1[1]:
-            if provided_contract_name in epg1[2] and not skip_aci_epg_name(epg1[0], _acronysm_to_skip_in_epg_name):
-                contract_consumer_list.append(aep1[0] + "-" + epg1[0])
+        for epg1 in aep1.epgs:
+            if provided_contract_name in epg1.consumed and \
+                    not skip_aci_epg_name(epg1.name, _acronysm_to_skip_in_epg_name):
+                contract_consumer_list.append(aep1.name + "-" + epg1.name)
 
     return contract_consumer_list
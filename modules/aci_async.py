@@ -0,0 +1,135 @@
+# Fetcher that rebuilds the extract_data structures from paginated APIC class queries, instead of
+# downloading the whole tenant with a single rsp-subtree=full request.
+# The HTTP requests are not asynchronous: asyncio only schedules the pages, and every page is a blocking
+# ApicSession.get run on a thread pool of max_concurrent_queries threads, which caps the concurrency.
+# This keeps the token refresh, retries and circuit breaker of ApicSession for the paged queries.
+
+import asyncio
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import modules.aci as aci
+import modules.model as model
+
+_PAGE_SIZE = 500
+_MAX_CONCURRENT_QUERIES = 8  # keep it at or below the ApicSession pool size
+
+
+class PagedQueryError(Exception):
+    pass
+
+
+def get_tenant_class_path(tena, class_name, subtree, page, page_size):
+    return '/api/node/mo/uni/tn-{}.json?query-target=subtree&target-subtree-class={}&rsp-subtree={}' \
+           '&rsp-prop-include=config-only&order-by={}.dn&page={}&page-size={}'.format(tena, class_name, subtree,
+                                                                                      class_name, page, page_size)
+
+
+def get_parent_dn(dn):
+    return dn.rsplit('/', 1)[0]
+
+
+async def fetch_class(apic, executor, semaphore, tena, class_name, subtree, page_size, process_mo):
+    # Reads the first page to learn totalCount, then the remaining pages concurrently.
+    # Every page is handed to process_mo and dropped, so memory is bounded by the page size.
+    loop = asyncio.get_running_loop()
+
+    async def fetch_page(page):
+        api_path = get_tenant_class_path(tena, class_name, subtree, page, page_size)
+        async with semaphore:
+            data = await loop.run_in_executor(executor, apic.get, api_path)
+
+        if data is None:
+            raise PagedQueryError('{} page {}'.format(class_name, page))
+
+        for item in data['imdata']:
+            process_mo(item[class_name])
+        return int(data['totalCount'])
+
+    total_count = await fetch_page(0)
+    await asyncio.gather(*[fetch_page(page) for page in range(1, math.ceil(total_count / page_size))])
+    return total_count
+
+
+async def fetch_tenant(apic, tena, page_size, max_concurrent_queries):
+    contracts = {}
+    filters = {}
+    app_profiles = {}
+    epgs = {}
+    provided = {}
+    consumed = {}
+
+    def add_contract(mo):
+        contracts[mo['attributes']['dn']] = model.make_contract(mo['attributes']['name'], aci.extract_contract(mo))
+
+    def add_filter(mo):
+        filters[mo['attributes']['dn']] = (sys.intern(mo['attributes']['name']), aci.extract_filter(mo))
+
+    def add_app_profile(mo):
+        app_profiles[mo['attributes']['dn']] = mo['attributes']['name']
+
+    def add_epg(mo):
+        epgs[mo['attributes']['dn']] = mo['attributes']['name']
+
+    def add_provided(mo):
+        provided.setdefault(get_parent_dn(mo['attributes']['dn']), []).append(mo['attributes']['tnVzBrCPName'])
+
+    def add_consumed(mo):
+        consumed.setdefault(get_parent_dn(mo['attributes']['dn']), []).append(mo['attributes']['tnVzBrCPName'])
+
+    queries = [('vzBrCP', 'full', add_contract),
+               ('vzFilter', 'full', add_filter),
+               ('fvAp', 'no', add_app_profile),
+               ('fvAEPg', 'no', add_epg),
+               ('fvRsProv', 'no', add_provided),
+               ('fvRsCons', 'no', add_consumed)]
+
+    semaphore = asyncio.Semaphore(max_concurrent_queries)
+    with ThreadPoolExecutor(max_workers=max_concurrent_queries) as executor:
+        await asyncio.gather(*[fetch_class(apic, executor, semaphore, tena, class_name, subtree, page_size,
+                                           process_mo)
+                               for class_name, subtree, process_mo in queries])
+
+    return contracts, filters, app_profiles, epgs, provided, consumed
+
+
+def build_extracted_data(contracts, filters, app_profiles, epgs, provided, consumed):
+    # Same structures as aci.extract_data, in dn order
+    full_contract_rules = {}
+    full_filter_rules = {}
+    full_aep_list = []
+
+    for contract_dn in sorted(contracts):
+        contract = contracts[contract_dn]
+        if len(contract.subjects) != 0:
+            full_contract_rules[contract.name] = contract
+
+    for filter_dn in sorted(filters):
+        filter_name, fe_list = filters[filter_dn]
+        full_filter_rules[filter_name] = fe_list
+
+    # fvRsProv/fvRsCons also exist under external EPGs, only the ones under an fvAEPg are kept
+    epg_by_app_profile = {}
+    for epg_dn in sorted(epgs):
+        epg_by_app_profile.setdefault(get_parent_dn(epg_dn), []).append(
+            model.make_epg(epgs[epg_dn], provided.get(epg_dn, []), consumed.get(epg_dn, [])))
+
+    for app_profile_dn in sorted(app_profiles):
+        full_aep_list.append(model.make_app_profile(app_profiles[app_profile_dn],
+                                                    epg_by_app_profile.get(app_profile_dn, [])))
+
+    return full_aep_list, len(app_profiles), len(epgs), \
+        full_contract_rules, len(contracts), \
+        full_filter_rules, len(filters)
+
+
+def get_tenant_paged(apic, tena, page_size=_PAGE_SIZE, max_concurrent_queries=_MAX_CONCURRENT_QUERIES):
+    print('\nGetting Tenant {} detail - Only Configuration - Paged class queries ...'.format(tena))
+    try:
+        fetched = asyncio.run(fetch_tenant(apic, tena, page_size, max_concurrent_queries))
+    except PagedQueryError as e:
+        print('[!] Request Failed: {}'.format(e))
+        return None
+
+    return build_extracted_data(*fetched)
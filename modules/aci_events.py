@@ -0,0 +1,144 @@
+# Asyncio subscriber to APIC events over the websocket, for several fabrics in the same process.
+# Every object notified by the APICs goes to one bounded queue that is consumed by the dispatcher workers.
+# aiohttp is imported when the subscribers start, importing the module doesn't need it.
+
+import asyncio
+import json
+
+_QUEUE_SIZE = 10000  # events waiting for a worker, the websocket reads stop when it is full
+_DISPATCHER_WORKERS = 4
+_SUBSCRIPTION_REFRESH_TIMER = 45  # seconds, the APIC drops the subscriptions not refreshed in 90
+_RECONNECT_TIMER = 10
+_REQUEST_TIMEOUT = 30
+_WEBSOCKET_HEARTBEAT = 30
+
+
+class ApicEventError(Exception):
+    pass
+
+
+class ApicEventSubscriber:
+    # Logs in to one APIC, opens the websocket and subscribes to the classes.
+    # The token and the subscriptions are refreshed in the background, everything is done again
+    # after a disconnection.
+
+    def __init__(self, host, user, passwd, class_names, queue):
+        self.host = host
+        self.user = user
+        self.passwd = passwd
+        self.class_names = class_names
+        self.queue = queue
+        self.token = None
+        self.refresh_timer = 0
+        self.subscriptions = {}
+        self.aiohttp = None
+
+    def url(self, path):
+        return 'https://{}{}'.format(self.host, path)
+
+    async def request(self, session, method, path, aci_json_query_data=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.token is not None:
+            headers['Cookie'] = 'APIC-cookie=' + self.token
+
+        async with session.request(method, self.url(path), data=aci_json_query_data, headers=headers,
+                                   ssl=False) as response:
+            if response.status != 200:
+                raise ApicEventError('[{}] {}'.format(response.status, path))
+            return await response.json(content_type=None)
+
+    def set_token(self, data):
+        attributes = data['imdata'][0]['aaaLogin']['attributes']
+        self.token = attributes['token']
+        self.refresh_timer = int(attributes.get('refreshTimeoutSeconds', 600)) // 2
+
+    async def login(self, session):
+        self.token = None
+        dict_query_data = {"aaaUser": {"attributes": {"name": self.user, "pwd": self.passwd}}}
+        self.set_token(await self.request(session, 'POST', '/api/aaaLogin.json', json.dumps(dict_query_data)))
+
+    async def subscribe(self, session, class_name):
+        # The objects that already exist come in the answer and are not notified, only the new events
+        data = await self.request(session, 'GET', '/api/class/{}.json?subscription=yes'.format(class_name))
+        self.subscriptions[data['subscriptionId']] = class_name
+
+    async def keep_alive(self, session, websocket):
+        loop = asyncio.get_running_loop()
+        token_time = loop.time()
+        try:
+            while True:
+                await asyncio.sleep(_SUBSCRIPTION_REFRESH_TIMER)
+                if loop.time() - token_time >= self.refresh_timer:
+                    self.set_token(await self.request(session, 'GET', '/api/aaaRefresh.json'))
+                    token_time = loop.time()
+                for subscription_id in self.subscriptions.keys():
+                    await self.request(session, 'GET', '/api/subscriptionRefresh.json?id={}'.format(subscription_id))
+        except (self.aiohttp.ClientError, ApicEventError, asyncio.TimeoutError) as e:
+            print('[!] {} refresh failed: {}'.format(self.host, e))
+            await websocket.close()
+
+    async def put_events(self, data):
+        for item in data.get('imdata', []):
+            for class_name, mo in item.items():
+                await self.queue.put((self.host, class_name, mo['attributes']))
+
+    async def listen(self, session):
+        await self.login(session)
+        web_socket_url = 'wss://{}/socket{}'.format(self.host, self.token)
+        async with session.ws_connect(web_socket_url, ssl=False, heartbeat=_WEBSOCKET_HEARTBEAT) as websocket:
+            self.subscriptions = {}
+            for class_name in self.class_names:
+                await self.subscribe(session, class_name)
+            print('Subscribed to {} events'.format(self.host))
+
+            keep_alive = asyncio.create_task(self.keep_alive(session, websocket))
+            try:
+                async for message in websocket:
+                    if message.type == self.aiohttp.WSMsgType.TEXT:
+                        await self.put_events(json.loads(message.data))
+                    elif message.type == self.aiohttp.WSMsgType.ERROR:
+                        break
+            finally:
+                keep_alive.cancel()
+
+    async def run(self):
+        import aiohttp
+
+        self.aiohttp = aiohttp
+        timeout = aiohttp.ClientTimeout(total=_REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout, cookie_jar=aiohttp.DummyCookieJar()) as session:
+            while True:
+                try:
+                    await self.listen(session)
+                    print('[!] {} websocket closed'.format(self.host))
+                except asyncio.CancelledError:  # an Exception before Python 3.8
+                    raise
+                except (aiohttp.ClientError, ApicEventError, asyncio.TimeoutError) as e:
+                    print('[!] {} subscription failed: {}'.format(self.host, e))
+                except Exception as e:  # a malformed event must not stop the watcher, nor the other fabrics
+                    print('[!] {} subscription failed: {}: {}'.format(self.host, type(e).__name__, e))
+
+                await asyncio.sleep(_RECONNECT_TIMER)
+                print('Reconnecting to {} ...'.format(self.host))
+
+
+async def dispatch_events(queue, handler):
+    while True:
+        host, class_name, attributes = await queue.get()
+        try:
+            await handler(host, class_name, attributes)
+        except Exception as e:  # one bad event must not stop the worker
+            print('[!] Event dispatch failed: {}'.format(e))
+        finally:
+            queue.task_done()
+
+
+async def watch_fabrics(fabrics, class_names, handler, workers=_DISPATCHER_WORKERS, queue_size=_QUEUE_SIZE):
+    # fabrics: list of (host, user, password)
+    # handler: coroutine called with (host, class name, attributes) for every event
+    queue = asyncio.Queue(maxsize=queue_size)
+    tasks = [asyncio.create_task(dispatch_events(queue, handler)) for _ in range(workers)]
+    tasks += [asyncio.create_task(ApicEventSubscriber(host, user, passwd, class_names, queue).run())
+              for host, user, passwd in fabrics]
+    await asyncio.gather(*tasks)
+
@@ -0,0 +1,209 @@
+# Asynchronous dispatcher of chat messages to Slack or WebEx Teams.
+# Messages are coalesced per dn prefix during a window, then queued and sent by workers through a
+# token bucket for the platform. Failed sends are retried by the workers, the intake never waits for them.
+# aiohttp is imported by start(), importing the module doesn't need it.
+
+import asyncio
+
+_COALESCE_WINDOW = 10  # seconds
+_DN_PREFIX_DEPTH = 3  # dn levels grouped in the same summary, topology/pod-1/node-101
+_SEND_QUEUE_SIZE = 1000
+_SENDER_WORKERS = 2
+_SEND_RETRIES = 5
+_RETRY_BACKOFF = 1  # seconds, doubled on every retry
+_CONNECTION_POOL_SIZE = 4
+_REQUEST_TIMEOUT = 30
+_CLOSE_TIMEOUT = 10
+
+# Messages per second and burst for every platform
+_PLATFORM_RATE_LIMITS = {
+    'slack': (1, 3),
+    'webex_teams': (2, 5),
+}
+
+_SLACK_URL = 'https://slack.com/api/chat.postMessage'
+_WEBEX_TEAMS_URL = 'https://api.ciscospark.com/v1/messages/'
+_WEBEX_TEAMS_ERRORS = {
+    404: "please check the bot is in the room you're attempting to post to...",
+    400: "please check the identifier of the room you're attempting to post to...",
+    401: "please check if the access token is correct...",
+}
+
+
+class ChatSendError(Exception):
+    def __init__(self, message, retry=False, retry_after=None):
+        super().__init__(message)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = None
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self.last is not None:
+                    self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def get_dn_prefix(dn, depth=_DN_PREFIX_DEPTH):
+    return '/'.join(dn.split('/')[:depth])
+
+
+def get_retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class ChatDispatcher:
+    # platform: slack or webex_teams
+    # destination: the Slack channel or the WebEx Teams room id
+
+    def __init__(self, platform, token, destination, coalesce_window=_COALESCE_WINDOW, workers=_SENDER_WORKERS):
+        self.platform = platform
+        self.token = token
+        self.destination = destination
+        self.coalesce_window = coalesce_window
+        self.workers = workers
+        self.bucket = TokenBucket(*_PLATFORM_RATE_LIMITS[platform])
+        self.pending = {}
+        self.send_queue = None
+        self.session = None
+        self.aiohttp = None
+        self.tasks = []
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    async def start(self):
+        import aiohttp
+
+        self.aiohttp = aiohttp
+        self.send_queue = asyncio.Queue(maxsize=_SEND_QUEUE_SIZE)
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=_CONNECTION_POOL_SIZE),
+                                             timeout=aiohttp.ClientTimeout(total=_REQUEST_TIMEOUT))
+        self.tasks = [asyncio.create_task(self.flush_pending_loop())]
+        self.tasks += [asyncio.create_task(self.send_messages()) for _ in range(self.workers)]
+
+    async def close(self):
+        # Sends what is pending, waiting at most _CLOSE_TIMEOUT
+        self.flush_pending()
+        try:
+            await asyncio.wait_for(self.send_queue.join(), _CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            print('[!] {} chat messages not sent'.format(self.send_queue.qsize()))
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.session.close()
+        print('Chat messages sent: {}, failed: {}, dropped: {}'.format(self.sent, self.failed, self.dropped))
+
+    def notify(self, kind, dn, message):
+        # kind names the messages in the summary, e.g. '37 faults on dn prefix X in 10s'
+        self.pending.setdefault((kind, get_dn_prefix(dn)), []).append(message)
+
+    def send(self, message):
+        try:
+            self.send_queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print('[!] Chat send queue full, message dropped')
+
+    def flush_pending(self):
+        pending, self.pending = self.pending, {}
+        for (kind, dn_prefix), messages in pending.items():
+            if len(messages) == 1:
+                self.send(messages[0])
+            else:
+                self.send('{} {} on dn prefix {} in {}s'.format(len(messages), kind, dn_prefix,
+                                                                self.coalesce_window))
+
+    async def flush_pending_loop(self):
+        while True:
+            await asyncio.sleep(self.coalesce_window)
+            self.flush_pending()
+
+    async def send_messages(self):
+        while True:
+            message = await self.send_queue.get()
+            try:
+                await self.deliver(message)
+            finally:
+                self.send_queue.task_done()
+
+    async def deliver(self, message):
+        for attempt in range(_SEND_RETRIES):
+            await self.bucket.acquire()
+            try:
+                await self.post(message)
+                self.sent += 1
+                print(message)
+                return
+            except ChatSendError as e:
+                if not e.retry:
+                    break
+                error = e
+                delay = e.retry_after
+            except (self.aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+                delay = None
+
+            if attempt == _SEND_RETRIES - 1:  # no wait after the last try
+                print('[!] Chat send failed: {}'.format(error))
+                break
+            if delay is None:
+                delay = _RETRY_BACKOFF * 2 ** attempt
+            print('[!] Chat send failed: {}, retrying in {}s'.format(error, delay))
+            await asyncio.sleep(delay)
+
+        self.failed += 1
+        print('[!] Chat message not sent:\n{}'.format(message))
+
+    async def post(self, message):
+        if self.platform == 'slack':
+            await self.post_slack(message)
+        elif self.platform == 'webex_teams':
+            await self.post_webex_teams(message)
+
+    async def post_slack(self, message):
+        headers = {'Authorization': 'Bearer ' + self.token}
+        data = {'channel': self.destination, 'text': '```' + message + '```'}
+        async with self.session.post(_SLACK_URL, json=data, headers=headers) as response:
+            if response.status == 429 or response.status >= 500:
+                raise ChatSendError('[{}] Slack'.format(response.status), True, get_retry_after(response))
+            result = await response.json(content_type=None)
+
+        # Slack answers 200 to the failed calls, with the reason in error
+        if not result.get('ok', False):
+            print('[!] Slack failed with error: {}'.format(result.get('error')))
+            raise ChatSendError(result.get('error'))
+
+    async def post_webex_teams(self, message):
+        headers = {'Authorization': 'Bearer ' + self.token}
+        data = {'roomId': self.destination, 'markdown': '```\n' + message + '\n```'}
+        async with self.session.post(_WEBEX_TEAMS_URL, json=data, headers=headers) as response:
+            if response.status == 200:
+                return
+            if response.status == 429 or response.status >= 500:
+                raise ChatSendError('[{}] WebEx Teams'.format(response.status), True, get_retry_after(response))
+
+        print('failed with statusCode: %d' % response.status)
+        if response.status in _WEBEX_TEAMS_ERRORS.keys():
+            print(_WEBEX_TEAMS_ERRORS[response.status])
+        raise ChatSendError('[{}] WebEx Teams'.format(response.status))
@@ -0,0 +1,127 @@
+# Deduplication and flap suppression of the ACI faults sent to chat.
+# Repeats of a (dn, rule, severity) are suppressed while they are in the TTL, but a fault raised again
+# after a clear, or cleared after a raise, is always reported. A fault raised and cleared too often is
+# reported once as flapping and then kept quiet until it is stable again.
+# What was suppressed is reported in a periodic digest.
+
+from collections import OrderedDict, deque
+from time import time
+
+_FAULT_CACHE_SIZE = 10000  # faults remembered, the least recently seen are dropped first
+_FAULT_CACHE_TTL = 3600  # seconds before the same fault is sent again
+_FLAP_THRESHOLD = 4  # raise/clear changes in _FLAP_WINDOW to consider the fault flapping
+_FLAP_WINDOW = 600  # seconds
+_DIGEST_TOP = 10  # faults listed in the digest
+
+# observe() results
+SEND = 'send'
+SUPPRESS = 'suppress'
+FLAPPING = 'flapping'
+CLEARED = 'cleared'  # a raised fault cleared
+
+
+class FaultCache:
+    def __init__(self, max_size=_FAULT_CACHE_SIZE, ttl=_FAULT_CACHE_TTL, flap_threshold=_FLAP_THRESHOLD,
+                 flap_window=_FLAP_WINDOW):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flap_threshold = flap_threshold
+        self.flap_window = flap_window
+        self.sent = OrderedDict()  # (dn, rule, severity): time sent
+        # The raise/clear state goes by dn only, the modified faults don't always carry the rule
+        self.states = OrderedDict()  # dn: [raised or cleared, change times, flapping, last raised severity]
+        self.suppressed = {}  # dn: faults suppressed since the last digest
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def touch(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+            self.evictions += 1
+
+    def suppress(self, dn):
+        self.suppressed[dn] = self.suppressed.get(dn, 0) + 1
+        return SUPPRESS
+
+    def update_state(self, dn, severity, now):
+        # Returns if the raise/clear state changed, if the fault is flapping and if it just started to
+        state = 'cleared' if severity == 'cleared' else 'raised'
+        changed = False
+        fault_state = self.states.get(dn)
+        if fault_state is None:
+            fault_state = [state, deque(maxlen=self.flap_threshold), False, None]
+        elif fault_state[0] != state:
+            fault_state[0] = state
+            fault_state[1].append(now)
+            changed = True
+        if state == 'raised':
+            fault_state[3] = severity
+        self.touch(self.states, dn, fault_state)
+
+        changes = fault_state[1]
+        flapping = len(changes) == self.flap_threshold and now - changes[0] <= self.flap_window
+        started = flapping and not fault_state[2]
+        fault_state[2] = flapping
+        return changed, flapping, started
+
+    def is_raised(self, dn):
+        fault_state = self.states.get(dn)
+        return fault_state is not None and fault_state[0] == 'raised'
+
+    def get_raised_severity(self, dn):
+        # Severity of the last raise of the fault, None if it was never seen raised
+        fault_state = self.states.get(dn)
+        return None if fault_state is None else fault_state[3]
+
+    def observe(self, dn, rule, severity, now=None):
+        # Returns SEND for a new or raised again fault, CLEARED for a raised fault that cleared, SUPPRESS
+        # for a repeat or a flapping fault, and FLAPPING the first time a fault is seen flapping
+        if now is None:
+            now = time()
+
+        changed, flapping, started = self.update_state(dn, severity, now)
+        if started:
+            self.suppress(dn)
+            return FLAPPING
+        elif flapping:
+            return self.suppress(dn)
+
+        sent_time = self.sent.get((dn, rule, severity))
+        if changed:
+            # The TTL starts again from the state change, only repeats of the same state are suppressed
+            self.misses += 1
+            self.touch(self.sent, (dn, rule, severity), now)
+            return CLEARED if severity == 'cleared' else SEND
+        elif sent_time is not None and now - sent_time <= self.ttl:
+            self.hits += 1
+            self.sent.move_to_end((dn, rule, severity))
+            return self.suppress(dn)
+
+        self.misses += 1
+        self.touch(self.sent, (dn, rule, severity), now)
+        return SEND
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.sent), 'flapping': sum(1 for state in self.states.values() if state[2])}
+
+    def digest(self):
+        # Summary of the suppressed faults since the last call, None if nothing was suppressed
+        if len(self.suppressed) == 0:
+            return None
+
+        suppressed, self.suppressed = self.suppressed, {}
+        stats = self.get_stats()
+        message = [
+            'Fault Digest:',
+            '    Suppressed          : {} on {} faults'.format(sum(suppressed.values()), len(suppressed)),
+            '    Flapping now        : {}'.format(stats['flapping']),
+            '    Cache               : {} hits, {} misses, {} entries'.format(stats['hits'], stats['misses'],
+                                                                           stats['size']),
+        ]
+        for dn, count in sorted(suppressed.items(), key=lambda x: x[1], reverse=True)[:_DIGEST_TOP]:
+            message.append('    {:>8} x {}'.format(count, dn))
+        return "\n".join(message)
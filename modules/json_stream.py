@@ -0,0 +1,127 @@
+# Incremental reader for big APIC JSON documents
+# Walks the document as it is read, decoding only one tenant child object at a time
+
+import codecs
+import json
+
+_CHUNK_SIZE = 1024 * 1024
+_WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+class JsonStreamReader:
+    def __init__(self, stream, chunk_size=_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self, size):
+        chunk = self.stream.read(size)
+        if isinstance(chunk, bytes):
+            chunk = self.text_decoder.decode(chunk, final=not chunk)
+
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more(self.chunk_size):
+                raise ValueError('Unexpected end of JSON document')
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError('Expecting {!r} at JSON stream, found {!r}'.format(char, found))
+        self.pos += 1
+
+    def read_value(self):
+        self.peek()
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof or not isinstance(value, (int, float)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            # Grow the reads so a big value is not decoded again for every chunk
+            self.read_more(read_size)
+            read_size = max(read_size, len(self.buffer))
+
+    def iter_keys(self):
+        # The caller must consume the value of each key before asking for the next one
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+
+            separator = self.peek()
+            self.pos += 1
+            if separator == '}':
+                return
+            elif separator != ',':
+                raise ValueError('Expecting \',\' or \'}}\' at JSON stream, found {!r}'.format(separator))
+
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.read_value()
+
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            elif separator != ',':
+                raise ValueError('Expecting \',\' or \']\' at JSON stream, found {!r}'.format(separator))
+
+
+def iter_tenant_children(stream, chunk_size=_CHUNK_SIZE):
+    # Yields the children of imdata[0].fvTenant, one by one
+    reader = JsonStreamReader(stream, chunk_size)
+
+    for key in reader.iter_keys():
+        if key != 'imdata':
+            reader.read_value()
+            continue
+
+        reader.expect('[')
+        if reader.peek() == ']':  # tenant not found
+            return
+
+        for class_name in reader.iter_keys():
+            if class_name != 'fvTenant':
+                reader.read_value()
+                continue
+
+            for tenant_key in reader.iter_keys():
+                if tenant_key == 'children':
+                    yield from reader.iter_array()
+                else:
+                    reader.read_value()
+            return
+        return
@@ -0,0 +1,77 @@
+# Typed model of the tenant objects returned by aci.extract_data.
+# Named tuples instead of nested lists: no per object dict, the names are interned so all the relations
+# to a contract or filter share one string, ports are integers and protocols are Protocol members.
+
+import sys
+from collections import namedtuple
+from enum import Enum
+
+AppProfile = namedtuple('AppProfile', ['name', 'epgs'])
+EPG = namedtuple('EPG', ['name', 'provided', 'consumed'])
+Contract = namedtuple('Contract', ['name', 'subjects'])
+# One per filter of a subject, a subject with several filters gives several Subject
+Subject = namedtuple('Subject', ['name', 'reverse_ports', 'action', 'filter_name'])
+# Ports are None when unspecified, service names (http, https, ...) are kept as they come
+FilterEntry = namedtuple('FilterEntry', ['name', 'protocol', 'from_port', 'to_port', 'stateful'])
+
+
+class Protocol(str, Enum):
+    # vzEntry prot values
+    UNSPECIFIED = 'unspecified'
+    ICMP = 'icmp'
+    IGMP = 'igmp'
+    TCP = 'tcp'
+    EGP = 'egp'
+    IGP = 'igp'
+    UDP = 'udp'
+    ICMPV6 = 'icmpv6'
+    EIGRP = 'eigrp'
+    OSPFIGP = 'ospfigp'
+    PIM = 'pim'
+    L2TP = 'l2tp'
+
+    def __str__(self):
+        return self.value
+
+
+_PROTOCOLS = {protocol.value: protocol for protocol in Protocol}
+
+
+def get_protocol(aci_protocol):
+    # Protocols not in Protocol, e.g. numbers, are kept as strings
+    return _PROTOCOLS.get(aci_protocol) or sys.intern(aci_protocol)
+
+
+def get_port(aci_port):
+    if aci_port == 'unspecified':
+        return None
+    elif aci_port.isdigit():
+        return int(aci_port)
+    return sys.intern(aci_port)
+
+
+def format_port(port, unspecified='unspecified'):
+    if port is None:
+        return unspecified
+    return str(port)
+
+
+def make_app_profile(name, epgs):
+    return AppProfile(sys.intern(name), tuple(epgs))
+
+
+def make_epg(name, provided, consumed):
+    return EPG(sys.intern(name), tuple(map(sys.intern, provided)), tuple(map(sys.intern, consumed)))
+
+
+def make_contract(name, subjects):
+    return Contract(sys.intern(name), tuple(subjects))
+
+
+def make_subject(name, reverse_ports, action, filter_name):
+    return Subject(sys.intern(name), sys.intern(reverse_ports), sys.intern(action), sys.intern(filter_name))
+
+
+def make_filter_entry(name, protocol, from_port, to_port, stateful):
+    return FilterEntry(sys.intern(name), get_protocol(protocol), get_port(from_port), get_port(to_port),
+                       sys.intern(stateful))
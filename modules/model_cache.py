@@ -0,0 +1,105 @@
+# Binary cache of the extracted tenant (aci.extract_data), saved next to the tenant file as <file>.model.
+# The header has the cache format version and the size, mtime and sha256 of the tenant file, so a stale
+# cache is never used. The model is a pickle read straight from a memory map of the cache file.
+# The incremental export keeps a copy of the model exported in the export directory, see load_model_copy.
+
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+
+import modules.perf as perf
+
+_CACHE_SUFFIX = '.model'
+_CACHE_MAGIC = b'ACIMODEL'
+# Bump it when modules/model.py or aci.extract_data change, older caches are extracted again
+_CACHE_VERSION = 1
+_CACHE_HEADER = struct.Struct('<8sHQq32s')  # magic, version, tenant file size, mtime_ns and sha256
+_PICKLE_PROTOCOL = 5
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_cache_file(source_file):
+    return source_file + _CACHE_SUFFIX
+
+
+def hash_file(file_name):
+    file_hash = hashlib.sha256()
+    with open(file_name, 'rb') as file_read:
+        for chunk in iter(lambda: file_read.read(_HASH_CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    return file_hash.digest()
+
+
+def load_model(source_file):
+    # Cached model of source_file, None if there is no cache or it is stale
+    try:
+        source_stat = os.stat(source_file)
+        with open(get_cache_file(source_file), 'rb') as file_read, \
+                mmap.mmap(file_read.fileno(), 0, access=mmap.ACCESS_READ) as cache_map:
+            magic, version, size, mtime_ns, sha256 = _CACHE_HEADER.unpack_from(cache_map)
+            if magic != _CACHE_MAGIC or version != _CACHE_VERSION or size != source_stat.st_size:
+                return None
+            # A file with the same size and mtime is taken as unchanged, otherwise the content decides
+            if mtime_ns != source_stat.st_mtime_ns and sha256 != hash_file(source_file):
+                return None
+            with memoryview(cache_map) as cache_view, perf.gc_paused():
+                return pickle.loads(cache_view[_CACHE_HEADER.size:])
+    except (OSError, ValueError, EOFError, struct.error, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def load_model_copy(cache_file, sha256):
+    # Model saved to cache_file by save_model, None if it is missing or wasn't extracted from a tenant file
+    # with this sha256. The tenant file itself may be gone or modified since.
+    try:
+        with open(cache_file, 'rb') as file_read, \
+                mmap.mmap(file_read.fileno(), 0, access=mmap.ACCESS_READ) as cache_map:
+            magic, version, size, mtime_ns, cache_sha256 = _CACHE_HEADER.unpack_from(cache_map)
+            if magic != _CACHE_MAGIC or version != _CACHE_VERSION or cache_sha256 != sha256:
+                return None
+            with memoryview(cache_map) as cache_view, perf.gc_paused():
+                return pickle.loads(cache_view[_CACHE_HEADER.size:])
+    except (OSError, ValueError, EOFError, struct.error, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def save_model(source_file, tenant_data, cache_file=None):
+    # Returns the sha256 of source_file, None if the model wasn't saved
+    if cache_file is None:
+        cache_file = get_cache_file(source_file)
+    try:
+        source_stat = os.stat(source_file)
+        sha256 = hash_file(source_file)
+        header = _CACHE_HEADER.pack(_CACHE_MAGIC, _CACHE_VERSION, source_stat.st_size, source_stat.st_mtime_ns,
+                                    sha256)
+        file_descriptor, temp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file) or '.', prefix='.',
+                                                      suffix='.tmp')
+    except OSError as e:
+        print('[!] Model cache not saved: {}'.format(e))
+        return None
+
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file_write:
+            file_write.write(header)
+            pickle.dump(tenant_data, file_write, protocol=_PICKLE_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        os.remove(temp_file)
+        print('[!] Model cache not saved: {}'.format(e))
+        return None
+    return sha256
+
+
+def get_model(source_file, extract):
+    # extract(source_file) runs only when there is no valid cache, its result is cached
+    tenant_data = load_model(source_file)
+    if tenant_data is not None:
+        print('Model loaded from cache {}'.format(get_cache_file(source_file)))
+        return tenant_data
+
+    tenant_data = extract(source_file)
+    save_model(source_file, tenant_data)
+    return tenant_data
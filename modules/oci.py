@@ -1,95 +1,57 @@
 # Modules to work with OCI
 
+import hashlib
 import json
 import os
-import socket
+import tempfile
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 
 import modules.aci as aci
+import modules.model as model
+import modules.perf as perf
+import modules.port_numbers as port_numbers
 
-# ACI port names sometimes don't match the RFC.
-# Add to this dictionary different port number and names
-_EXTRA_PORT_NUMBERS = {
-    'ftpData': '20',
-}
+# OCI port ranges start at 1
+_UNSPECIFIED_MIN_PORT = '1'
 
+# Bump it when the generated rules change for the same tenant, incremental exports translate everything again
+_TRANSLATION_VERSION = 2
 
-def identify_port_number(aci_filter_entry):
-    if aci_filter_entry[2] == 'unspecified':
-        min_p = '1'
-    else:
-        try:
-            min_p = str(socket.getservbyname(aci_filter_entry[2]))
-        except OSError:
-            if aci_filter_entry[2] in _EXTRA_PORT_NUMBERS.keys():
-                min_p = _EXTRA_PORT_NUMBERS[aci_filter_entry[2]]
-            else:
-                min_p = aci_filter_entry[2]
-
-    if aci_filter_entry[3] == 'unspecified':
-        max_p = '65535'
-    else:
-        try:
-            max_p = str(socket.getservbyname(aci_filter_entry[3]))
-        except OSError:
-            if aci_filter_entry[2] in _EXTRA_PORT_NUMBERS.keys():
-                max_p = _EXTRA_PORT_NUMBERS[aci_filter_entry[2]]
-            else:
-                max_p = aci_filter_entry[3]
-
-    return min_p, max_p
-
+# Hash of every generated file, used to skip unchanged files and to find stale ones
+_MANIFEST_FILE = '.aci_export_manifest.json'
+_MAX_NSG_PER_VNIC = 5
+_WRITER_THREADS = 8
 
-def add_tcp_udp_rule(aci_filter_entry, oci_nsg_full_dict, oci_display_name, current_oci_nsg_id, ocid_other_nsg_end_id,
-                     oci_direction, oci_nsg_rule_type):
-
-    if aci_filter_entry[1] == '6':
-        protocol = '6'  # TCP
-        options = 'tcp_options'
-    else:
-        protocol = '17'  # UDP
-        options = 'udp_options'
+# Entries of the rules added with _default_permit_all_egress_and_icmp_in
+_PERMIT_ALL_ENTRY = model.FilterEntry(None, model.Protocol.UNSPECIFIED, None, None, 'false')
+_PERMIT_ICMP_ENTRY = model.FilterEntry(None, model.Protocol.ICMP, None, None, 'false')
 
-    if oci_direction == 'INGRESS':
-        direction = 'source'
-        direction_type = 'source_type'
-    else:
-        direction = 'destination'
-        direction_type = 'destination_type'
 
-    stateless = 'false' if aci_filter_entry[4] == 'yes' else 'true'
-    min_p, max_p = identify_port_number(aci_filter_entry)
+@perf.timed('oci.identify_port_number')
+def identify_port_number(aci_filter_entry):
+    return port_numbers.identify_port_number(aci_filter_entry, _UNSPECIFIED_MIN_PORT)
 
-    if oci_display_name not in oci_nsg_full_dict.keys():
-        oci_nsg_full_dict[oci_display_name] = {'resources': []}
 
-    if ocid_other_nsg_end_id == 'ANY':
-        src_dst = '0.0.0.0/0'
+def print_skipped_rule(aci_filter_entry, aci_source_epg, src_dst, aci_contract_name, aci_filter_name, oci_direction):
+    perf.count('oci.rules_skipped')
+    print('\nWARNING: Skipping rule. Missing filter or protocol not recognized '
+          'at filter: ' + str(aci_filter_entry))
+    if oci_direction == 'EGRESS':
+        print('EPG Consumer: ' + aci_source_epg)
+        print('EPG Provider: ' + src_dst)
     else:
-        src_dst = ocid_other_nsg_end_id
-
-    oci_nsg_full_dict[oci_display_name]['resources'].append(
-        {
-            'network_security_group_id': current_oci_nsg_id,
-            'direction': oci_direction,
-            'protocol': protocol,
-            options: {"destination_port_range": {
-                "min": min_p,
-                "max": max_p
-            }
-            },
-            direction: src_dst,
-            'stateless': stateless,
-            direction_type: oci_nsg_rule_type
-        }
-    )
-
+        print('EPG Provider: ' + aci_source_epg)
+        print('EPG Consumer: ' + src_dst)
+    print('Contract: ' + str(aci_contract_name))
+    print('Filter Name: ' + str(aci_filter_name))
 
-def add_icmp_rule(aci_filter_entry, oci_nsg_full_dict, oci_display_name, current_oci_nsg_id, ocid_other_nsg_end_id,
-                  oci_direction, oci_nsg_rule_type):
-    protocol = '1'
-    stateless = 'false' if aci_filter_entry[4] == 'yes' else 'true'
 
+@perf.timed('oci.build_rule_template')
+def build_rule_template(aci_filter_entry, oci_direction, oci_nsg_rule_type):
+    # Rule with the NSG id and the peer left empty, the fields in the order of the Terraform files.
+    # Returns the template and its peer field, the template is None when the protocol is not recognized.
     if oci_direction == 'INGRESS':
         direction = 'source'
         direction_type = 'source_type'
@@ -97,274 +59,526 @@ def add_icmp_rule(aci_filter_entry, oci_nsg_full_dict, oci_display_name, current
         direction = 'destination'
         direction_type = 'destination_type'
 
-    if ocid_other_nsg_end_id == 'ANY':
-        src_dst = '0.0.0.0/0'
-    else:
-        src_dst = ocid_other_nsg_end_id
-
-    if oci_display_name not in oci_nsg_full_dict.keys():
-        oci_nsg_full_dict[oci_display_name] = {'resources': []}
-
-    oci_nsg_full_dict[oci_display_name]['resources'].append(
-        {
-            'network_security_group_id': current_oci_nsg_id,
-            'direction': oci_direction,
-            'protocol': protocol,
-            direction: src_dst,
-            'stateless': stateless,
-            direction_type: oci_nsg_rule_type
+    oci_rule_template = {'network_security_group_id': None, 'direction': oci_direction}
+    if aci_filter_entry.protocol is model.Protocol.TCP or aci_filter_entry.protocol is model.Protocol.UDP:
+        if aci_filter_entry.protocol is model.Protocol.TCP:
+            oci_rule_template['protocol'] = '6'
+            options = 'tcp_options'
+        else:
+            oci_rule_template['protocol'] = '17'
+            options = 'udp_options'
+        min_p, max_p = identify_port_number(aci_filter_entry)
+        # Copied with the rule by RuleExpansion.get_nsg_dict, the rules don't share it
+        oci_rule_template[options] = {"destination_port_range": {
+            "min": min_p,
+            "max": max_p
         }
-    )
-
-
-def add_all_protocols_rule(aci_filter_entry, oci_nsg_full_dict, oci_display_name, current_oci_nsg_id,
-                           ocid_other_nsg_end_id, oci_direction, oci_nsg_rule_type):
-    protocol = 'all'
-    stateless = 'false' if aci_filter_entry[4] == 'yes' else 'true'
-
-    if oci_direction == 'INGRESS':
-        direction = 'source'
-        direction_type = 'source_type'
-    else:
-        direction = 'destination'
-        direction_type = 'destination_type'
-
-    if oci_display_name not in oci_nsg_full_dict.keys():
-        oci_nsg_full_dict[oci_display_name] = {'resources': []}
-
-    oci_nsg_full_dict[oci_display_name]['resources'].append(
-        {
-            'network_security_group_id': current_oci_nsg_id,
-            'direction': oci_direction,
-            'protocol': protocol,
-            direction: ocid_other_nsg_end_id,
-            'stateless': stateless,
-            direction_type: oci_nsg_rule_type
         }
-    )
-
-
-def build_add_rule(aci_filter_entry, aci_source_epg, aci_other_end_epg, aci_consumed_contract_name, aci_filter_name,
-                   oci_full_nsg_dict, oci_nsg_display_name, current_oci_nsg_id, ocid_other_nsg_end_id, oci_direction,
-                   oci_nsg_rule_type):
-
-    if aci_other_end_epg == 'ANY':
-        src_dst = '0.0.0.0/0'
-        ocid_src_dst = '0.0.0.0/0'
+    elif aci_filter_entry.protocol is model.Protocol.ICMP:
+        oci_rule_template['protocol'] = '1'
+    elif aci_filter_entry.protocol is model.Protocol.UNSPECIFIED:
+        oci_rule_template['protocol'] = 'all'
     else:
-        src_dst = aci_other_end_epg
-        ocid_src_dst = ocid_other_nsg_end_id
-
-    if aci_filter_entry[1] == 'tcp' or aci_filter_entry[1] == 'udp':
-        add_tcp_udp_rule(aci_filter_entry, oci_full_nsg_dict, oci_nsg_display_name,
-                         current_oci_nsg_id, ocid_src_dst, oci_direction, oci_nsg_rule_type)
-
-    elif aci_filter_entry[1] == 'icmp':
-        add_icmp_rule(aci_filter_entry, oci_full_nsg_dict, oci_nsg_display_name,
-                      current_oci_nsg_id, ocid_src_dst, oci_direction, oci_nsg_rule_type)
-
-    elif aci_filter_entry[1] == 'unspecified':
-        add_all_protocols_rule(aci_filter_entry, oci_full_nsg_dict,
-                               oci_nsg_display_name, current_oci_nsg_id,
-                               ocid_src_dst, oci_direction, oci_nsg_rule_type)
-
-    else:
-        print('\nWARNING: Skipping rule. Missing filter or protocol not recognized '
-              'at filter: ' + str(aci_filter_entry))
-        if oci_direction == 'EGRESS':
-            print('EPG Consumer: ' + aci_source_epg)
-            print('EPG Provider: ' + src_dst)
+        return None, direction
+
+    oci_rule_template[direction] = None
+    oci_rule_template['stateless'] = 'false' if aci_filter_entry.stateful == 'yes' else 'true'
+    oci_rule_template[direction_type] = oci_nsg_rule_type
+    return oci_rule_template, direction
+
+
+class RuleExpansion:
+    # Columnar translation of the contracts to NSG rules, same result as the rule by rule translation of
+    # benchmarks/oci_by_rule.py.
+    # Filter entries, peers and NSGs are numbered, and the rules of an EPG contract are added as whole
+    # arrays, the filter entries of the contract subjects times its peers. Protocols and ports are
+    # resolved once per filter entry and direction, and the rule dicts are only built by get_nsg_dict.
+
+    def __init__(self, aci_full_contracts_dict, aci_full_filters_dict, aci_contract_index):
+        self.contracts = aci_full_contracts_dict
+        self.filters = aci_full_filters_dict
+        self.contract_index = aci_contract_index
+        self.templates = []  # rule templates, see build_rule_template
+        self.template_peer_fields = []
+        self.template_numbers = {}  # (filter entry, direction, rule type): template number, -1 if not a rule
+        self.peers = ['0.0.0.0/0']  # NSG ids of the peers, the first one for the CIDR_BLOCK rules
+        self.peer_numbers = {}
+        self.filter_templates = {}  # (filter, direction): templates array
+        self.contract_templates = {}  # (contract, direction): templates array, (filter entry, filter name) list
+        self.contract_peers = {}  # (contract, direction): peer names, peers array
+        self.nsg_names = []  # in the order they get their first rule
+        self.nsg_numbers = {}
+        # One row per rule
+        self.rule_nsgs = array('i')
+        self.rule_templates = array('i')
+        self.rule_peers = array('i')
+
+    # The get_* methods number things the first time they are seen, they run once per EPG contract,
+    # so they look up the dicts once instead of testing the keys first
+
+    def get_template_number(self, aci_filter_entry, oci_direction, oci_nsg_rule_type):
+        key = (aci_filter_entry, oci_direction, oci_nsg_rule_type)
+        template_number = self.template_numbers.get(key)
+        if template_number is None:
+            oci_rule_template, peer_field = build_rule_template(aci_filter_entry, oci_direction, oci_nsg_rule_type)
+            if oci_rule_template is None:
+                template_number = -1
+            else:
+                template_number = len(self.templates)
+                self.templates.append(oci_rule_template)
+                self.template_peer_fields.append(peer_field)
+            self.template_numbers[key] = template_number
+        return template_number
+
+    def get_peer_number(self, aci_peer):
+        peer_number = self.peer_numbers.get(aci_peer)
+        if peer_number is None:
+            peer_number = self.peer_numbers[aci_peer] = len(self.peers)
+            self.peers.append(get_oci_nsg_id(aci_peer))
+        return peer_number
+
+    def get_nsg_number(self, oci_nsg_display_name):
+        nsg_number = self.nsg_numbers.get(oci_nsg_display_name)
+        if nsg_number is None:
+            nsg_number = self.nsg_numbers[oci_nsg_display_name] = len(self.nsg_names)
+            self.nsg_names.append(oci_nsg_display_name)
+        return nsg_number
+
+    def get_filter_templates(self, aci_filter_name, oci_direction):
+        key = (aci_filter_name, oci_direction)
+        template_numbers = self.filter_templates.get(key)
+        if template_numbers is None:
+            template_numbers = self.filter_templates[key] = array('i', [
+                self.get_template_number(aci_filter_entry, oci_direction, 'NETWORK_SECURITY_GROUP')
+                for aci_filter_entry in aci.get_filter(self.filters, aci_filter_name)])
+        return template_numbers
+
+    def get_contract_templates(self, aci_contract_name, oci_direction):
+        # Templates of the filter entries of all the contract subjects, in order. The filter entries
+        # are only listed when some of them are not rules, for the warnings.
+        key = (aci_contract_name, oci_direction)
+        contract_templates = self.contract_templates.get(key)
+        if contract_templates is None:
+            template_numbers = array('i')
+            for aci_subject in self.contracts[aci_contract_name].subjects:
+                template_numbers.extend(self.get_filter_templates(aci_subject.filter_name, oci_direction))
+
+            filter_entries = None
+            if -1 in template_numbers:
+                filter_entries = [(aci_filter_entry, aci_subject.filter_name)
+                                  for aci_subject in self.contracts[aci_contract_name].subjects
+                                  for aci_filter_entry in aci.get_filter(self.filters, aci_subject.filter_name)]
+            contract_templates = self.contract_templates[key] = (template_numbers, filter_entries)
+        return contract_templates
+
+    def get_contract_peers(self, aci_contract_name, oci_direction):
+        # The providers of the consumed contracts, the consumers of the provided ones
+        key = (aci_contract_name, oci_direction)
+        contract_peers = self.contract_peers.get(key)
+        if contract_peers is None:
+            if oci_direction == 'EGRESS':
+                aci_peers = aci.get_indexed_providers(self.contract_index, aci_contract_name)
+            else:
+                aci_peers = aci.get_indexed_consumers(self.contract_index, aci_contract_name)
+            contract_peers = self.contract_peers[key] = (aci_peers, array('i', [self.get_peer_number(aci_peer)
+                                                                                for aci_peer in aci_peers]))
+        return contract_peers
+
+    def add_rules(self, nsg_number, template_number, peer_numbers):
+        self.rule_nsgs.extend(array('i', [nsg_number]) * len(peer_numbers))
+        self.rule_templates.extend(array('i', [template_number]) * len(peer_numbers))
+        self.rule_peers.extend(peer_numbers)
+
+    def add_default_rules(self, oci_nsg_display_name):
+        nsg_number = self.get_nsg_number(oci_nsg_display_name)
+        self.add_rules(nsg_number, self.get_template_number(_PERMIT_ALL_ENTRY, 'EGRESS', 'CIDR_BLOCK'),
+                       array('i', [0]))
+        self.add_rules(nsg_number, self.get_template_number(_PERMIT_ICMP_ENTRY, 'INGRESS', 'CIDR_BLOCK'),
+                       array('i', [0]))
+
+    @perf.timed('oci.RuleExpansion.add_contract_rules')
+    def add_contract_rules(self, oci_nsg_display_name, aci_source_epg, aci_contract_name, oci_direction):
+        source_role = 'Consumer' if oci_direction == 'EGRESS' else 'Provider'
+        if aci_contract_name not in self.contracts:
+            print('\nWARNING: Skipping rule. Missing contract: ' + aci_contract_name)
+            print('EPG ' + source_role + ': ' + aci_source_epg)
+            return
+
+        template_numbers, filter_entries = self.get_contract_templates(aci_contract_name, oci_direction)
+        aci_peers, peer_numbers = self.get_contract_peers(aci_contract_name, oci_direction)
+        if len(template_numbers) == 0:
+            return
+        elif len(peer_numbers) == 0:
+            for _ in template_numbers:
+                print('\nWARNING: Skipping rule. No {} for contract: '.format(
+                    'providers' if oci_direction == 'EGRESS' else 'consumer') + aci_contract_name)
+                print('EPG ' + source_role + ': ' + aci_source_epg)
+            return
+
+        nsg_number = self.get_nsg_number(oci_nsg_display_name)
+        if filter_entries is None:
+            # The filter entries times the peers, in a few array operations
+            rules = len(template_numbers) * len(peer_numbers)
+            self.rule_nsgs.extend(array('i', [nsg_number]) * rules)
+            for template_number in template_numbers:
+                self.rule_templates.extend(array('i', [template_number]) * len(peer_numbers))
+            self.rule_peers.extend(peer_numbers * len(template_numbers))
+            return
+
+        for template_number, (aci_filter_entry, aci_filter_name) in zip(template_numbers, filter_entries):
+            if template_number != -1:
+                self.add_rules(nsg_number, template_number, peer_numbers)
+                continue
+            for aci_peer in aci_peers:
+                print_skipped_rule(aci_filter_entry, aci_source_epg, aci_peer, aci_contract_name, aci_filter_name,
+                                   oci_direction)
+
+    @perf.timed('oci.RuleExpansion.add_epg')
+    def add_epg(self, oci_nsg_display_name, aci_epg, _default_permit_all_egress_and_icmp_in):
+        if _default_permit_all_egress_and_icmp_in:
+            self.add_default_rules(oci_nsg_display_name)
         else:
-            print('EPG Provider: ' + aci_source_epg)
-            print('EPG Consumer: ' + src_dst)
-        print('Contract: ' + str(aci_consumed_contract_name))
-        print('Filter Name: ' + str(aci_filter_name))
-
-
+            for aci_consumed_contract_name in aci_epg.consumed:
+                self.add_contract_rules(oci_nsg_display_name, aci_epg.name, aci_consumed_contract_name, 'EGRESS')
+
+        for aci_provided_contract_name in aci_epg.provided:
+            self.add_contract_rules(oci_nsg_display_name, aci_epg.name, aci_provided_contract_name, 'INGRESS')
+
+    @perf.timed('oci.RuleExpansion.get_nsg_dict')
+    def get_nsg_dict(self):
+        # Rule dicts from the rows, a copy of the template with the NSG id and the peer
+        oci_full_nsg_dict = {nsg_name: {'resources': []} for nsg_name in self.nsg_names}
+        nsg_resources = [oci_full_nsg_dict[nsg_name]['resources'] for nsg_name in self.nsg_names]
+        nsg_ids = [get_oci_nsg_id(nsg_name) for nsg_name in self.nsg_names]
+        templates = self.templates
+        template_peer_fields = self.template_peer_fields
+        # The port ranges are copied too, no dict is shared by two rules
+        template_options = [next((options for options in ('tcp_options', 'udp_options') if options in template), None)
+                            for template in templates]
+        peers = self.peers
+
+        with perf.gc_paused():
+            for nsg_number, template_number, peer_number in zip(self.rule_nsgs, self.rule_templates,
+                                                                 self.rule_peers):
+                oci_rule = templates[template_number].copy()
+                oci_rule['network_security_group_id'] = nsg_ids[nsg_number]
+                oci_rule[template_peer_fields[template_number]] = peers[peer_number]
+                options = template_options[template_number]
+                if options is not None:
+                    oci_rule[options] = {'destination_port_range': oci_rule[options]['destination_port_range'].copy()}
+                nsg_resources[nsg_number].append(oci_rule)
+
+        return oci_full_nsg_dict
+
+
+@perf.timed('oci.export_to_oci_format')
 def export_to_oci_format(aci_full_aep_list, aci_full_contracts_dict, aci_full_filters_dict,
-                         _default_permit_all_egress_and_icmp_in, _acronysm_to_skip_in_epg_name):
-    oci_full_nsg_dict = {}
+                         _default_permit_all_egress_and_icmp_in, _acronysm_to_skip_in_epg_name,
+                         aci_contract_index=None, only_nsgs=None):
+    # only_nsgs: translate only these NSGs, the peers of their rules still come from the whole tenant
+    if aci_contract_index is None:
+        aci_contract_index = aci.build_contract_index(aci_full_aep_list, _acronysm_to_skip_in_epg_name)
+
+    rule_expansion = RuleExpansion(aci_full_contracts_dict, aci_full_filters_dict, aci_contract_index)
     for aci_aep in aci_full_aep_list:
-        for aci_epg in aci_aep[1]:
-            if aci.skip_aci_epg_name(aci_epg[0], _acronysm_to_skip_in_epg_name):
+        for aci_epg in aci_aep.epgs:
+            if aci.skip_aci_epg_name(aci_epg.name, _acronysm_to_skip_in_epg_name):
                 continue
-            else:
-                aci_source_epg = aci_epg[0]
-                oci_nsg_display_name = aci_aep[0] + "-" + aci_source_epg
-
-                if _default_permit_all_egress_and_icmp_in:
-                    destination = 'ANY'
-                    aci_filter_entry = [None, 'unspecified', None, None, 'false']
-                    aci_consumed_contract_name = None
-                    filter_name = None
-                    oci_nsg_rule_type = 'CIDR_BLOCK'
-
-                    current_oci_nsg_id = "${oci_core_network_security_group." \
-                                         "aci_exported_nsg_" + oci_nsg_display_name + ".id}"
-                    ocid_destination = "${oci_core_network_security_group." \
-                                       "aci_exported_nsg_" + destination + ".id}"
-
-                    oci_direction = 'EGRESS'
-
-                    build_add_rule(aci_filter_entry, aci_source_epg, destination,
-                                   aci_consumed_contract_name, filter_name, oci_full_nsg_dict,
-                                   oci_nsg_display_name, current_oci_nsg_id, ocid_destination,
-                                   oci_direction, oci_nsg_rule_type)
-
-                    source = 'ANY'
-                    oci_direction = 'INGRESS'
-                    aci_filter_entry = [None, 'icmp', None, None, 'false']
-
-                    build_add_rule(aci_filter_entry, aci_source_epg, source,
-                                   aci_consumed_contract_name, filter_name, oci_full_nsg_dict,
-                                   oci_nsg_display_name, current_oci_nsg_id, ocid_destination,
-                                   oci_direction, oci_nsg_rule_type)
-
-                else:
-                    for aci_consumed_contract_name in aci_epg[2]:
-                        if aci_consumed_contract_name not in aci_full_contracts_dict.keys():
-                            print('\nWARNING: Skipping rule. Missing contract: ' + aci_consumed_contract_name)
-                            print('EPG Consumer: ' + aci_source_epg)
-
-                        else:
-                            for aci_subject in aci_full_contracts_dict[aci_consumed_contract_name]:
-                                is_bidir = aci_subject[1]
-                                aci_filter_list = aci.get_filter(aci_full_filters_dict, aci_subject[3])
-
-                                for aci_filter_entry in aci_filter_list:
-
-                                    aci_all_providers = aci.get_consumer_epg(aci_full_aep_list,
-                                                                             aci_consumed_contract_name,
-                                                                             _acronysm_to_skip_in_epg_name)
-
-                                    if len(aci_all_providers) != 0:
-                                        if oci_nsg_display_name not in oci_full_nsg_dict.keys():
-                                            oci_full_nsg_dict[oci_nsg_display_name] = {'resources': []}
-
-                                        for aci_provider in aci_all_providers:
-                                            current_oci_nsg_id = "${oci_core_network_security_group." \
-                                                                 "aci_exported_nsg_" + oci_nsg_display_name + ".id}"
-                                            ocid_destination = "${oci_core_network_security_group." \
-                                                               "aci_exported_nsg_" + aci_provider + ".id}"
-                                            oci_direction = 'EGRESS'
-                                            oci_nsg_rule_type = 'NETWORK_SECURITY_GROUP'
-
-                                            build_add_rule(aci_filter_entry, aci_source_epg, aci_provider,
-                                                           aci_consumed_contract_name, aci_subject[3],
-                                                           oci_full_nsg_dict,
-                                                           oci_nsg_display_name, current_oci_nsg_id, ocid_destination,
-                                                           oci_direction, oci_nsg_rule_type)
-
-                                    else:
-                                        print('\nWARNING: Skipping rule. No providers'
-                                              ' for contract: ' + aci_consumed_contract_name)
-                                        print('EPG Consumer: ' + aci_source_epg)
-
-                for aci_provided_contract_name in aci_epg[1]:
-                    if aci_provided_contract_name not in aci_full_contracts_dict.keys():
-                        print('\nWARNING: Skipping rule. Missing contract: ' + aci_provided_contract_name)
-                        print('EPG Provider: ' + aci_source_epg)
+            elif only_nsgs is not None and aci_aep.name + "-" + aci_epg.name not in only_nsgs:
+                continue
+            rule_expansion.add_epg(aci_aep.name + "-" + aci_epg.name, aci_epg, _default_permit_all_egress_and_icmp_in)
 
-                    else:
-                        for aci_subject in aci_full_contracts_dict[aci_provided_contract_name]:
-                            is_bidir = aci_subject[1]
-                            aci_filter_list = aci.get_filter(aci_full_filters_dict, aci_subject[3])
+    perf.count('oci.rules_emitted', len(rule_expansion.rule_nsgs))
+    perf.count('oci.nsgs', len(rule_expansion.nsg_names))
+    return rule_expansion.get_nsg_dict()
 
-                            for aci_filter_entry in aci_filter_list:
 
-                                aci_consumers = aci.get_consumer_epg(aci_full_aep_list, aci_provided_contract_name,
-                                                                     _acronysm_to_skip_in_epg_name)
-                                if len(aci_consumers) != 0:
-                                    if oci_nsg_display_name not in oci_full_nsg_dict.keys():
-                                        oci_full_nsg_dict[oci_nsg_display_name] = {'resources': []}
+def get_rule_peer_key(oci_rule):
+    # Rules with the same key only differ in protocol and ports
+    if oci_rule['direction'] == 'INGRESS':
+        peer = oci_rule['source']
+        peer_type = oci_rule['source_type']
+    else:
+        peer = oci_rule['destination']
+        peer_type = oci_rule['destination_type']
 
-                                    for aci_consumer in aci_consumers:
-                                        current_oci_nsg_id = "${oci_core_network_security_group." \
-                                                             "aci_exported_nsg_" + oci_nsg_display_name + ".id}"
-                                        ocid_destination = "${oci_core_network_security_group." \
-                                                           "aci_exported_nsg_" + aci_consumer + ".id}"
-                                        oci_direction = 'INGRESS'
-                                        oci_nsg_rule_type = 'NETWORK_SECURITY_GROUP'
+    return oci_rule['network_security_group_id'], oci_rule['direction'], peer, peer_type, oci_rule['stateless']
 
-                                        build_add_rule(aci_filter_entry, aci_source_epg, aci_consumer,
-                                                       aci_provided_contract_name, aci_subject[3], oci_full_nsg_dict,
-                                                       oci_nsg_display_name, current_oci_nsg_id, ocid_destination,
-                                                       oci_direction, oci_nsg_rule_type)
 
-                                else:
-                                    print('\nWARNING: Skipping rule. No consumer for '
-                                          'contract: ' + aci_provided_contract_name)
-                                    print('EPG Provider: ' + aci_source_epg)
+def get_rule_port_range(oci_rule):
+    options = 'tcp_options' if oci_rule['protocol'] == '6' else 'udp_options'
+    port_range = oci_rule[options]['destination_port_range']
+    if not (port_range['min'].isdigit() and port_range['max'].isdigit()):  # unresolved service name
+        return None
 
-    return oci_full_nsg_dict
+    return options, int(port_range['min']), int(port_range['max'])
 
 
-def save_oci_files(oci_nsg, _export_to_dir, _nsg_over_allowed_rules):
+def merge_port_ranges(port_ranges):
+    merged_ranges = []
+    for min_p, max_p in sorted(port_ranges):
+        if len(merged_ranges) != 0 and min_p <= merged_ranges[-1][1] + 1:  # overlapping or contiguous
+            merged_ranges[-1][1] = max(merged_ranges[-1][1], max_p)
+        else:
+            merged_ranges.append([min_p, max_p])
+    return merged_ranges
+
+
+@perf.timed('oci.optimize_rules')
+def optimize_rules(oci_rules):
+    all_protocols_peers = set(get_rule_peer_key(oci_rule) for oci_rule in oci_rules if oci_rule['protocol'] == 'all')
+    seen_rules = set()
+    port_range_groups = {}
+    optimized_rules = []
+
+    for oci_rule in oci_rules:
+        peer_key = get_rule_peer_key(oci_rule)
+
+        if oci_rule['protocol'] != 'all' and peer_key in all_protocols_peers:
+            continue
+
+        if oci_rule['protocol'] in ('6', '17'):
+            port_range = get_rule_port_range(oci_rule)
+            if port_range is not None:
+                group_key = (peer_key, oci_rule['protocol'])
+                if group_key not in port_range_groups.keys():
+                    # The merged rules are emitted where the first rule of the group was
+                    port_range_groups[group_key] = [oci_rule, port_range[0], []]
+                    optimized_rules.append(group_key)
+                port_range_groups[group_key][2].append(port_range[1:])
+                continue
+
+        rule_key = json.dumps(oci_rule, sort_keys=True)
+        if rule_key not in seen_rules:
+            seen_rules.add(rule_key)
+            optimized_rules.append(oci_rule)
+
+    expanded_rules = []
+    for oci_rule in optimized_rules:
+        if isinstance(oci_rule, dict):
+            expanded_rules.append(oci_rule)
+            continue
+
+        first_rule, options, port_ranges = port_range_groups[oci_rule]
+        for min_p, max_p in merge_port_ranges(port_ranges):
+            merged_rule = dict(first_rule)
+            merged_rule[options] = {"destination_port_range": {
+                "min": str(min_p),
+                "max": str(max_p)
+            }
+            }
+            expanded_rules.append(merged_rule)
+
+    return expanded_rules
+
+
+@perf.timed('oci.optimize_nsg_rules')
+def optimize_nsg_rules(oci_full_nsg_dict):
+    # Drops duplicated rules, rules covered by an 'all' protocols rule to the same peer,
+    # and merges overlapping or contiguous TCP/UDP port ranges to the same peer
+    optimization_report = {}
+    for nsg_name, resources in oci_full_nsg_dict.items():
+        rules_before = len(resources['resources'])
+        resources['resources'] = optimize_rules(resources['resources'])
+        optimization_report[nsg_name] = (rules_before, len(resources['resources']))
+
+    total_before = 0
+    total_after = 0
+    for nsg_name, (rules_before, rules_after) in optimization_report.items():
+        total_before += rules_before
+        total_after += rules_after
+        if rules_before != rules_after:
+            print(f'NSG {nsg_name}: {rules_before} -> {rules_after} rules')
+    print(f'\nOptimized rules: {total_before} -> {total_after}')
+    perf.count('oci.rules_optimized_out', total_before - total_after)
+
+    return optimization_report
+
+
+def get_oci_nsg_id(oci_nsg_display_name):
+    return "${oci_core_network_security_group.aci_exported_nsg_" + oci_nsg_display_name + ".id}"
+
+
+def pack_peer_groups(oci_rules, max_rules):
+    # First fit decreasing over the groups of rules to the same peer. A group bigger than an NSG fills
+    # whole NSGs first, so only its remainder is packed with the others.
+    peer_groups = {}
+    for rule_number, oci_rule in enumerate(oci_rules):
+        peer_groups.setdefault(get_rule_peer_key(oci_rule)[2], []).append(rule_number)
+
+    bins = []
+    remainders = []
+    for rule_numbers in peer_groups.values():
+        full_bins = len(rule_numbers) // max_rules
+        for bin_number in range(full_bins):
+            bins.append(rule_numbers[bin_number * max_rules:(bin_number + 1) * max_rules])
+        if len(rule_numbers) % max_rules != 0:
+            remainders.append(rule_numbers[full_bins * max_rules:])
+
+    for rule_numbers in sorted(remainders, key=len, reverse=True):
+        for rule_bin in bins:
+            if len(rule_bin) + len(rule_numbers) <= max_rules:
+                rule_bin.extend(rule_numbers)
+                break
+        else:
+            bins.append(list(rule_numbers))
+
+    return [[oci_rules[rule_number] for rule_number in sorted(rule_bin)] for rule_bin in bins]
+
+
+@perf.timed('oci.split_oversized_nsgs')
+def split_oversized_nsgs(oci_full_nsg_dict, _nsg_over_allowed_rules, split_nsgs=()):
+    # NSGs with more rules than allowed are split in <name>-1, <name>-2, ... keeping the rules to the same
+    # peer together. The VNICs of the EPG must be attached to all the parts, so the rules of the other NSGs
+    # that point to the EPG are rewritten to its first part.
+    # split_nsgs: NSGs already split that are not in oci_full_nsg_dict, on an incremental export
+    max_rules = _nsg_over_allowed_rules - 1
+    split_nsg_dict = {}
+    renamed_nsg_ids = {get_oci_nsg_id(nsg_name): get_oci_nsg_id(nsg_name + '-1') for nsg_name in split_nsgs}
+
+    for nsg_name, resources in oci_full_nsg_dict.items():
+        if len(resources['resources']) <= max_rules:
+            split_nsg_dict[nsg_name] = resources
+            continue
+
+        rule_bins = pack_peer_groups(resources['resources'], max_rules)
+        print(f'NSG {nsg_name}: {len(resources["resources"])} rules split in {len(rule_bins)} NSGs')
+        if len(rule_bins) > _MAX_NSG_PER_VNIC:
+            print(f'WARNING: {nsg_name} needs {len(rule_bins)} NSGs, a VNIC can only be attached '
+                  f'to {_MAX_NSG_PER_VNIC}')
+
+        renamed_nsg_ids[get_oci_nsg_id(nsg_name)] = get_oci_nsg_id(nsg_name + '-1')
+        for bin_number, rule_bin in enumerate(rule_bins, start=1):
+            part_nsg_id = get_oci_nsg_id(nsg_name + '-' + str(bin_number))
+            part_rules = []
+            for oci_rule in rule_bin:
+                part_rule = dict(oci_rule)
+                part_rule['network_security_group_id'] = part_nsg_id
+                part_rules.append(part_rule)
+            split_nsg_dict[nsg_name + '-' + str(bin_number)] = {'resources': part_rules, 'split_from': nsg_name}
+
+    # New rule dicts, the rules of oci_full_nsg_dict are left as they are
+    if len(renamed_nsg_ids) != 0:
+        for nsg_name, resources in split_nsg_dict.items():
+            split_nsg_dict[nsg_name] = dict(resources, resources=[rename_rule_peer(oci_rule, renamed_nsg_ids)
+                                                                  for oci_rule in resources['resources']])
+
+    return split_nsg_dict
+
+
+def rename_rule_peer(oci_rule, renamed_nsg_ids):
+    # Returns the rule, or a copy of it pointing to the renamed peer NSG
+    peer = 'source' if oci_rule['direction'] == 'INGRESS' else 'destination'
+    if oci_rule[peer] not in renamed_nsg_ids.keys():
+        return oci_rule
+    renamed_rule = dict(oci_rule)
+    renamed_rule[peer] = renamed_nsg_ids[oci_rule[peer]]
+    return renamed_rule
+
+
+@perf.timed('oci.save_oci_files')
+def save_oci_files(oci_nsg, _export_to_dir, _nsg_over_allowed_rules, only_nsgs=None):
+    # only_nsgs: oci_nsg has only these NSGs, the files of the other NSGs are left as they are
     ingress_nsg_with_exceeding_rules = {}
     egress_nsg_with_exceeding_rules = {}
     rule_entry_count = 0
     if not os.path.exists(_export_to_dir):
         os.makedirs(_export_to_dir)
+
+    manifest = read_manifest(_export_to_dir)
+    new_manifest = {}
+    if only_nsgs is not None:
+        for file_name, file_entry in manifest.items():
+            if get_manifest_nsg(file_name, file_entry) not in only_nsgs:
+                new_manifest[file_name] = file_entry
+    files_written = []
+    files_skipped = 0
+    writer = ThreadPoolExecutor(max_workers=_WRITER_THREADS)
+
     for nsg_name, resources in oci_nsg.items():
-        with open(_export_to_dir + nsg_name + '.tf.json', 'w') as file:
-            item = "aci_exported_nsg_" + nsg_name
-            nsg_dict = {"resource": [{
-                "oci_core_network_security_group": {
-                    item: {
-                        "compartment_id": "${var.compartment_id}",
-                        "vcn_id": "${var.vcn_id}",
-                        "display_name": nsg_name
-                    }
+        item = "aci_exported_nsg_" + nsg_name
+        nsg_dict = {"resource": [{
+            "oci_core_network_security_group": {
+                item: {
+                    "compartment_id": "${var.compartment_id}",
+                    "vcn_id": "${var.vcn_id}",
+                    "display_name": nsg_name
                 }
             }
-            ]
-            }
+        }
+        ]
+        }
+        rule_entry_count += 1
+
+        temp = {'oci_core_network_security_group_security_rule': []}
+
+        ingress_rule_number_counter = 1
+        egress_rule_number_counter = 1
+        for resource in resources['resources']:
             rule_entry_count += 1
+            if resource['direction'] == 'INGRESS':
+                item_sr = item + "_security_rule_IN_" + str(ingress_rule_number_counter)
+                temp["oci_core_network_security_group_security_rule"].append({item_sr: resource})
+                ingress_rule_number_counter += 1
+
+                if ingress_rule_number_counter >= _nsg_over_allowed_rules:
+                    if item not in ingress_nsg_with_exceeding_rules.keys():
+                        ingress_nsg_with_exceeding_rules[item] = _nsg_over_allowed_rules
+                    else:
+                        ingress_nsg_with_exceeding_rules[item] = ingress_rule_number_counter
+
+                    print(f'\nERROR maximum number of 120 NSG Ingress security rules per'
+                          f' NSG exceeded ! - {ingress_rule_number_counter}\n')
+                    print('Rule: ')
+                    pprint(item_sr)
+                    print('Resource: ')
+                    pprint(resource)
+
+            elif resource['direction'] == 'EGRESS':
+                item_sr = item + "_security_rule_OUT_" + str(egress_rule_number_counter)
+                temp["oci_core_network_security_group_security_rule"].append({item_sr: resource})
+                egress_rule_number_counter += 1
+
+                if egress_rule_number_counter >= 121:
+                    if item not in egress_nsg_with_exceeding_rules.keys():
+                        egress_nsg_with_exceeding_rules[item] = 121
+                    else:
+                        egress_nsg_with_exceeding_rules[item] = egress_rule_number_counter
+
+                    print(f'\nERROR maximum number of 120 NSG Egress security rules per'
+                          f' NSG exceeded ! - {egress_rule_number_counter}\n')
+                    print('Rule: ')
+                    pprint(item_sr)
+                    print('Resource: ')
+                    pprint(resource)
+
+        nsg_dict['resource'].append(temp)
+
+        # Unchanged files are not rewritten, so Terraform only sees the NSGs that changed
+        file_name = nsg_name + '.tf.json'
+        with perf.span('oci.save_oci_files.json_dumps'):
+            content = json.dumps(nsg_dict).encode('utf-8')
+        new_manifest[file_name] = [hashlib.sha256(content).hexdigest(), len(content),
+                                   resources.get('split_from', nsg_name)]
+        if manifest.get(file_name) == new_manifest[file_name] and \
+                os.path.exists(_export_to_dir + file_name) and \
+                os.path.getsize(_export_to_dir + file_name) == len(content):
+            files_skipped += 1
+        else:
+            files_written.append(writer.submit(write_file_atomic, _export_to_dir + file_name, content))
+
+    writer.shutdown()
+    for file_written in files_written:
+        file_written.result()
+
+    # Files of NSGs that are not exported anymore
+    files_deleted = 0
+    for file_name in manifest.keys():
+        if file_name not in new_manifest.keys() and os.path.exists(_export_to_dir + file_name):
+            os.remove(_export_to_dir + file_name)
+            files_deleted += 1
 
-            temp = {'oci_core_network_security_group_security_rule': []}
-
-            ingress_rule_number_counter = 1
-            egress_rule_number_counter = 1
-            for resource in resources['resources']:
-                rule_entry_count += 1
-                if resource['direction'] == 'INGRESS':
-                    item_sr = item + "_security_rule_IN_" + str(ingress_rule_number_counter)
-                    temp["oci_core_network_security_group_security_rule"].append({item_sr: resource})
-                    ingress_rule_number_counter += 1
-
-                    if ingress_rule_number_counter >= _nsg_over_allowed_rules:
-                        if item not in ingress_nsg_with_exceeding_rules.keys():
-                            ingress_nsg_with_exceeding_rules[item] = _nsg_over_allowed_rules
-                        else:
-                            ingress_nsg_with_exceeding_rules[item] = ingress_rule_number_counter
-
-                        print(f'\nERROR maximum number of 120 NSG Ingress security rules per'
-                              f' NSG exceeded ! - {ingress_rule_number_counter}\n')
-                        print('Rule: ')
-                        pprint(item_sr)
-                        print('Resource: ')
-                        pprint(resource)
-
-                elif resource['direction'] == 'EGRESS':
-                    item_sr = item + "_security_rule_OUT_" + str(egress_rule_number_counter)
-                    temp["oci_core_network_security_group_security_rule"].append({item_sr: resource})
-                    egress_rule_number_counter += 1
-
-                    if egress_rule_number_counter >= 121:
-                        if item not in egress_nsg_with_exceeding_rules.keys():
-                            egress_nsg_with_exceeding_rules[item] = 121
-                        else:
-                            egress_nsg_with_exceeding_rules[item] = egress_rule_number_counter
-
-                        print(f'\nERROR maximum number of 120 NSG Egress security rules per'
-                              f' NSG exceeded ! - {egress_rule_number_counter}\n')
-                        print('Rule: ')
-                        pprint(item_sr)
-                        print('Resource: ')
-                        pprint(resource)
-
-            nsg_dict['resource'].append(temp)
-            json.dump(nsg_dict, file)
+    write_file_atomic(_export_to_dir + _MANIFEST_FILE, json.dumps(new_manifest, indent=1).encode('utf-8'))
 
     if len(ingress_nsg_with_exceeding_rules) >= _nsg_over_allowed_rules:
         print('\nIngress NSG with more than 120 rules\n')
@@ -375,3 +589,42 @@ def save_oci_files(oci_nsg, _export_to_dir, _nsg_over_allowed_rules):
         pprint(egress_nsg_with_exceeding_rules)
 
     print(f'\nComposite rule entries: {rule_entry_count}')
+    perf.count('oci.files_written', len(files_written))
+    perf.count('oci.files_unchanged', files_skipped)
+    perf.count('oci.files_deleted', files_deleted)
+    print(f'Files written: {len(files_written)}, unchanged: {files_skipped}, stale deleted: {files_deleted}')
+
+
+def get_manifest_nsg(file_name, file_entry):
+    # NSG the file was exported from, the parts of a split NSG keep its name
+    if len(file_entry) > 2:
+        return file_entry[2]
+    return file_name[:-len('.tf.json')]
+
+
+def get_split_nsgs(_export_to_dir):
+    # NSGs exported split in parts
+    return {get_manifest_nsg(file_name, file_entry) for file_name, file_entry in read_manifest(_export_to_dir).items()
+            if get_manifest_nsg(file_name, file_entry) + '.tf.json' != file_name}
+
+
+def read_manifest(_export_to_dir):
+    if not os.path.exists(_export_to_dir + _MANIFEST_FILE):
+        return {}
+
+    with open(_export_to_dir + _MANIFEST_FILE, 'r') as file:
+        return json.load(file)
+
+
+@perf.timed('oci.write_file_atomic')
+def write_file_atomic(file_name, content):
+    # Readers never see a half written file, the temporary file replaces the old one in a single rename
+    fd, temp_file_name = tempfile.mkstemp(dir=os.path.dirname(file_name) or '.', prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(content)
+        os.chmod(temp_file_name, 0o644)
+        os.replace(temp_file_name, file_name)
+    except BaseException:
+        os.remove(temp_file_name)
+        raise
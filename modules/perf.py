@@ -0,0 +1,207 @@
+# Helpers to report resource usage next to the timing prints, and the instrumentation of the
+# export pipeline: named spans and counters written to a JSON run report.
+#
+# Instrumentation is off unless one of these environment variables is set:
+#   ACI_PERF_REPORT=<file>    write the run report to <file> when the script ends
+#   ACI_PERF_PROFILE=<modes>  comma separated: cprofile, tracemalloc. The report goes to
+#                             _DEFAULT_REPORT_FILE if ACI_PERF_REPORT is not set
+# When it is off, timed() returns the function itself and span() a shared empty context, so the
+# instrumented code runs as if it was not there. Spans and counters of batch mode export workers,
+# which run in other processes, are not in the report.
+
+import atexit
+import gc
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_DEFAULT_REPORT_FILE = 'aci-perf-report.json'
+_PROFILE_TOP_FUNCTIONS = 40  # functions of the cProfile capture in the report, by cumulative time
+_TRACEMALLOC_TOP_LINES = 20  # lines allocating the memory still in use at the end, in the report
+_TRACEMALLOC_FRAMES = 1
+
+_PROFILE_MODES = {mode.strip() for mode in os.environ.get('ACI_PERF_PROFILE', '').split(',') if mode.strip()}
+_REPORT_FILE = os.environ.get('ACI_PERF_REPORT') or (_DEFAULT_REPORT_FILE if _PROFILE_MODES else None)
+enabled = _REPORT_FILE is not None
+
+_NULL_SPAN = nullcontext()
+_lock = threading.Lock()
+_spans = {}  # name: [calls, seconds, max seconds, peak memory MB at the end of the span]
+_counters = {}
+_profiler = None
+_run_start = perf_counter()
+
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # bytes on macOS, kilobytes on Linux
+        return max_rss / (1024 * 1024)
+    return max_rss / 1024
+
+
+def format_peak_memory():
+    peak = peak_memory_mb()
+    if peak is None:
+        return 'Peak memory: n/a'
+    return 'Peak memory: {:0.1f} MB'.format(peak)
+
+
+@contextmanager
+def gc_paused():
+    # For code creating millions of objects without reference cycles, the garbage collector would
+    # scan them over and over while they are created
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def add_span_time(name, seconds, peak_mb=None):
+    with _lock:
+        span_stats = _spans.get(name)
+        if span_stats is None:
+            span_stats = _spans[name] = [0, 0.0, 0.0, None]
+        span_stats[0] += 1
+        span_stats[1] += seconds
+        span_stats[2] = max(span_stats[2], seconds)
+        if peak_mb is not None:
+            span_stats[3] = peak_mb
+
+
+@contextmanager
+def measure_span(name):
+    timer_span = perf_counter()
+    try:
+        yield
+    finally:
+        add_span_time(name, perf_counter() - timer_span, peak_memory_mb())
+
+
+def span(name):
+    # Times a block of code, for the pipeline stages: with perf.span('stage.extract'): ...
+    if not enabled:
+        return _NULL_SPAN
+    return measure_span(name)
+
+
+def timed(name):
+    # Decorator timing every call of a function, the function is left untouched when disabled
+    def decorator(function):
+        if not enabled:
+            return function
+
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            timer_call = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add_span_time(name, perf_counter() - timer_call)
+        return timed_function
+    return decorator
+
+
+def count(name, value=1):
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def get_profile_functions(profiler):
+    import pstats
+
+    stats = pstats.Stats(profiler).stats
+    functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:_PROFILE_TOP_FUNCTIONS]
+    return [{'function': '{}:{}({})'.format(file_name, line, function_name),
+             'calls': calls, 'primitive_calls': primitive_calls,
+             'own_seconds': own_seconds, 'cumulative_seconds': cumulative_seconds}
+            for (file_name, line, function_name), (primitive_calls, calls, own_seconds, cumulative_seconds, callers)
+            in functions]
+
+
+def get_tracemalloc_lines():
+    import tracemalloc
+
+    snapshot = tracemalloc.take_snapshot()
+    return [{'line': str(statistic.traceback), 'size_mb': statistic.size / (1024 * 1024), 'blocks': statistic.count}
+            for statistic in snapshot.statistics('lineno')[:_TRACEMALLOC_TOP_LINES]]
+
+
+def get_report():
+    with _lock:
+        report = {'argv': sys.argv,
+                  'python': sys.version.split()[0],
+                  'wall_seconds': perf_counter() - _run_start,
+                  'peak_memory_mb': peak_memory_mb(),
+                  'spans': {name: {'calls': calls, 'seconds': seconds, 'max_seconds': max_seconds,
+                                   'peak_memory_mb': span_peak_mb}
+                            for name, (calls, seconds, max_seconds, span_peak_mb) in sorted(_spans.items())},
+                  'counters': dict(sorted(_counters.items()))}
+
+    if 'tracemalloc' in _PROFILE_MODES:
+        import tracemalloc
+
+        if tracemalloc.is_tracing():
+            report['tracemalloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            report['tracemalloc_top_lines'] = get_tracemalloc_lines()
+    if _profiler is not None:
+        report['profile_file'] = _REPORT_FILE + '.prof'
+        report['profile_functions'] = get_profile_functions(_profiler)
+    return report
+
+
+def write_report():
+    # The cProfile capture also goes to <report>.prof, for pstats or snakeviz
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_REPORT_FILE + '.prof')
+
+    try:
+        with open(_REPORT_FILE, 'w') as file_write:
+            json.dump(get_report(), file_write, indent=4)
+    except OSError as e:
+        print('[!] Performance report not saved: {}'.format(e), file=sys.stderr)
+        return False
+    print('Performance report saved to {}'.format(_REPORT_FILE), file=sys.stderr)
+    return True
+
+
+def start_capture():
+    global _profiler
+
+    if 'tracemalloc' in _PROFILE_MODES:
+        import tracemalloc
+
+        tracemalloc.start(_TRACEMALLOC_FRAMES)
+    if 'cprofile' in _PROFILE_MODES:
+        import cProfile
+
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    unknown_modes = _PROFILE_MODES - {'tracemalloc', 'cprofile'}
+    if len(unknown_modes) != 0:
+        print('[!] Unknown ACI_PERF_PROFILE modes: {}'.format(', '.join(sorted(unknown_modes))), file=sys.stderr)
+    atexit.register(write_report)
+
+
+if enabled:
+    import multiprocessing
+
+    # Only the script writes the report, not the processes it starts
+    if multiprocessing.parent_process() is None:
+        start_capture()
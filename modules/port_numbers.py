@@ -1,27 +1,77 @@
-import socket
+# Service name to port number resolution, shared by the OCI exporter and the other scripts.
+# It uses the bundled table below instead of socket.getservbyname, so the result doesn't depend
+# on the /etc/services of the host running the export.
 
+# Bump it when _SERVICE_PORT_NUMBERS changes, the generated rules may change with it
+_SERVICE_TABLE_VERSION = '2024.1'
 
-def identify_port_number(aci_filter_entry):
-    if aci_filter_entry[2] == 'unspecified':
-        min_p = '0'
+# Subset of the IANA service names, as found in /etc/services
+_SERVICE_PORT_NUMBERS = {
+    'ftp-data': '20',
+    'ftp': '21',
+    'ssh': '22',
+    'telnet': '23',
+    'smtp': '25',
+    'domain': '53',
+    'tftp': '69',
+    'http': '80',
+    'kerberos': '88',
+    'pop3': '110',
+    'ntp': '123',
+    'netbios-ssn': '139',
+    'imap': '143',
+    'imap2': '143',
+    'snmp': '161',
+    'snmp-trap': '162',
+    'snmptrap': '162',
+    'bgp': '179',
+    'ldap': '389',
+    'https': '443',
+    'microsoft-ds': '445',
+    'smtps': '465',
+    'syslog': '514',
+    'rtsp': '554',
+    'submission': '587',
+    'ldaps': '636',
+    'imaps': '993',
+    'pop3s': '995',
+    'ms-sql-s': '1433',
+    'radius': '1812',
+    'nfs': '2049',
+    'mysql': '3306',
+    'ms-wbt-server': '3389',
+    'sip': '5060',
+    'postgresql': '5432',
+    'redis': '6379',
+    'http-alt': '8080',
+}
+
+# ACI port names sometimes don't match the RFC.
+# Add to this dictionary different port number and names
+_EXTRA_PORT_NUMBERS = {
+    'ftpData': '20',
+    'dns': '53',
+}
+
+# Merged once at import, every lookup after that is a dictionary hit
+_PORT_NUMBERS = dict(_SERVICE_PORT_NUMBERS, **_EXTRA_PORT_NUMBERS)
+
+
+def get_port_number(aci_port):
+    # Numbers and unknown names are returned as they are
+    return _PORT_NUMBERS.get(aci_port, aci_port)
+
+
+def identify_port_number(aci_filter_entry, unspecified_min_port='0'):
+    # Port numbers as strings, from a model.FilterEntry
+    if aci_filter_entry.from_port is None:
+        min_p = unspecified_min_port
     else:
-        try:
-            min_p = str(socket.getservbyname(aci_filter_entry[2]))
-        except OSError:
-            if aci_filter_entry[2] == 'ftpData':
-                min_p = '20'
-            else:
-                min_p = aci_filter_entry[2]
-
-    if aci_filter_entry[3] == 'unspecified':
+        min_p = get_port_number(str(aci_filter_entry.from_port))
+
+    if aci_filter_entry.to_port is None:
         max_p = '65535'
     else:
-        try:
-            max_p = str(socket.getservbyname(aci_filter_entry[3]))
-        except OSError:
-            if aci_filter_entry[2] == 'ftpData':
-                max_p = '20'
-            else:
-                max_p = aci_filter_entry[3]
+        max_p = get_port_number(str(aci_filter_entry.to_port))
 
     return min_p, max_p
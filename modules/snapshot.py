@@ -0,0 +1,173 @@
+# Local store of downloaded tenants, shared by the scripts.
+# Snapshots are gzip files named by the sha256 of the JSON, listed per (host, tenant) in index.json.
+# A tenant is downloaded again only when its latest APIC audit log record (aaaModLR) changed.
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from time import time
+
+import modules.aci as aci
+import modules.model_cache as model_cache
+
+_SNAPSHOT_DIR = './data/snapshots/'
+_INDEX_FILE = 'index.json'
+_SNAPSHOT_RETENTION = 5  # snapshots kept for every (host, tenant)
+_SNAPSHOT_MAX_AGE_DAYS = 30  # older snapshots are deleted, except the latest one of every (host, tenant)
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+class HashWriter:
+    # File object that hashes what is written to it
+    def __init__(self, file_write):
+        self.file_write = file_write
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.file_write.write(data)
+
+
+def open_snapshot(snapshot_file, mode='rb'):
+    # Works for the snapshots and for the plain .json files downloaded before
+    if snapshot_file.endswith('.gz'):
+        return gzip.open(snapshot_file, mode)
+    return open(snapshot_file, mode)
+
+
+def open_stream(stream):
+    # A tenant read from a pipe, plain JSON or gzip like the snapshots
+    if stream.peek(len(_GZIP_MAGIC))[:len(_GZIP_MAGIC)] == _GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    return stream
+
+
+def load_snapshot(snapshot_file):
+    with open_snapshot(snapshot_file, 'rt') as file_read:
+        return json.load(file_read)
+
+
+def get_last_modification(apic, tena):
+    # Id and time of the latest audit log record of the tenant subtree, None if it can't be read.
+    # Also None without records, the audit log may have been purged and tell nothing about the changes.
+    api_path = '/api/node/mo/uni/tn-{}.json?rsp-subtree-include=audit-logs,no-scoped,subtree' \
+               '&order-by=aaaModLR.created|desc&page=0&page-size=1'.format(tena)
+    data = apic.get(api_path)
+    if data is None or len(data['imdata']) == 0:
+        return None
+
+    attributes = data['imdata'][0]['aaaModLR']['attributes']
+    return '{} {}'.format(attributes['id'], attributes['created'])
+
+
+class SnapshotStore:
+    def __init__(self, directory=_SNAPSHOT_DIR, retention=_SNAPSHOT_RETENTION, max_age_days=_SNAPSHOT_MAX_AGE_DAYS):
+        self.directory = directory
+        self.retention = retention
+        self.max_age_days = max_age_days
+        self.lock = threading.Lock()  # batch mode downloads several tenants at the same time
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def read_index(self):
+        try:
+            with open(self.path(_INDEX_FILE), 'r') as file_read:
+                return json.load(file_read)
+        except (OSError, ValueError):
+            return {}
+
+    def write_index(self, index):
+        file_descriptor, temp_file = tempfile.mkstemp(dir=self.directory, prefix='.' + _INDEX_FILE)
+        with os.fdopen(file_descriptor, 'w') as file_write:
+            json.dump(index, file_write, indent=2)
+        os.replace(temp_file, self.path(_INDEX_FILE))
+
+    def get_snapshots(self, host, tena):
+        # Newest first
+        with self.lock:
+            return self.read_index().get(host, {}).get(tena, [])
+
+    def list_latest(self):
+        # (host, tenant, entry) of the newest snapshot of every downloaded tenant
+        with self.lock:
+            index = self.read_index()
+        return [(host, tena, snapshots[0]) for host, tenant_snapshots in index.items()
+                for tena, snapshots in tenant_snapshots.items() if len(snapshots) != 0]
+
+    def get_latest(self, host, tena):
+        for entry in self.get_snapshots(host, tena):
+            if os.path.exists(self.path(entry['file'])):
+                return entry
+        return None
+
+    def add(self, host, tena, temp_file, sha256, size, last_modification):
+        entry = {'file': sha256 + '.json.gz', 'sha256': sha256, 'size': size, 'downloaded': time(),
+                 'last_modification': last_modification}
+
+        with self.lock:
+            # Same content as a snapshot already stored, only the index changes
+            if os.path.exists(self.path(entry['file'])):
+                os.remove(temp_file)
+            else:
+                os.replace(temp_file, self.path(entry['file']))
+
+            index = self.read_index()
+            snapshots = index.setdefault(host, {}).setdefault(tena, [])
+            snapshots[:] = [entry] + [snapshot for snapshot in snapshots if snapshot['sha256'] != sha256]
+            self.apply_retention(index)
+            self.write_index(index)
+
+        return entry
+
+    def apply_retention(self, index):
+        max_age = time() - self.max_age_days * 86400
+        for tenant_snapshots in index.values():
+            for tena, snapshots in tenant_snapshots.items():
+                tenant_snapshots[tena] = snapshots[:1] + [snapshot for snapshot in snapshots[1:self.retention]
+                                                          if snapshot['downloaded'] >= max_age]
+
+        # A file is kept while any (host, tenant) still points to it
+        kept_files = {snapshot['file'] for tenant_snapshots in index.values()
+                      for snapshots in tenant_snapshots.values() for snapshot in snapshots}
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.json.gz') and file_name not in kept_files:
+                os.remove(self.path(file_name))
+                if os.path.exists(self.path(model_cache.get_cache_file(file_name))):
+                    os.remove(self.path(model_cache.get_cache_file(file_name)))
+
+    def download(self, apic, tena, last_modification):
+        file_descriptor, temp_file = tempfile.mkstemp(dir=self.directory, prefix='.download-')
+        with os.fdopen(file_descriptor, 'wb') as file_write, \
+                gzip.GzipFile(fileobj=file_write, mode='wb', compresslevel=6) as gzip_write:
+            hash_write = HashWriter(gzip_write)
+            downloaded = aci.download_tenant(apic, tena, hash_write)
+
+        if not downloaded:
+            os.remove(temp_file)
+            return None
+        return self.add(apic.host, tena, temp_file, hash_write.hash.hexdigest(), hash_write.size, last_modification)
+
+    def get_tenant_snapshot(self, apic, tena):
+        # Path of an up to date snapshot of the tenant, downloaded only if the tenant changed or the audit log
+        # can't tell
+        last_modification = get_last_modification(apic, tena)
+        latest = self.get_latest(apic.host, tena)
+
+        if latest is not None and last_modification is not None \
+                and latest['last_modification'] == last_modification:
+            print('\nTenant {} not modified since the last download, using snapshot {}'.format(tena, latest['file']))
+            return self.path(latest['file'])
+
+        entry = self.download(apic, tena, last_modification)
+        if entry is None:
+            return None
+        print('\nTenant {} saved to snapshot {}'.format(tena, entry['file']))
+        return self.path(entry['file'])
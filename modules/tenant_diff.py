@@ -0,0 +1,60 @@
+# Structural diff of two extracted tenants (aci.extract_data), to translate again only the NSGs
+# whose contracts, filters or EPG relations changed between the snapshots
+
+import modules.aci as aci
+
+
+def get_changed_names(old_dict, new_dict):
+    # Keys added, removed or with a different value
+    changed = set(old_dict.keys()) ^ set(new_dict.keys())
+    for name in set(old_dict.keys()) & set(new_dict.keys()):
+        if old_dict[name] != new_dict[name]:
+            changed.add(name)
+    return changed
+
+
+def get_contract_epgs(contract_index, contract_names):
+    epg_names = set()
+    for contract_name in contract_names:
+        epg_names.update(aci.get_indexed_providers(contract_index, contract_name))
+        epg_names.update(aci.get_indexed_consumers(contract_index, contract_name))
+    return epg_names
+
+
+def get_contract_peers(contract_index, epg_names):
+    # EPGs sharing any contract with the given EPGs
+    contract_names = set()
+    for epg_name in epg_names:
+        if epg_name in contract_index['epg_contracts'].keys():
+            contract_names.update(contract_index['epg_contracts'][epg_name].provided)
+            contract_names.update(contract_index['epg_contracts'][epg_name].consumed)
+    return get_contract_epgs(contract_index, contract_names)
+
+
+def diff_tenants(old_data, new_data, old_contract_index, new_contract_index):
+    # Returns the NSGs (AP-EPG names) to translate again, with the removed EPGs, and a report
+    old_contracts, old_filters = old_data[3], old_data[5]
+    new_contracts, new_filters = new_data[3], new_data[5]
+
+    changed_filters = get_changed_names(old_filters, new_filters)
+    changed_contracts = get_changed_names(old_contracts, new_contracts)
+    for contracts in (old_contracts, new_contracts):
+        for contract_name, contract in contracts.items():
+            for subject in contract.subjects:
+                if subject.filter_name in changed_filters:
+                    changed_contracts.add(contract_name)
+
+    changed_epgs = get_changed_names(old_contract_index['epg_contracts'], new_contract_index['epg_contracts'])
+
+    # The rules of an EPG also name the peers of its contracts, in index order
+    affected_contracts = changed_contracts \
+        | get_changed_names(old_contract_index['providers'], new_contract_index['providers']) \
+        | get_changed_names(old_contract_index['consumers'], new_contract_index['consumers'])
+
+    changed_nsgs = changed_epgs \
+        | get_contract_epgs(old_contract_index, affected_contracts) \
+        | get_contract_epgs(new_contract_index, affected_contracts)
+
+    report = {'filters': len(changed_filters), 'contracts': len(changed_contracts), 'epgs': len(changed_epgs),
+              'nsgs': len(changed_nsgs)}
+    return changed_nsgs, report
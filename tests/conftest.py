@@ -0,0 +1,46 @@
+# The scripts and modules are run from the repository directory, the tests import them the same way
+
+import io
+import json
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+import generate_tenant
+
+_SKIP_EPG_NAMES = ['-BD', 'VLAN']
+
+
+def make_tenant(scale=0.5, seed=1):
+    tenant_text = io.StringIO()
+    generate_tenant.write_tenant(tenant_text, generate_tenant.get_tenant_counts(scale), seed=seed)
+    return json.loads(tenant_text.getvalue())
+
+
+def write_tenant_file(path, tenant):
+    with open(path, 'w') as file_write:
+        json.dump(tenant, file_write)
+    return str(path)
+
+
+@pytest.fixture
+def skip_epg_names():
+    return list(_SKIP_EPG_NAMES)
+
+
+@pytest.fixture
+def tenant():
+    return make_tenant()
+
+
+@pytest.fixture(params=['synthetic', 'cisco.json'])
+def tenant_file(request, tmp_path):
+    # A synthetic tenant and the sample tenant of the repository
+    if request.param == 'cisco.json':
+        return os.path.join(REPO_DIR, 'data', 'cisco.json')
+    return write_tenant_file(tmp_path / 'tenant.json', make_tenant())
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+import modules.aci as aci
+import modules.json_stream as json_stream
+
+
+def test_extract_data_from_stream_equals_extract_data(tenant_file):
+    with open(tenant_file) as file_read:
+        expected = aci.extract_data(json.load(file_read))
+    with open(tenant_file, 'rb') as file_read:
+        assert aci.extract_data_from_stream(file_read) == expected
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 4096])
+def test_extract_data_from_stream_small_chunks(tenant_file, chunk_size):
+    # Tokens and strings split over the chunk boundaries
+    with open(tenant_file) as file_read:
+        expected = aci.extract_data(json.load(file_read))
+    with open(tenant_file, 'rb') as file_read:
+        tenant_children = json_stream.iter_tenant_children(file_read, chunk_size=chunk_size)
+        assert aci.extract_tenant_children(tenant_children) == expected
+
+
+def test_circuit_breaker_opens_after_failures_in_a_row():
+    breaker = aci.CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    assert breaker.allow() == 'closed'
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    breaker.record_success()  # the failures must be in a row
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.allow() is None
+    assert breaker.get_retry_time() > 0
+
+
+def test_circuit_breaker_half_open_lets_one_trial_through():
+    breaker = aci.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    assert breaker.record_failure()
+    assert breaker.allow() == 'half open'
+    assert breaker.allow() is None
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow() == 'closed'
+
+
+def test_circuit_breaker_failed_trial_opens_again():
+    breaker = aci.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow() == 'half open'
+    assert breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_circuit_breaker_ended_trial_lets_the_next_call_through():
+    breaker = aci.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow() == 'half open'
+    breaker.end_trial()
+    assert breaker.allow() == 'half open'
+
+
+def test_apic_session_ends_the_trial_on_unexpected_errors():
+    pytest.importorskip('requests')
+
+    def request_failing(*args, **kwargs):
+        raise ValueError('unexpected')
+
+    breaker = aci.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    apic = aci.ApicSession('apic.invalid', 'user', 'password', breaker=breaker)
+    apic.session.request = request_failing
+    breaker.record_failure()
+    with pytest.raises(ValueError):
+        apic.request('GET', '/api/class/fvTenant.json', authenticate=False)
+    assert breaker.allow() == 'half open'
@@ -0,0 +1,20 @@
+import asyncio
+
+import pytest
+
+import modules.aci_events as aci_events
+
+
+def test_subscriber_reconnects_after_unexpected_errors(monkeypatch):
+    pytest.importorskip('aiohttp')
+    monkeypatch.setattr(aci_events, '_RECONNECT_TIMER', 0)
+    errors = [KeyError('imdata'), RuntimeError('bad event'), asyncio.CancelledError()]
+
+    async def listen(session):
+        raise errors.pop(0)
+
+    subscriber = aci_events.ApicEventSubscriber('apic1', 'user', 'password', [], None)
+    subscriber.listen = listen
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(subscriber.run())
+    assert errors == []
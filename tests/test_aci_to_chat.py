@@ -0,0 +1,43 @@
+import asyncio
+
+import aci_to_chat
+import modules.fault_cache as fault_cache
+
+_HOST = 'apic1'
+_DN = 'topology/pod-1/node-101/sys/fault-F0532'
+
+
+class Dispatcher:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message.split('\n')[0])
+
+    def notify(self, kind, dn, message):
+        self.messages.append(message.split('\n')[0])
+
+
+def handle_faults(faults, severities):
+    dispatcher = Dispatcher()
+    for severity in severities:
+        attributes = {'dn': _DN, 'rule': 'ethpm-if-port-down-infra-epg', 'descr': 'port down'}
+        if severity == 'cleared':
+            attributes['status'] = 'deleted'
+        else:
+            attributes['severity'] = severity
+        asyncio.run(aci_to_chat.handle_event(dispatcher, faults, _HOST, aci_to_chat._FAULT_CLASS, attributes))
+    return dispatcher.messages
+
+
+def test_faults_not_matched_are_not_reported_flapping_nor_suppressed():
+    faults = fault_cache.FaultCache(flap_threshold=4, flap_window=600)
+    assert handle_faults(faults, ['warning', 'cleared'] * 4) == []
+    assert faults.digest() is None
+
+
+def test_clear_of_a_matched_fault_is_reported():
+    faults = fault_cache.FaultCache()
+    messages = handle_faults(faults, ['major', 'warning', 'cleared'])
+    assert len(messages) == 2
+    assert handle_faults(faults, ['cleared']) == []
@@ -0,0 +1,36 @@
+import copy
+
+import pytest
+
+import duplicateTenant as duplicate_tenant
+
+
+@pytest.mark.parametrize('dn, expected', [
+    ('uni/tn-T1', 'uni/tn-T2'),
+    ('uni/tn-T1/ap-web/epg-front', 'uni/tn-T2/ap-web/epg-front'),
+    ('uni/tn-T10/ap-web', 'uni/tn-T10/ap-web'),  # another tenant starting with the same name
+    ('uni/tn-common/brc-default', 'uni/tn-common/brc-default'),
+    ('topology/pod-1/node-101', 'topology/pod-1/node-101'),
+])
+def test_rewrite_dn(dn, expected):
+    assert duplicate_tenant.rewrite_dn(dn, 'T1', 'T2') == expected
+
+
+def test_clone_mo_points_only_the_tenant_references_to_the_new_tenant():
+    mo = {'attributes': {'dn': 'uni/tn-T1/ap-T1-web', 'name': 'T1-web'},
+          'children': [
+              {'fvAEPg': {'attributes': {'name': 'T1-front', 'monPolDn': 'uni/tn-T1/monepg-default'},
+                          'children': [{'fvRsBd': {'attributes': {'tnFvBDName': 'bd-1',
+                                                                  'tDn': 'uni/tn-common/BD-shared'}}}]}},
+              {'vzRsAnyToCons': {'attributes': {'tnFvTenantName': 'T1', 'tnVzBrCPName': 'T1'}}},
+          ]}
+    original = copy.deepcopy(mo)
+
+    clone = duplicate_tenant.clone_mo(mo, 'T1', 'T2')
+
+    assert mo == original
+    assert clone['attributes'] == {'dn': 'uni/tn-T2/ap-T1-web', 'name': 'T1-web'}
+    epg = clone['children'][0]['fvAEPg']
+    assert epg['attributes'] == {'name': 'T1-front', 'monPolDn': 'uni/tn-T2/monepg-default'}
+    assert epg['children'][0]['fvRsBd']['attributes']['tDn'] == 'uni/tn-common/BD-shared'
+    assert clone['children'][1]['vzRsAnyToCons']['attributes'] == {'tnFvTenantName': 'T2', 'tnVzBrCPName': 'T1'}
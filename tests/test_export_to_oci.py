@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+
+import getTenantExportToOCI as export_to_oci
+import modules.oci as oci
+from conftest import make_tenant, write_tenant_file
+
+_NOT_COMPARED_FILES = ['export.log', export_to_oci._EXPORT_STATE_FILE, export_to_oci._EXPORT_MODEL_FILE]
+
+
+def change_tenant(tenant):
+    # A filter entry port changed, a contract consumed by one more EPG and a provider removed
+    children = tenant['imdata'][0]['fvTenant']['children']
+    filters = [child['vzFilter'] for child in children if 'vzFilter' in child]
+    entry_attributes = filters[0]['children'][0]['vzEntry']['attributes']
+    entry_attributes.update({'prot': 'tcp', 'dFromPort': '8443', 'dToPort': '8443'})
+
+    epgs = [epg['fvAEPg'] for child in children if 'fvAp' in child for epg in child['fvAp']['children']]
+    epgs[1]['children'].append({'fvRsCons': {'attributes': {'tnVzBrCPName': 'con-0'}}})
+    epgs[2]['children'] = [epg_child for epg_child in epgs[2]['children'] if 'fvRsProv' not in epg_child]
+    return tenant
+
+
+def read_export(export_dir):
+    export_files = {}
+    for file_name in os.listdir(export_dir):
+        if file_name not in _NOT_COMPARED_FILES:
+            with open(os.path.join(export_dir, file_name), 'rb') as file_read:
+                export_files[file_name] = file_read.read()
+    # The entries of the manifest are in the order the files were written
+    export_files[oci._MANIFEST_FILE] = json.loads(export_files[oci._MANIFEST_FILE])
+    return export_files
+
+
+@pytest.mark.parametrize('nsg_over_allowed_rules', [121, 10])
+@pytest.mark.parametrize('change', ['new file', 'edited in place', 'model removed'])
+def test_incremental_export_equals_full_export(tmp_path, monkeypatch, nsg_over_allowed_rules, change):
+    monkeypatch.setattr(export_to_oci, '_NSG_OVER_ALLOWED_RULES', nsg_over_allowed_rules)
+    old_file = write_tenant_file(tmp_path / 'old.json', make_tenant())
+    new_file = str(tmp_path / 'new.json')
+
+    # The same tenant exported to the same directory twice, the second time only the changes are translated
+    export_dir = tmp_path / 'incremental' / 'bench'
+    monkeypatch.setattr(export_to_oci, '_EXPORT_TO_DIR', str(tmp_path / 'incremental') + '/')
+    export_to_oci.batch_export_config('bench', old_file)
+    if change == 'edited in place':
+        new_file = old_file
+    elif change == 'model removed':
+        os.remove(export_dir / export_to_oci._EXPORT_MODEL_FILE)
+    write_tenant_file(new_file, change_tenant(make_tenant()))
+    export_to_oci.batch_export_config('bench', new_file)
+    with open(export_dir / 'export.log') as file_read:
+        export_log = file_read.read()
+    assert ('NSGs to translate' in export_log) == (change != 'model removed')
+
+    monkeypatch.setattr(export_to_oci, '_EXPORT_TO_DIR', str(tmp_path / 'full') + '/')
+    export_to_oci.batch_export_config('bench', new_file)
+
+    assert read_export(export_dir) == read_export(tmp_path / 'full' / 'bench')
+
+
+def test_same_configuration_translates_nothing(tmp_path, monkeypatch):
+    config_file = write_tenant_file(tmp_path / 'tenant.json', make_tenant())
+    monkeypatch.setattr(export_to_oci, '_EXPORT_TO_DIR', str(tmp_path / 'export') + '/')
+    export_to_oci.batch_export_config('bench', config_file)
+    assert export_to_oci.batch_export_config('bench', config_file)['nsgs'] == 0
@@ -0,0 +1,61 @@
+import modules.fault_cache as fault_cache
+
+_DN = 'apic1:topology/pod-1/node-101/sys/fault-F0532'
+_RULE = 'ethpm-if-port-down-infra-epg'
+
+
+def test_repeats_are_suppressed_while_in_the_ttl():
+    faults = fault_cache.FaultCache(ttl=60)
+    assert faults.observe(_DN, _RULE, 'major', now=0) == fault_cache.SEND
+    assert faults.observe(_DN, _RULE, 'major', now=30) == fault_cache.SUPPRESS
+    assert faults.observe(_DN, _RULE, 'major', now=100) == fault_cache.SEND
+    assert faults.observe(_DN, _RULE, 'critical', now=101) == fault_cache.SEND
+    assert faults.get_stats()['hits'] == 1
+
+
+def test_state_changes_are_always_sent():
+    faults = fault_cache.FaultCache(ttl=3600)
+    assert faults.observe(_DN, _RULE, 'major', now=0) == fault_cache.SEND
+    assert faults.observe(_DN, _RULE, 'cleared', now=10) == fault_cache.CLEARED
+    assert faults.observe(_DN, _RULE, 'cleared', now=11) == fault_cache.SUPPRESS
+    assert faults.get_raised_severity(_DN) == 'major'
+    assert faults.observe(_DN, _RULE, 'major', now=20) == fault_cache.SEND
+    assert faults.observe(_DN, _RULE, 'major', now=21) == fault_cache.SUPPRESS
+
+
+def test_flapping_is_reported_once():
+    faults = fault_cache.FaultCache(flap_threshold=4, flap_window=600)
+    severities = ['major', 'cleared', 'major', 'cleared']
+    assert [faults.observe(_DN, _RULE, severity, now=now) for now, severity in enumerate(severities)] == \
+        [fault_cache.SEND, fault_cache.CLEARED, fault_cache.SEND, fault_cache.CLEARED]
+    assert faults.observe(_DN, _RULE, 'major', now=4) == fault_cache.FLAPPING
+    assert faults.observe(_DN, _RULE, 'cleared', now=5) == fault_cache.SUPPRESS
+    assert faults.get_stats()['flapping'] == 1
+
+
+def test_flapping_ends_out_of_the_window():
+    faults = fault_cache.FaultCache(ttl=0, flap_threshold=2, flap_window=10)
+    faults.observe(_DN, _RULE, 'major', now=0)
+    faults.observe(_DN, _RULE, 'cleared', now=1)
+    assert faults.observe(_DN, _RULE, 'major', now=2) == fault_cache.FLAPPING
+    assert faults.observe(_DN, _RULE, 'major', now=100) == fault_cache.SEND
+    assert faults.get_stats()['flapping'] == 0
+
+
+def test_digest_lists_the_suppressed_faults_and_clears():
+    faults = fault_cache.FaultCache()
+    assert faults.digest() is None
+    for now in range(3):
+        faults.observe(_DN, _RULE, 'major', now=now)
+    digest = faults.digest()
+    assert '2 on 1 faults' in digest
+    assert _DN in digest
+    assert faults.digest() is None
+
+
+def test_cache_size_is_bounded():
+    faults = fault_cache.FaultCache(max_size=2)
+    for fault_number in range(3):
+        faults.observe('{}-{}'.format(_DN, fault_number), _RULE, 'major', now=0)
+    assert faults.get_stats()['size'] == 2
+    assert faults.observe('{}-0'.format(_DN), _RULE, 'major', now=1) == fault_cache.SEND
@@ -0,0 +1,27 @@
+import io
+
+import modules.aci as aci
+import generate_tenant
+
+
+def write_tenant_text(counts, seed=1):
+    tenant_text = io.StringIO()
+    generate_tenant.write_tenant(tenant_text, counts, seed=seed)
+    return tenant_text.getvalue()
+
+
+def test_same_arguments_give_the_same_tenant():
+    counts = generate_tenant.get_tenant_counts(0.5)
+    assert write_tenant_text(counts) == write_tenant_text(counts)
+    assert write_tenant_text(counts) != write_tenant_text(counts, seed=2)
+
+
+def test_tenant_has_the_counts_asked(tenant):
+    counts = generate_tenant.get_tenant_counts(0.5)
+    full_aep, num_aepg, num_epg, full_contract, num_con, full_filter, num_fil = aci.extract_data(tenant)
+    assert num_aepg == counts['app_profiles']
+    assert num_epg == counts['app_profiles'] * counts['epgs_per_app_profile']
+    assert num_con == counts['contracts']
+    assert num_fil == counts['filters']
+    assert all(len(epg.consumed) == counts['consumed_per_epg'] and len(epg.provided) == counts['provided_per_epg']
+               for aep in full_aep for epg in aep.epgs)
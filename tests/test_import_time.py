@@ -0,0 +1,11 @@
+import pytest
+
+import import_time
+
+
+# Only the imports are checked, the time against the budget is left to benchmarks/import_time.py as a
+# loaded machine would make it fail
+@pytest.mark.parametrize('module_name', import_time._SCRIPT_BUDGETS)
+def test_script_import_is_lazy(module_name):
+    import_ms, lazy_imported = import_time.check_script(module_name, 1)
+    assert lazy_imported == []
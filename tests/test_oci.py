@@ -0,0 +1,74 @@
+import copy
+import json
+from collections import Counter
+
+import pytest
+
+import modules.aci as aci
+import modules.oci as oci
+import oci_by_rule
+
+
+def extract_tenant(tenant, skip_epg_names):
+    tenant_data = aci.extract_data(tenant)
+    return tenant_data, aci.build_contract_index(tenant_data[0], skip_epg_names)
+
+
+@pytest.mark.parametrize('default_permit', [True, False])
+def test_export_to_oci_format_equals_export_by_rule(tenant, skip_epg_names, default_permit):
+    tenant_data, contract_index = extract_tenant(tenant, skip_epg_names)
+    by_rule = oci_by_rule.export_to_oci_format(tenant_data[0], tenant_data[3], tenant_data[5], default_permit,
+                                               skip_epg_names, contract_index)
+    columnar = oci.export_to_oci_format(tenant_data[0], tenant_data[3], tenant_data[5], default_permit,
+                                        skip_epg_names, contract_index)
+    assert json.dumps(columnar) == json.dumps(by_rule)
+
+
+def test_export_to_oci_format_rules_share_no_dict(tenant, skip_epg_names):
+    tenant_data, contract_index = extract_tenant(tenant, skip_epg_names)
+    oci_dict = oci.export_to_oci_format(tenant_data[0], tenant_data[3], tenant_data[5], False, skip_epg_names,
+                                        contract_index)
+    nested_dicts = [id(value) for resources in oci_dict.values() for oci_rule in resources['resources']
+                    for options in oci_rule.values() if isinstance(options, dict)
+                    for value in (options, options['destination_port_range'])]
+    assert len(nested_dicts) != 0
+    assert len(set(nested_dicts)) == len(nested_dicts)
+
+
+def get_rule_peer(oci_rule):
+    return 'source' if oci_rule['direction'] == 'INGRESS' else 'destination'
+
+
+@pytest.mark.parametrize('limit_ratio', [0.2, 0.8])
+def test_split_oversized_nsgs_keeps_every_rule(tenant, skip_epg_names, limit_ratio):
+    # Most NSGs split, and only the biggest ones, pointed to by NSGs not split
+    tenant_data, contract_index = extract_tenant(tenant, skip_epg_names)
+    oci_dict = oci.export_to_oci_format(tenant_data[0], tenant_data[3], tenant_data[5], False, skip_epg_names,
+                                        contract_index)
+    oci.optimize_nsg_rules(oci_dict)
+    original = copy.deepcopy(oci_dict)
+    nsg_over_allowed_rules = int(max(len(resources['resources']) for resources in oci_dict.values()) * limit_ratio)
+
+    split_dict = oci.split_oversized_nsgs(oci_dict, nsg_over_allowed_rules)
+    assert oci_dict == original  # the rules given are not modified
+    split_names = {resources['split_from'] for resources in split_dict.values() if 'split_from' in resources}
+    assert len(split_names) != 0
+
+    # Back to the names before the split, the rules of the parts are the rules of the NSG
+    original_ids = {oci.get_oci_nsg_id(nsg_name + '-1'): oci.get_oci_nsg_id(nsg_name) for nsg_name in split_names}
+    nsg_ids = {oci.get_oci_nsg_id(nsg_name) for nsg_name in split_dict}
+    rules = {nsg_name: Counter() for nsg_name in original}
+    for nsg_name, resources in split_dict.items():
+        assert len(resources['resources']) < nsg_over_allowed_rules
+        for oci_rule in resources['resources']:
+            assert oci_rule['network_security_group_id'] == oci.get_oci_nsg_id(nsg_name)
+            peer = oci_rule[get_rule_peer(oci_rule)]
+            if peer.startswith('${'):
+                assert peer in nsg_ids
+            original_rule = dict(oci_rule)
+            original_rule['network_security_group_id'] = oci.get_oci_nsg_id(resources.get('split_from', nsg_name))
+            original_rule[get_rule_peer(oci_rule)] = original_ids.get(peer, peer)
+            rules[resources.get('split_from', nsg_name)][json.dumps(original_rule, sort_keys=True)] += 1
+
+    for nsg_name, resources in original.items():
+        assert rules[nsg_name] == Counter(json.dumps(oci_rule, sort_keys=True) for oci_rule in resources['resources'])
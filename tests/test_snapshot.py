@@ -0,0 +1,48 @@
+import pytest
+
+import modules.aci as aci
+import modules.snapshot as snapshot
+
+
+class Apic:
+    host = 'apic1'
+
+    def __init__(self, audit_records):
+        self.audit_records = audit_records
+        self.downloads = 0
+
+    def get(self, api_path):
+        return {'imdata': [{'aaaModLR': {'attributes': {'id': str(record), 'created': '2026-01-01'}}}
+                           for record in self.audit_records[:1]]}
+
+
+@pytest.fixture
+def apic(monkeypatch):
+    apic = Apic([])
+
+    def download_tenant(apic, tena, file_write):
+        apic.downloads += 1
+        file_write.write(b'{"imdata": []}')
+        return True
+
+    monkeypatch.setattr(aci, 'download_tenant', download_tenant)
+    return apic
+
+
+def test_snapshot_reused_while_the_audit_log_is_not_modified(tmp_path, apic):
+    store = snapshot.SnapshotStore(str(tmp_path))
+    apic.audit_records = [1]
+    store.get_tenant_snapshot(apic, 'T1')
+    store.get_tenant_snapshot(apic, 'T1')
+    assert apic.downloads == 1
+    apic.audit_records = [2, 1]
+    store.get_tenant_snapshot(apic, 'T1')
+    assert apic.downloads == 2
+
+
+def test_snapshot_downloaded_again_without_audit_log_records(tmp_path, apic):
+    # A purged audit log tells nothing about the changes of the tenant
+    store = snapshot.SnapshotStore(str(tmp_path))
+    store.get_tenant_snapshot(apic, 'T1')
+    store.get_tenant_snapshot(apic, 'T1')
+    assert apic.downloads == 2